@@ -45,5 +45,5 @@ setup(
 
     install_requires=['six'],
     setup_requires=['setuptools_scm', 'pytest-runner'],
-    tests_require=['pytest', 'coverage', 'cogapp'],
+    tests_require=['pytest', 'coverage'],
 )
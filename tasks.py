@@ -29,8 +29,11 @@ def travis_setpass():
 
 
 @task
-def cog():
+def bench(baseline='tests/bench_baseline.json', max_regression=0.25, repeat=3):
     """
-    Generate code using cog in the appropriate files.
+    Executes the benchmarks, comparing the results against the baseline.
     """
-    run("cog -r zerotk/reraiseit/_reraiseit.py")
+    run(
+        "python tests/bench_reraiseit.py --baseline {} --max-regression {} "
+        "--repeat {}".format(baseline, max_regression, repeat)
+    )
@@ -0,0 +1,1274 @@
+# coding=utf-8
+"""
+    Benchmarks for reraise.
+
+    Run with:
+        python tests/bench_reraiseit.py [--output results.json]
+            [--baseline tests/bench_baseline.json] [--max-regression 0.25]
+            [--repeat 3]
+
+    Every metric is "lower is better" (times, sizes). When a baseline is
+    given, the run fails (exit code 1) if any metric is worse than the
+    baseline by more than --max-regression (a fraction: 0.25 means 25%).
+
+    Each timing is the best of several repetitions and each metric the
+    median of --repeat runs. Timings are compared relative to the time of a
+    calibration loop timed before each benchmark, so a slower machine
+    doesn't fail the comparison. The baseline is only regenerated (with
+    --save-baseline) on purpose, never along with the changes it measures.
+"""
+from __future__ import unicode_literals, print_function
+
+import argparse
+import gc
+import json
+import platform
+import re
+import sys
+import threading
+import timeit
+import traceback
+
+import six
+
+from zerotk.reraiseit import (
+    FailureAggregator,
+    ReraiseFilter,
+    ReraiseStats,
+    add_observer,
+    configure,
+    context_boundary,
+    dumps_exceptions,
+    exception_to_unicode,
+    format_exception,
+    loads_exceptions,
+    push_context,
+    release_traceback,
+    remove_observer,
+    reraise_iter,
+    retrying,
+    start_profiling,
+    stop_profiling,
+    reraise,
+    reraising,
+    reraising_call,
+)
+from zerotk.reraiseit import shared as shared_exception
+from zerotk.reraiseit import _reraiseit
+
+_BENCHMARKS = []
+
+# Metrics measuring time: "depth.10.per_layer_us", "ambient.push.ns", ...
+_TIMING_METRIC = re.compile(r'(^|[._])(us|ns)($|[._])')
+
+
+def benchmark(function):
+    """
+    Registers a benchmark.
+
+    A benchmark returns a dict mapping metric names to values, where lower
+    values are better.
+    """
+    _BENCHMARKS.append(function)
+    return function
+
+
+def best_time(function, number, repeat=5):
+    """
+    :return float:
+        Best time, in seconds, of a single call of `function`.
+    """
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def annotate(
+        depth, exception=None, message='While handling layer', messages=None
+):
+    """
+    Reraises an exception `depth` times, the same as an exception passing
+    through `depth` handlers.
+
+    :param list(unicode)|None messages:
+        The message of each layer, instead of `message` for all of them
+        (which are collapsed into a single layer).
+    """
+    if exception is None:
+        exception = RuntimeError('original message')
+    exception_class = type(exception)
+    for i in range(depth):
+        try:
+            try:
+                raise exception
+            except exception_class as e:
+                reraise(e, message if messages is None else messages[i])
+        except exception_class as e:
+            exception = e
+    return exception
+
+
+def make_syntax_error():
+    try:
+        compile('in valid syntax', '<string>', 'exec')
+    except SyntaxError as e:
+        return e
+
+
+def make_unicode_decode_error():
+    try:
+        b'\xc2'.decode('ascii')
+    except UnicodeDecodeError as e:
+        return e
+
+
+EXCEPTION_FAMILIES = [
+    ('plain', lambda: RuntimeError('original message')),
+    ('key_error', lambda: KeyError('key')),
+    ('os_error', lambda: OSError(2, 'No such file or directory', 'path')),
+    ('syntax_error', make_syntax_error),
+    ('unicode_decode_error', make_unicode_decode_error),
+    ('non_ascii', lambda: RuntimeError('исключение £ ' * 10)),
+]
+
+
+@benchmark
+def bench_depth(depths=(1, 10, 100, 1000)):
+    """
+    Time per layer when reraising with increasing depth.
+
+    The cost per layer should stay flat as the depth grows.
+    """
+    results = {}
+    for depth in depths:
+        messages = [
+            'While handling layer {}'.format(i) for i in range(depth)
+        ]
+        number = max(1, 1000 // depth)
+        per_layer = best_time(
+            lambda: annotate(depth, messages=messages), number
+        ) / depth
+        results['depth.{}.per_layer_us'.format(depth)] = per_layer * 1e6
+    return results
+
+
+@benchmark
+def bench_exception_families(depth=3):
+    """
+    Time to annotate and render exceptions of different families.
+    """
+    results = {}
+    for name, factory in EXCEPTION_FAMILIES:
+
+        def annotate_and_render():
+            exception_to_unicode(annotate(depth, factory()))
+
+        results['family.{}.us'.format(name)] = \
+            best_time(annotate_and_render, 1000) * 1e6
+    return results
+
+
+@benchmark
+def bench_traceback_size(depth=10):
+    """
+    Size of the traceback of an exception annotated `depth` times.
+    """
+    exception = annotate(depth)
+    formatted = ''.join(
+        traceback.format_exception(
+            type(exception), exception, exception.__traceback__
+        )
+    )
+    entries = len(traceback.extract_tb(exception.__traceback__))
+    return {
+        'traceback.depth_{}.entries'.format(depth): entries,
+        'traceback.depth_{}.formatted_bytes'.format(depth):
+            len(formatted.encode('utf-8')),
+    }
+
+
+@benchmark
+def bench_retained_memory(count=1000, depth=10):
+    """
+    Memory retained by each stored annotated exception.
+    """
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        stored = [annotate(depth) for _i in range(count)]
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del stored
+    return {
+        'memory.depth_{}.bytes_per_exception'.format(depth):
+            float(after - before) / count,
+    }
+
+
+@benchmark
+def bench_exception_to_unicode():
+    """
+    Time of a single exception_to_unicode call.
+    """
+    results = {}
+    for name, factory in EXCEPTION_FAMILIES:
+        exception = factory()
+        results['exception_to_unicode.{}.ns'.format(name)] = best_time(
+            lambda: exception_to_unicode(exception), 10000
+        ) * 1e9
+    return results
+
+
+@benchmark
+def bench_backends(depth=10, count=200):
+    """
+    Time per layer and memory retained per exception by each annotation
+    backend.
+
+    Uses PermissionError, which the "args" backend replaces by a Reraised*
+    instance.
+    """
+    import tracemalloc
+
+    backends = ['args']
+    if hasattr(BaseException, 'add_note'):
+        backends.append('notes')
+
+    def factory():
+        return PermissionError(13, 'Permission denied', 'path')
+
+    results = {}
+    previous = _reraiseit._annotate
+    try:
+        for name in backends:
+            _reraiseit._annotate = _reraiseit._BACKENDS[name]
+            per_layer = best_time(lambda: annotate(depth, factory()), 100)
+            results['backend.{}.per_layer_us'.format(name)] = \
+                per_layer / depth * 1e6
+
+            gc.collect()
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                stored = [annotate(depth, factory()) for _i in range(count)]
+                after = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            del stored
+            results['backend.{}.bytes_per_exception'.format(name)] = \
+                float(after - before) / count
+    finally:
+        _reraiseit._annotate = previous
+    return results
+
+
+@benchmark
+def bench_reraising_success(number=100000):
+    """
+    Overhead of `reraising` and `reraising_call` when no exception is
+    raised, against a bare try/except and an unprotected call.
+    """
+
+    def work(value):
+        return value
+
+    def bare(value):
+        return work(value)
+
+    def try_except(value):
+        try:
+            return work(value)
+        except Exception as e:
+            reraise(e, 'While working on %s' % (value,))
+
+    scope = reraising('While working')
+
+    def context_manager(value):
+        with scope:
+            return work(value)
+
+    def context_manager_with_args(value):
+        with reraising('While working on %s', value):
+            return work(value)
+
+    decorated = reraising('While working')(work)
+    call_decorated = reraising_call()(work)
+
+    results = {}
+    for name, function in [
+        ('bare', bare),
+        ('try_except', try_except),
+        ('context_manager', context_manager),
+        ('context_manager_with_args', context_manager_with_args),
+        ('decorator', decorated),
+        ('call_decorator', call_decorated),
+        ('undecorated', work),
+    ]:
+        results['reraising.success.{}.ns'.format(name)] = \
+            best_time(lambda: function(1), number) * 1e9
+    return results
+
+
+@benchmark
+def bench_reraise_iter(items=100000):
+    """
+    Time per item of a loop over a generator: bare, with a try/except
+    calling `reraise` around each item and wrapped by `reraise_iter`.
+    """
+
+    def generate():
+        for i in range(items):
+            yield i
+
+    def work(item):
+        return item
+
+    def describe(index, item):
+        return 'While processing record %d' % index
+
+    def bare():
+        for item in generate():
+            work(item)
+
+    def try_except():
+        for index, item in enumerate(generate()):
+            try:
+                work(item)
+            except Exception as e:
+                reraise(e, 'While processing record %d', args=(index,))
+
+    def wrapped():
+        with reraise_iter(generate(), describe) as records:
+            for item in records:
+                work(item)
+
+    results = {}
+    for name, function in [
+        ('bare', bare),
+        ('try_except', try_except),
+        ('reraise_iter', wrapped),
+    ]:
+        results['reraise_iter.{}.ns_per_item'.format(name)] = \
+            best_time(function, 1) / items * 1e9
+    return results
+
+
+def fail_record(index):
+    try:
+        fail_nested(5)
+    except RuntimeError as e:
+        reraise(e, 'While storing record %d', args=(index,))
+
+
+@benchmark
+def bench_failure_aggregator(counts=(1000, 10000)):
+    """
+    Memory retained by the failures of a batch of `count` records, all
+    failing: stored in a list or collected by a `FailureAggregator`. Also
+    the time per failure collected.
+    """
+    import tracemalloc
+
+    results = {}
+    for count in counts:
+        for name in ('list', 'aggregator'):
+            gc.collect()
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                failures = [] if name == 'list' else FailureAggregator()
+                for index in range(count):
+                    try:
+                        fail_record(index)
+                    except RuntimeError as e:
+                        if name == 'list':
+                            failures.append(e)
+                        else:
+                            failures.add(e)
+                gc.collect()
+                after = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            del failures
+            results['aggregator.{}.{}.retained_kb'.format(name, count)] = \
+                (after - before) / 1024.0
+
+    failures = FailureAggregator()
+    try:
+        fail_record(0)
+    except RuntimeError as e:
+        exception = e
+    results['aggregator.add.us'] = best_time(
+        lambda: failures.add(exception), 10000
+    ) * 1e6
+    return results
+
+
+@benchmark
+def bench_retrying(attempts=1000):
+    """
+    Memory retained per failed attempt by `retrying` (with the last
+    exception) and time per attempt.
+    """
+    import tracemalloc
+
+    def fail():
+        fail_nested(5)
+
+    retry = retrying(attempts=attempts, delay=0, sleep=lambda delay: None)
+    results = {}
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            retry.call(fail)
+        except RuntimeError as e:
+            exception = e
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del exception
+    results['retrying.bytes_per_attempt'] = float(after - before) / attempts
+
+    retry = retrying(attempts=100, delay=0, sleep=lambda delay: None)
+
+    def retry_call():
+        try:
+            retry.call(fail)
+        except RuntimeError:
+            pass
+
+    results['retrying.us_per_attempt'] = best_time(retry_call, 10) / 100 * 1e6
+    return results
+
+
+@benchmark
+def bench_deferred_message(size=10000):
+    """
+    Cost of reraising (without showing the message) with a large payload,
+    formatting the message eagerly or deferring it.
+    """
+    payload = list(range(size))
+
+    def raise_and_catch(function):
+        try:
+            try:
+                raise RuntimeError('original message')
+            except RuntimeError as e:
+                function(e)
+        except RuntimeError:
+            pass
+
+    def eager(e):
+        reraise(e, 'While processing %r' % (payload,))
+
+    def deferred(e):
+        reraise(e, 'While processing %r', args=(payload,))
+
+    return {
+        'deferred_message.eager.us':
+            best_time(lambda: raise_and_catch(eager), 100) * 1e6,
+        'deferred_message.deferred.us':
+            best_time(lambda: raise_and_catch(deferred), 100) * 1e6,
+    }
+
+
+@benchmark
+def bench_huge_message(size=1024 * 1024, depth=10, count=20):
+    """
+    Memory retained by exceptions with a huge message after being reraised
+    and rendered.
+    """
+    import tracemalloc
+
+    def annotate_and_render():
+        exception = annotate(depth, RuntimeError('x' * size))
+        exception_to_unicode(exception)
+        return exception
+
+    results = {}
+    previous = _reraiseit._annotate
+    try:
+        for name in sorted(_reraiseit._BACKENDS):
+            if name == 'notes' and not hasattr(BaseException, 'add_note'):
+                continue
+            _reraiseit._annotate = _reraiseit._BACKENDS[name]
+            gc.collect()
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                stored = [annotate_and_render() for _i in range(count)]
+                after = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            del stored
+            results['huge_message.{}.bytes_per_exception'.format(name)] = \
+                float(after - before) / count
+    finally:
+        _reraiseit._annotate = previous
+    return results
+
+
+def fail_with_locals(depth, size):
+    """
+    Raises an exception `depth` calls deep, each frame holding a local of
+    about `size` bytes and reraising it.
+    """
+    payload = bytearray(size)
+    if depth == 0:
+        raise RuntimeError('original message')
+    try:
+        fail_with_locals(depth - 1, size)
+    except RuntimeError as e:
+        # Only the size is kept in the message: the payload itself is only
+        # kept alive by the frame.
+        reraise(
+            e, 'While failing at depth %d (%d bytes)',
+            args=(depth, len(payload)),
+        )
+
+
+@benchmark
+def bench_retry_storm(depths=(10, 1000, 10000)):
+    """
+    Time per layer and memory retained when reraising with the same message
+    (collapsed into a single layer) and with a different message per layer
+    (limited by the "max_layers" setting).
+
+    Both should stay flat as the depth grows.
+    """
+    import tracemalloc
+
+    def annotate_distinct(depth):
+        exception = RuntimeError('original message')
+        for i in range(depth):
+            try:
+                try:
+                    raise exception
+                except RuntimeError as e:
+                    reraise(e, 'While handling layer %d', args=(i,))
+            except RuntimeError as e:
+                exception = e
+        return exception
+
+    results = {}
+    for name, function in [
+        ('repeated', lambda depth: annotate(depth, message='While retrying')),
+        ('distinct', annotate_distinct),
+    ]:
+        for depth in depths:
+            per_layer = best_time(lambda: function(depth), 1) / depth
+            results['storm.{}.{}.per_layer_us'.format(name, depth)] = \
+                per_layer * 1e6
+
+            gc.collect()
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                exception = function(depth)
+                # Only the context: the traceback grows on every raise.
+                exception.__traceback__ = None
+                gc.collect()
+                after = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            del exception
+            results['storm.{}.{}.bytes'.format(name, depth)] = \
+                float(after - before)
+    return results
+
+
+@benchmark
+def bench_retention(depth=10, size=10000, count=100):
+    """
+    Memory retained per stored exception under each traceback retention
+    policy, applied by reraise or by release_traceback.
+    """
+    import tracemalloc
+
+    def catch():
+        try:
+            fail_with_locals(depth, size)
+        except RuntimeError as e:
+            return e
+
+    results = {}
+    for policy in ('full', 'clear_locals', 'summary'):
+        for mode in ('reraise', 'release_traceback'):
+            previous = configure(
+                traceback_retention=policy if mode == 'reraise' else 'full'
+            )
+            try:
+                gc.collect()
+                tracemalloc.start()
+                try:
+                    before = tracemalloc.get_traced_memory()[0]
+                    if mode == 'reraise':
+                        stored = [catch() for _i in range(count)]
+                    else:
+                        stored = [
+                            release_traceback(catch(), policy)
+                            for _i in range(count)
+                        ]
+                    gc.collect()
+                    after = tracemalloc.get_traced_memory()[0]
+                finally:
+                    tracemalloc.stop()
+                del stored
+            finally:
+                configure(**previous)
+            name = 'retention.{}.{}.bytes_per_exception'.format(mode, policy)
+            results[name] = float(after - before) / count
+    return results
+
+
+@benchmark
+def bench_async_success(tasks=1000, awaits=10):
+    """
+    Time per task of coroutines awaiting `awaits` times in an event loop busy
+    with `tasks` tasks, annotated in different ways (none failing).
+    """
+    import asyncio
+
+    async def work():
+        for _i in range(awaits):
+            await asyncio.sleep(0)
+
+    async def try_except():
+        try:
+            await work()
+        except Exception as e:
+            reraise(e, 'While working')
+
+    async def context_manager():
+        async with reraising('While working'):
+            await work()
+
+    decorated = reraising('While working')(work)
+
+    def wrapped():
+        return reraising('While working').wrap(work())
+
+    def run_all(factory):
+
+        async def main():
+            await asyncio.gather(*[factory() for _i in range(tasks)])
+
+        asyncio.run(main())
+
+    results = {}
+    for name, factory in [
+        ('bare', work),
+        ('try_except', try_except),
+        ('context_manager', context_manager),
+        ('decorator', decorated),
+        ('wrap', wrapped),
+    ]:
+        results['async.success.{}.us_per_task'.format(name)] = \
+            best_time(lambda: run_all(factory), 1, repeat=3) / tasks * 1e6
+    return results
+
+
+@benchmark
+def bench_exception_groups(members=5000, depth=10):
+    """
+    Time per layer reraising an exception group with many members, with and
+    without a per member message.
+    """
+    if not hasattr(BaseException, 'add_note'):
+        return {}
+
+    def make_group():
+        return ExceptionGroup(
+            'batch failed', [KeyError(i) for i in range(members)]
+        )
+
+    def annotate_group(exception, **kwargs):
+        for i in range(depth):
+            try:
+                try:
+                    raise exception
+                except ExceptionGroup as e:
+                    reraise(e, 'While handling layer', **kwargs)
+            except ExceptionGroup as e:
+                exception = e
+
+    def time_per_layer(**kwargs):
+        # The groups are built beforehand: creating the members takes longer
+        # than annotating them.
+        groups = [make_group() for _i in range(5)]
+        return best_time(
+            lambda: annotate_group(groups.pop(), **kwargs),
+            1,
+            repeat=len(groups),
+        ) / depth * 1e6
+
+    return {
+        'groups.group_message.per_layer_us': time_per_layer(),
+        'groups.member_message.per_layer_us':
+            time_per_layer(member_message='While processing member'),
+    }
+
+
+@benchmark
+def bench_ambient_context(number=100000, depth=10):
+    """
+    Cost of pushing a message on the ambient context when no exception is
+    raised and of attaching `depth` pushed messages when one is.
+    """
+    scope = context_boundary()
+
+    def push():
+        with push_context('While processing %s', 'path'):
+            pass
+
+    def push_and_fail(level):
+        with push_context('While processing level %d', level):
+            if level == depth:
+                raise RuntimeError('original message')
+            push_and_fail(level + 1)
+
+    def enter_boundary():
+        with scope:
+            pass
+
+    def fail_at_boundary():
+        try:
+            with scope:
+                push_and_fail(1)
+        except RuntimeError:
+            pass
+
+    def fail_without_context():
+        try:
+            with scope:
+                raise RuntimeError('original message')
+        except RuntimeError:
+            pass
+
+    return {
+        'ambient.push.ns': best_time(push, number) * 1e9,
+        'ambient.boundary_success.ns': best_time(enter_boundary, number) * 1e9,
+        'ambient.failure.{}.us'.format(depth):
+            best_time(fail_at_boundary, 1000) * 1e6,
+        'ambient.failure_without_context.us':
+            best_time(fail_without_context, 1000) * 1e6,
+    }
+
+
+@benchmark
+def bench_fields(depth=10):
+    """
+    Time per layer adding structured fields and time to render them.
+    """
+
+    def annotate_with_fields():
+        exception = RuntimeError('original message')
+        for i in range(depth):
+            try:
+                try:
+                    raise exception
+                except RuntimeError as e:
+                    reraise(
+                        e, 'While loading', fields={'shard': i, 'path': 'path'}
+                    )
+            except RuntimeError as e:
+                exception = e
+        return exception
+
+    return {
+        'fields.per_layer_us':
+            best_time(annotate_with_fields, 100) / depth * 1e6,
+        'fields.render_us':
+            best_time(
+                lambda: exception_to_unicode(annotate_with_fields()), 100
+            ) * 1e6,
+    }
+
+
+@benchmark
+def bench_observers(depth=10):
+    """
+    Time per layer without observers and with `ReraiseStats` observing all
+    or a sample of the annotations.
+    """
+    results = {
+        'observers.none.per_layer_us':
+            best_time(lambda: annotate(depth), 100) / depth * 1e6,
+    }
+    stats = ReraiseStats()
+    add_observer(stats)
+    try:
+        for rate in (1.0, 0.1):
+            previous = configure(observer_sample_rate=rate)
+            try:
+                per_layer = best_time(lambda: annotate(depth), 100) / depth
+            finally:
+                configure(**previous)
+            results['observers.stats.rate_{}.per_layer_us'.format(rate)] = \
+                per_layer * 1e6
+    finally:
+        remove_observer(stats)
+    return results
+
+
+def wait_shared(exception, count, shared):
+    for _i in range(count):
+        try:
+            try:
+                raise exception
+            except RuntimeError as e:
+                reraise(shared_exception(e) if shared else e, 'While waiting')
+        except RuntimeError:
+            pass
+
+
+@benchmark
+def bench_shared(depth=10, threads=16, count=2000):
+    """
+    Time per `reraise` of an exception (annotated `depth` times) shared by
+    `threads` threads, each reraising it `count` times as `shared`,
+    against reraising an exception per thread in place. Also the memory
+    retained by each overlay.
+    """
+    exception = annotate(depth)
+    exception.__traceback__ = None
+
+    def run(shared):
+        workers = [
+            threading.Thread(
+                target=wait_shared,
+                args=(
+                    exception if shared else annotate(depth),
+                    count,
+                    shared,
+                ),
+            )
+            for _i in range(threads)
+        ]
+        start = timeit.default_timer()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return (timeit.default_timer() - start) / (threads * count)
+
+    results = {}
+    for name, shared in [('in_place', False), ('overlay', True)]:
+        results['shared.{}.{}_threads.us'.format(name, threads)] = min(
+            run(shared) for _i in range(3)
+        ) * 1e6
+
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        overlays = []
+        for _i in range(count):
+            try:
+                try:
+                    raise exception
+                except RuntimeError as e:
+                    reraise(shared_exception(e), 'While waiting')
+            except RuntimeError as e:
+                e.__traceback__ = None
+                overlays.append(e)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del overlays
+    results['shared.overlay.bytes'] = float(after - before) / count
+    return results
+
+
+class ScalingError(Exception):
+    """
+    Not a builtin: its Reraised* class is looked up in the weak registry.
+    """
+
+
+def reraise_and_format(count):
+    for i in range(count):
+        try:
+            try:
+                raise ScalingError('original message')
+            except ScalingError as e:
+                reraise(e, 'While handling item %d', args=(i,))
+        except ScalingError as e:
+            exception_to_unicode(e)
+
+
+@benchmark
+def bench_thread_scaling(thread_counts=(1, 2, 4, 8, 16, 32, 64), count=500):
+    """
+    Wall time per operation (`reraise` and `exception_to_unicode` of the
+    result) with 1 to 64 threads doing `count` operations each, and the
+    cost of scaling: the single thread throughput times the number of
+    threads that could run in parallel (1 with the GIL, up to the number of
+    CPUs on free-threaded builds) divided by the throughput obtained.
+
+    A cost of 1.0 is linear scaling.
+    """
+    import multiprocessing
+
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)
+    parallel = 1 if is_gil_enabled() else multiprocessing.cpu_count()
+
+    def run(threads):
+        workers = [
+            threading.Thread(target=reraise_and_format, args=(count,))
+            for _i in range(threads)
+        ]
+        start = timeit.default_timer()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return (timeit.default_timer() - start) / (threads * count)
+
+    reraise_and_format(count)
+    results = {}
+    single = None
+    for threads in thread_counts:
+        per_operation = min(run(threads) for _i in range(3))
+        if single is None:
+            single = per_operation
+        results['scaling.{}_threads.us_per_op'.format(threads)] = \
+            per_operation * 1e6
+        results['scaling.{}_threads.cost'.format(threads)] = \
+            per_operation * min(threads, parallel) / single
+    return results
+
+
+@benchmark
+def bench_profiler(depth=10):
+    """
+    Time per layer while profiling (see ZEROTK_RERAISEIT_PROFILE).
+    """
+    start_profiling()
+    try:
+        per_layer = best_time(lambda: annotate(depth), 100) / depth
+    finally:
+        stop_profiling()
+    return {'profiler.per_layer_us': per_layer * 1e6}
+
+
+def fail_nested(depth):
+    if depth:
+        fail_nested(depth - 1)
+    raise RuntimeError('original message')
+
+
+@benchmark
+def bench_format_exception(depth=10, frames=20):
+    """
+    Time to format an exception annotated `depth` times with a traceback of
+    about `frames` entries: `format_exception` (with and without source
+    lines) against `traceback.format_exception`.
+    """
+    try:
+        fail_nested(frames)
+    except RuntimeError as e:
+        exception = annotate(depth, e)
+
+    def format_with_traceback():
+        traceback.format_exception(
+            type(exception), exception, exception.__traceback__
+        )
+
+    return {
+        'format.traceback_module.us':
+            best_time(format_with_traceback, 200) * 1e6,
+        'format.format_exception.us':
+            best_time(lambda: format_exception(exception), 200) * 1e6,
+        'format.format_exception_no_source.us':
+            best_time(
+                lambda: format_exception(exception, source=False), 200
+            ) * 1e6,
+    }
+
+
+@benchmark
+def bench_logging_enqueue(depth=10, frames=20):
+    """
+    Time to log an annotated exception through a `QueueHandler`, with and
+    without `ReraiseFilter` (which releases the exception before queuing).
+    """
+    if sys.version_info < (3, 2):
+        return {}
+    import logging
+    from logging.handlers import QueueHandler
+    from six.moves import queue
+
+    try:
+        fail_nested(frames)
+    except RuntimeError as e:
+        exception = annotate(depth, e)
+    exc_info = (type(exception), exception, exception.__traceback__)
+
+    logger = logging.getLogger('bench_reraiseit')
+    logger.propagate = False
+    results = {}
+    cases = [('plain', []), ('reraise_filter', [ReraiseFilter()])]
+    for name, filters in cases:
+        records = queue.Queue()
+        handler = QueueHandler(records)
+        for filter_ in filters:
+            handler.addFilter(filter_)
+        logger.addHandler(handler)
+        try:
+            results['logging.enqueue.{}.us'.format(name)] = best_time(
+                lambda: logger.error('Job failed', exc_info=exc_info), 200
+            ) * 1e6
+        finally:
+            logger.removeHandler(handler)
+    return results
+
+
+@benchmark
+def bench_wire_format(batch=100, depth=5, frames=20):
+    """
+    Size and time per exception of a batch of `batch` annotated exceptions
+    written with `dumps_exceptions`, against sending their text (message
+    and `traceback.format_exception`).
+    """
+    exceptions = []
+    for i in range(batch):
+        try:
+            fail_nested(frames)
+        except RuntimeError as e:
+            exceptions.append(
+                annotate(depth, e, 'While processing item %s' % i)
+            )
+
+    def as_text():
+        return ''.join(
+            six.text_type(exception) + ''.join(
+                traceback.format_exception(
+                    type(exception), exception, exception.__traceback__
+                )
+            )
+            for exception in exceptions
+        ).encode('utf-8')
+
+    dumped = dumps_exceptions(exceptions)
+    return {
+        'wire.text.bytes_per_exception': float(len(as_text())) / batch,
+        'wire.dumps.bytes_per_exception': float(len(dumped)) / batch,
+        'wire.text.us_per_exception': best_time(as_text, 5) / batch * 1e6,
+        'wire.dumps.us_per_exception':
+            best_time(lambda: dumps_exceptions(exceptions), 5) / batch * 1e6,
+        'wire.loads.us_per_exception':
+            best_time(lambda: loads_exceptions(dumped), 5) / batch * 1e6,
+    }
+
+
+@benchmark
+def bench_pickling(depths=(10, 100, 1000)):
+    """
+    Size and time to pickle exceptions annotated with increasing depth, as
+    done to send them back from process pool workers.
+    """
+    import pickle
+
+    results = {}
+    for depth in depths:
+        exception = annotate(depth, KeyError('key'))
+        dumped = pickle.dumps(exception, pickle.HIGHEST_PROTOCOL)
+        number = max(1, 10000 // depth)
+        results['pickle.{}.bytes'.format(depth)] = float(len(dumped))
+        results['pickle.{}.dumps_us'.format(depth)] = best_time(
+            lambda: pickle.dumps(exception, pickle.HIGHEST_PROTOCOL), number
+        ) * 1e6
+        results['pickle.{}.loads_us'.format(depth)] = \
+            best_time(lambda: pickle.loads(dumped), number) * 1e6
+    return results
+
+
+def fail_in_worker(depth):
+    raise annotate(depth, KeyError('key'))
+
+
+@benchmark
+def bench_process_pool(depths=(0, 100), tasks=100):
+    """
+    Time per task of a process pool whose tasks fail with an exception
+    annotated `depth` times.
+    """
+    if sys.version_info < (3,):
+        return {}
+    from concurrent.futures import ProcessPoolExecutor
+
+    def run_tasks(executor, depth):
+        for future in [
+            executor.submit(fail_in_worker, depth) for _i in range(tasks)
+        ]:
+            assert isinstance(future.exception(), KeyError)
+
+    results = {}
+    with ProcessPoolExecutor(1) as executor:
+        run_tasks(executor, 1)
+        for depth in depths:
+            results['pool.{}.us_per_task'.format(depth)] = best_time(
+                lambda: run_tasks(executor, depth), 1, repeat=3
+            ) / tasks * 1e6
+    return results
+
+
+def calibration_loop():
+    """
+    A fixed workload, independent from reraise, timed to compare timings
+    taken on different machines (or the same one under different loads).
+    """
+    for i in range(100):
+        try:
+            raise KeyError(i)
+        except KeyError as e:
+            '{}: {!r}'.format(type(e).__name__, e.args)
+
+
+def run(selected=None, repeat=1):
+    """
+    Runs the registered benchmarks.
+
+    :param list(unicode) selected:
+        Names of the benchmarks to run, all if None.
+
+    :param int repeat:
+        Number of runs: the median of each metric is kept.
+
+    :return dict:
+        JSON compatible results, with:
+            * "metrics": the value of each metric;
+            * "calibration_us": the time of `calibration_loop`;
+            * "relative": the timings, as a multiple of "calibration_us".
+    """
+    runs = []
+    calibrations = []
+    for _i in range(repeat):
+        metrics = {}
+        for function in _BENCHMARKS:
+            if selected and function.__name__ not in selected:
+                continue
+            # Sampled all along the runs, as the speed of the machine may
+            # change while they run.
+            calibrations.append(best_time(calibration_loop, 100))
+            metrics.update(function())
+        runs.append(metrics)
+    metrics = {
+        name: median([metrics[name] for metrics in runs]) for name in runs[0]
+    }
+    calibration = median(calibrations)
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'metrics': metrics,
+        'calibration_us': calibration * 1e6,
+        'relative': {
+            name: value / (calibration * _unit(name))
+            for name, value in metrics.items()
+            if _TIMING_METRIC.search(name)
+        },
+    }
+
+
+def _unit(name):
+    """
+    :return float:
+        The number of units per second of a timing metric.
+    """
+    if _TIMING_METRIC.search(name).group(2) == 'ns':
+        return 1e9
+    return 1e6
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def compare(results, baseline, max_regression):
+    """
+    Compares results against a baseline.
+
+    Timings are compared relative to the calibration (see `run`), when the
+    baseline has them.
+
+    :return list(unicode):
+        Description of each metric that regressed more than `max_regression`.
+    """
+    base_relative = baseline.get('relative', {})
+    regressions = []
+    for name, base_value in sorted(baseline['metrics'].items()):
+        value = results['metrics'].get(name)
+        if value is None or base_value <= 0:
+            continue
+        if name in base_relative and name in results['relative']:
+            change = results['relative'][name] / base_relative[name] - 1
+        else:
+            change = (value - base_value) / base_value
+        if change > max_regression:
+            regressions.append(
+                '{}: {:.3f} -> {:.3f} (+{:.0%})'.format(
+                    name, base_value, value, change
+                )
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for reraise.')
+    parser.add_argument(
+        'benchmarks', nargs='*',
+        help='Names of the benchmarks to run (default: all).')
+    parser.add_argument(
+        '--output', help='Write the results as JSON to this file.')
+    parser.add_argument(
+        '--baseline', help='Compare the results against this JSON file.')
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='Write the results to the --baseline file instead of comparing.')
+    parser.add_argument(
+        '--max-regression', type=float, default=0.25,
+        help='Allowed regression as a fraction of the baseline value.')
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Number of runs, keeping the median of each metric.')
+    options = parser.parse_args(argv)
+
+    results = run(options.benchmarks, options.repeat)
+    for name, value in sorted(results['metrics'].items()):
+        print('{:60s} {:12.3f}'.format(name, value))
+
+    if options.output:
+        with open(options.output, 'w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+
+    if options.baseline and options.save_baseline:
+        with open(options.baseline, 'w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+    elif options.baseline:
+        with open(options.baseline) as stream:
+            baseline = json.load(stream)
+        regressions = compare(results, baseline, options.max_regression)
+        if regressions:
+            print('\nRegressions against {}:'.format(options.baseline))
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+# coding=utf-8
+from __future__ import unicode_literals
+"""
+    Helpers shared by the tests.
+"""
+import traceback
+import weakref
+
+
+def format_exception(exception):
+    """
+    :return unicode:
+        The last lines shown by a traceback: the exception's type and
+        message, followed by its notes.
+    """
+    return ''.join(traceback.format_exception_only(type(exception), exception))
+
+
+class Payload(object):
+    """
+    An object kept alive only by the frames of a failure.
+    """
+
+
+def make_payload(payload_refs):
+    """
+    Creates a `Payload`, to be kept as a local of the caller's frame: its
+    weak reference tells whether the frame was released.
+
+    :param list(weakref.ref) payload_refs:
+        Gets a weak reference to the payload.
+
+    :return Payload:
+    """
+    payload = Payload()
+    payload_refs.append(weakref.ref(payload))
+    return payload
@@ -0,0 +1,106 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import gc
+
+import pytest
+
+from zerotk.reraiseit import (
+    FailureAggregator,
+    format_exception,
+    get_context,
+    reraise,
+)
+from zerotk.reraiseit import _groups
+
+from reraise_helpers import make_payload
+
+
+def store(index, payload):
+    try:
+        if index % 3:
+            raise KeyError(index)
+        raise ValueError('invalid record')
+    except Exception as e:
+        reraise(e, 'While storing record %d', args=(index,))
+
+
+def store_all(failures, count):
+    payload_refs = []
+    for index in range(count):
+        with failures:
+            store(index, make_payload(payload_refs))
+    return payload_refs
+
+
+def testFailureAggregator():
+    failures = FailureAggregator(max_examples=2)
+    payload_refs = store_all(failures, 30)
+    gc.collect()
+
+    assert failures.count == 30
+    assert failures.counts() == {
+        'failures': 30,
+        'types': {'KeyError': 20, 'ValueError': 10},
+        'messages': {'While storing record %d': 30},
+    }
+    # The "args" backend raises Reraised* subclasses of some types.
+    first, second = failures.examples
+    assert isinstance(first, ValueError)
+    assert isinstance(second, KeyError)
+    # Only the examples (and their tracebacks) are kept.
+    assert [ref() is not None for ref in payload_refs] == (
+        [True, True] + [False] * 28
+    )
+    assert failures.summary() == (
+        '30 failures (KeyError: 20, ValueError: 10), showing 2'
+    )
+
+    with pytest.raises(ValueError) as e:
+        failures.raise_if_failed('While storing records')
+    text = format_exception(e.value)
+    assert (
+        'While storing records: 30 failures (KeyError: 20, ValueError: 10), '
+        'showing 2 (failures=30)\n'
+        'While storing record 0\n'
+    ) in text
+    assert get_context(e.value) == {'failures': 30}
+
+
+def testFailureAggregatorWithoutFailures():
+    failures = FailureAggregator()
+    store_all(failures, 0)
+    failures.raise_if_failed('While storing records')
+    assert failures.summary() == '0 failures (), showing 0'
+
+    # Only exceptions are collected.
+    with pytest.raises(KeyboardInterrupt):
+        with failures:
+            raise KeyboardInterrupt()
+    assert failures.count == 0
+
+
+def testFailureAggregatorMaxGroups():
+    failures = FailureAggregator(max_groups=2)
+    for exception_type in [KeyError, ValueError, IOError, TypeError]:
+        with failures:
+            raise exception_type()
+    assert failures.counts()['types'] == {
+        'KeyError': 1, 'ValueError': 1, '<other>': 2
+    }
+
+
+@pytest.mark.skipif(
+    _groups.BaseExceptionGroup is None,
+    reason='Exception groups require Python 3.11',
+)
+def testFailureAggregatorGroup():
+    failures = FailureAggregator(max_examples=3)
+    store_all(failures, 10)
+    with pytest.raises(_groups.BaseExceptionGroup) as e:
+        failures.raise_if_failed('While storing records', group=True)
+    assert e.value.message == (
+        'While storing records: 10 failures (KeyError: 6, ValueError: 4), '
+        'showing 3'
+    )
+    assert e.value.exceptions == tuple(failures.examples)
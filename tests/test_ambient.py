@@ -0,0 +1,175 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+import sys
+import threading
+
+from zerotk.reraiseit import (
+    context_boundary,
+    push_context,
+    reraise,
+    reraising,
+)
+
+from reraise_helpers import format_exception
+
+
+def process(paths, failing):
+    for path in paths:
+        with push_context('While processing %s', path):
+            if path == failing:
+                raise KeyError(path)
+
+
+def testContextBoundary():
+
+    @context_boundary()
+    def handle(request, failing):
+        with push_context('While handling request %d', request):
+            process(['a.txt', 'b.txt'], failing)
+
+    handle(1, None)
+    with pytest.raises(KeyError) as e:
+        handle(1, 'b.txt')
+
+    text = format_exception(e.value)
+    assert 'While handling request 1\nWhile processing b.txt' in text
+    assert 'a.txt' not in text
+    assert 'reraised_pending_context' not in e.value.__dict__
+
+
+def testPushContextFormatsOnlyOnFailure():
+    calls = []
+
+    class Expensive(object):
+        def __str__(self):
+            calls.append(None)
+            return 'expensive'
+
+    with context_boundary():
+        for _i in range(3):
+            with push_context('While processing %s', Expensive()):
+                pass
+    assert calls == []
+
+    with pytest.raises(RuntimeError) as e:
+        with context_boundary():
+            with push_context('While processing %s', Expensive()):
+                raise RuntimeError('error')
+    assert 'While processing expensive' in format_exception(e.value)
+    assert len(calls) == 1
+
+
+def testContextBoundaryWithoutContext():
+    with pytest.raises(KeyError) as e:
+        with context_boundary():
+            raise KeyError('key')
+    assert not hasattr(e.value, 'reraised_message')
+
+    # Only the context pushed inside the boundary is attached.
+    with pytest.raises(KeyError) as e:
+        with push_context('Outside'):
+            with context_boundary():
+                with push_context('Inside'):
+                    raise KeyError('key')
+    text = format_exception(e.value)
+    assert 'Inside' in text
+    assert 'Outside' not in text
+
+
+def testPushContextWithReraise():
+    with pytest.raises(KeyError) as e:
+        with context_boundary():
+            with push_context('While handling request'):
+                try:
+                    with push_context('While processing %s', 'a.txt'):
+                        raise KeyError('key')
+                except KeyError as e1:
+                    reraise(e1, 'While loading')
+    text = format_exception(e.value)
+    assert (
+        'While handling request\nWhile loading\nWhile processing a.txt'
+        in text
+    )
+
+    with pytest.raises(KeyError) as e:
+        with reraising('While running'):
+            with push_context('While processing %s', 'a.txt'):
+                raise KeyError('key')
+    assert 'While running\nWhile processing a.txt' in format_exception(e.value)
+
+
+def testPushContextIgnoresStaleContext():
+    with pytest.raises(KeyError) as e:
+        with push_context('While processing a.txt'):
+            raise KeyError('key')
+    stored = e.value
+
+    with pytest.raises(KeyError) as e:
+        with context_boundary():
+            with push_context('While retrying'):
+                raise stored
+    text = format_exception(e.value)
+    assert 'While retrying' in text
+    assert 'a.txt' not in text
+
+
+def testPushContextPerThread():
+    barrier = threading.Barrier(4)
+    errors = {}
+
+    @context_boundary()
+    def handle(request):
+        with push_context('While handling request %d', request):
+            barrier.wait()
+            raise KeyError(request)
+
+    def run(request):
+        try:
+            handle(request)
+        except KeyError as e:
+            errors[request] = format_exception(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(errors) == [0, 1, 2, 3]
+    for request, text in errors.items():
+        assert text.count('While handling request') == 1
+        assert 'While handling request %d' % request in text
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 7), reason='asyncio.run requires Python 3.7'
+)
+def testPushContextPerTask():
+    import asyncio
+
+    @context_boundary()
+    async def handle(request):
+        with push_context('While handling request %d', request):
+            await asyncio.sleep(0)
+            raise KeyError(request)
+
+    async def main():
+        return await asyncio.gather(
+            *[handle(i) for i in range(4)], return_exceptions=True
+        )
+
+    for request, error in enumerate(asyncio.run(main())):
+        text = format_exception(error)
+        assert text.count('While handling request') == 1
+        assert 'While handling request %d' % request in text
+
+
+def testPendingContextIsNotPickled():
+    from six.moves.cPickle import dumps, loads
+
+    with pytest.raises(KeyError) as e:
+        with push_context(lambda: 'While processing'):
+            raise KeyError('key')
+    assert loads(dumps(e.value)).reraised_pending_context is None
@@ -0,0 +1,216 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+import sys
+
+from zerotk.reraiseit import reraise_iter, reraising, reraising_call
+
+from reraise_helpers import format_exception
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 7), reason='asyncio.run requires Python 3.7'
+)
+
+
+def run(coroutine_function, *args):
+    import asyncio
+
+    return asyncio.run(coroutine_function(*args))
+
+
+async def fetch(shard):
+    import asyncio
+
+    await asyncio.sleep(0)
+    if shard < 0:
+        raise KeyError(shard)
+    return shard
+
+
+def testAsyncContextManager():
+
+    async def main():
+        async with reraising('While fetching shard %d', -1) as scope:
+            assert isinstance(scope, reraising)
+            await fetch(-1)
+
+    with pytest.raises(KeyError) as e:
+        run(main)
+    assert 'While fetching shard -1' in format_exception(e.value)
+
+
+def testCoroutineFunctionDecorator():
+
+    @reraising('While fetching')
+    async def decorated_fetch(shard):
+        return await fetch(shard)
+
+    import inspect
+    assert inspect.iscoroutinefunction(decorated_fetch)
+    assert run(decorated_fetch, 1) == 1
+    with pytest.raises(KeyError) as e:
+        run(decorated_fetch, -1)
+    assert 'While fetching' in format_exception(e.value)
+
+
+def testGather():
+    import asyncio
+
+    async def main():
+        async with reraising('While fetching shards'):
+            return await asyncio.gather(
+                *[
+                    reraising('While fetching shard %d', shard).wrap(
+                        fetch(shard)
+                    )
+                    for shard in (1, 2, -3)
+                ]
+            )
+
+    with pytest.raises(KeyError) as e:
+        run(main)
+    assert (
+        'While fetching shards\nWhile fetching shard -3' in
+        format_exception(e.value)
+    )
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 11), reason='TaskGroup requires Python 3.11'
+)
+def testTaskGroup():
+    import asyncio
+
+    async def main():
+        async with reraising('While fetching shards'):
+            async with asyncio.TaskGroup() as group:
+                for shard in (1, -2):
+                    group.create_task(
+                        reraising('While fetching shard %d', shard).wrap(
+                            fetch(shard)
+                        )
+                    )
+
+    with pytest.raises(ExceptionGroup) as e:
+        run(main)
+    assert 'While fetching shards' in format_exception(e.value)
+    [exception] = e.value.exceptions
+    assert isinstance(exception, KeyError)
+    assert 'While fetching shard -2' in format_exception(exception)
+
+
+def testCancelledIsNotAnnotated():
+    import asyncio
+
+    async def main():
+        task = asyncio.ensure_future(
+            reraising('While sleeping').wrap(asyncio.sleep(10))
+        )
+        await asyncio.sleep(0)
+        task.cancel()
+        await task
+
+    with pytest.raises(asyncio.CancelledError) as e:
+        run(main)
+    assert 'While sleeping' not in format_exception(e.value)
+
+
+async def fetch_all(count, fail_at=None):
+    for shard in range(count):
+        if shard == fail_at:
+            await fetch(-shard)
+        yield await fetch(shard)
+
+
+def describe(index, item):
+    return 'While storing shard {} ({!r})'.format(index, item)
+
+
+def testReraiseIterAsync():
+
+    async def store_all(fail_at, store_fail_at):
+        stored = []
+        async with reraise_iter(fetch_all(5, fail_at), describe) as shards:
+            async for shard in shards:
+                if shard == store_fail_at:
+                    raise ValueError('cannot store')
+                stored.append(shard)
+        return stored
+
+    assert run(store_all, None, None) == [0, 1, 2, 3, 4]
+
+    with pytest.raises(ValueError) as e:
+        run(store_all, None, 3)
+    assert 'While storing shard 3 (3)' in format_exception(e.value)
+
+    with pytest.raises(KeyError) as e:
+        run(store_all, 2, None)
+    text = format_exception(e.value)
+    assert 'While storing shard 2 (None)' in text
+    assert text.count('While storing') == 1
+
+
+def testReraiseIterAsyncBreak():
+
+    async def store_until(stop_at):
+        async with reraise_iter(fetch_all(5), describe) as shards:
+            async for shard in shards:
+                if shard == stop_at:
+                    break
+            raise ValueError('cannot commit')
+
+    # Exceptions after leaving the loop are not annotated.
+    with pytest.raises(ValueError) as e:
+        run(store_until, 3)
+    assert 'While storing' not in format_exception(e.value)
+
+
+def testReraiseIterAsyncReleasedLater():
+    import subprocess
+
+    # The iterator is kept by the traceback (with the consumer's frame) and
+    # released at exit, when no frame is running.
+    code = '\n'.join([
+        'import asyncio',
+        'import traceback',
+        'from zerotk.reraiseit import reraise_iter',
+        'async def fetch_all():',
+        '    yield 0',
+        'async def store():',
+        '    shards = reraise_iter(fetch_all(), lambda i, item: "In %d" % i)',
+        '    async with shards:',
+        '        iterator = shards.__aiter__()',
+        '        async for shard in iterator:',
+        '            raise ValueError("cannot store")',
+        'try:',
+        '    asyncio.run(store())',
+        'except ValueError as e:',
+        '    print("".join(traceback.format_exception_only(type(e), e)))',
+    ])
+    process = subprocess.Popen(
+        [sys.executable, '-c', code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    out, err = process.communicate()
+    assert 'In 0' in out.splitlines()
+    assert err == ''
+
+
+def testReraisingCallCoroutineFunction():
+    import inspect
+
+    @reraising_call()
+    async def fetch_shard(shard, timeout=1.0):
+        return await fetch(shard)
+
+    assert inspect.iscoroutinefunction(fetch_shard)
+    assert run(fetch_shard, 1) == 1
+    with pytest.raises(KeyError) as e:
+        run(fetch_shard, -1)
+    assert (
+        'While calling testReraisingCallCoroutineFunction.<locals>.'
+        'fetch_shard(shard=-1)'
+    ) in format_exception(e.value)
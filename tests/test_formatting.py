@@ -0,0 +1,110 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+import six
+
+from zerotk.reraiseit import configure, format_exception, reraise
+from zerotk.reraiseit import _formatting, _reraiseit
+
+
+class LoadError(Exception):
+    pass
+
+
+def fail():
+    raise LoadError('original message')
+
+
+def load():
+    try:
+        fail()
+    except LoadError as e:
+        reraise(e, 'While loading', fields={'shard': 17})
+
+
+def run():
+    try:
+        try:
+            load()
+        except LoadError as e:
+            reraise(e, 'While running')
+    except LoadError as e:
+        return e
+
+
+def entry(function, offset, source):
+    lineno = function.__code__.co_firstlineno + offset
+    result = '  File "{}", line {}, in {}\n'.format(
+        __file__.replace('.pyc', '.py'), lineno, function.__name__
+    )
+    if source:
+        result += '    {}\n'.format(source)
+    return result
+
+
+@pytest.mark.parametrize('backend', ['args', 'notes'])
+def testFormatException(backend, monkeypatch):
+    if backend == 'notes' and not hasattr(BaseException, 'add_note'):
+        pytest.skip('PEP 678 notes require Python 3.11')
+    monkeypatch.setattr(
+        _reraiseit, '_annotate', _reraiseit._BACKENDS[backend]
+    )
+    exception = run()
+    text = format_exception(exception)
+    assert text.startswith('Traceback (most recent call last):\n')
+    assert entry(load, 2, 'fail()') in text
+    assert entry(fail, 1, "raise LoadError('original message')") in text
+    assert text.endswith(
+        'While running\n'
+        'While loading (shard=17)\n'
+        'test_formatting.LoadError: original message\n'
+    )
+
+    text = format_exception(exception, source=False)
+    assert entry(load, 2, None) + entry(fail, 1, None) in text
+    assert 'fail()' not in text
+
+
+def testFormatExceptionChain():
+    try:
+        try:
+            raise KeyError('key')
+        except KeyError as e:
+            six.raise_from(ValueError('value'), e)
+    except ValueError as e:
+        exception = e
+
+    text = format_exception(exception)
+    assert "KeyError: 'key'\n" in text
+    assert 'The above exception was the direct cause' in text
+    assert text.endswith('ValueError: value\n')
+
+    text = format_exception(exception, chain=False)
+    assert 'KeyError' not in text
+
+
+def testFormatExceptionReleasedFrames():
+    previous = configure(traceback_retention='summary')
+    try:
+        exception = run()
+    finally:
+        configure(**previous)
+
+    text = format_exception(exception)
+    assert 'Released frames' not in text
+    # Released frames are shown without source.
+    assert entry(fail, 1, None) in text
+    assert text.endswith('test_formatting.LoadError: original message\n')
+
+
+def testFormatExceptionWithoutContext():
+    assert format_exception(KeyError('key')) == "KeyError: 'key'\n"
+    assert format_exception(RuntimeError()) == 'RuntimeError\n'
+
+
+def testSourceLinesCacheIsBounded(monkeypatch):
+    monkeypatch.setattr(_formatting, '_MAX_SOURCE_LINES', 2)
+    monkeypatch.setattr(_formatting, '_SOURCE_LINES', {})
+    format_exception(run())
+    assert len(_formatting._SOURCE_LINES) <= 2
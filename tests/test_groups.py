@@ -0,0 +1,145 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+import re
+import sys
+import traceback
+
+from zerotk.reraiseit import reraise, reraising
+from zerotk.reraiseit import _reraiseit
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 11), reason='Exception groups require Python 3.11'
+)
+
+
+@pytest.fixture(params=['args', 'notes'])
+def backend(request, monkeypatch):
+    monkeypatch.setattr(
+        _reraiseit, '_annotate', _reraiseit._BACKENDS[request.param]
+    )
+    return request.param
+
+
+def format_exception(exception):
+    """
+    Formats the exception, without the margin added to exception groups.
+    """
+    lines = ''.join(traceback.format_exception(exception)).splitlines()
+    return '\n'.join(re.sub(r'^ *[|+] ', '', line) for line in lines)
+
+
+def make_group(count=3):
+    return ExceptionGroup(
+        'batch failed',
+        [KeyError('record %d' % i) for i in range(count)] + [
+            ExceptionGroup('nested', [ValueError('nested record')]),
+        ],
+    )
+
+
+def reraise_twice(group, **kwargs):
+    try:
+        try:
+            raise group
+        except ExceptionGroup as e1:
+            reraise(e1, 'While processing batch', **kwargs)
+    except ExceptionGroup as e2:
+        reraise(e2, 'While running job', **kwargs)
+
+
+def testGroupIsAnnotatedOnce(backend):
+    group = make_group()
+    with pytest.raises(ExceptionGroup) as e:
+        reraise_twice(group)
+
+    text = format_exception(e.value)
+    assert 'While running job\nWhile processing batch' in text
+    # The group's own message and members are kept.
+    assert str(e.value).endswith('batch failed (4 sub-exceptions)')
+    assert e.value.exceptions == group.exceptions
+    for exception in group.exceptions:
+        assert not hasattr(exception, '__notes__')
+
+
+def testMemberMessages(backend):
+    group = make_group()
+    visited = []
+
+    def describe(member):
+        visited.append(member)
+        return 'While processing %s' % (member.args[0],)
+
+    with pytest.raises(ExceptionGroup) as e:
+        reraise_twice(group, member_message=describe)
+    # The member messages are only formatted when shown.
+    assert visited == []
+
+    text = format_exception(e.value)
+    assert (
+        'While processing record 1\nWhile processing record 1\n' in text
+    )
+    assert 'While processing nested record' in text
+    # Each message is formatted once per member.
+    assert len(visited) == 8
+
+    # PEP 678: notes must be strings. Each member gets a single note, which
+    # shows the messages added since.
+    [note] = group.exceptions[0].__notes__
+    assert isinstance(note, str)
+    assert str(note) == 'While processing record 0\nWhile processing record 0'
+    assert (
+        'While processing record 1\nWhile processing record 1' in
+        ''.join(traceback.format_exception(group.exceptions[1]))
+    )
+
+
+def testSplitKeepsAnnotations(backend):
+    group = make_group()
+    with pytest.raises(ExceptionGroup) as e:
+        reraise_twice(group, member_message='While processing member')
+
+    keys, others = e.value.split(KeyError)
+    for derived in (keys, others, e.value.subgroup(ValueError)):
+        text = format_exception(derived)
+        assert 'While running job\nWhile processing batch' in text
+        assert 'While processing member' in text
+
+    # Derived groups can be reraised without changing the original.
+    with pytest.raises(ExceptionGroup) as e2:
+        try:
+            raise keys
+        except ExceptionGroup as e3:
+            reraise(e3, 'While handling keys')
+    assert 'While handling keys' in format_exception(e2.value)
+    assert 'While handling keys' not in format_exception(e.value)
+
+
+def testReraisingMemberMessage():
+    with pytest.raises(ExceptionGroup) as e:
+        with reraising('While processing', member_message='In batch'):
+            raise make_group(1)
+    text = format_exception(e.value)
+    assert 'While processing' in text
+    assert text.splitlines().count('In batch') == 2
+
+
+def testPickleMemberMessages(backend):
+    from pickle import dumps, loads
+
+    with pytest.raises(ExceptionGroup) as e:
+        reraise_twice(make_group(), member_message=lambda member: 'In batch')
+
+    pickled_group = loads(dumps(e.value))
+    text = format_exception(pickled_group)
+    assert 'While running job\nWhile processing batch' in text
+    assert text.splitlines().count('In batch') == 2 * 4
+
+    # Members of the unpickled group get new messages too.
+    with pytest.raises(ExceptionGroup) as e2:
+        try:
+            raise pickled_group
+        except ExceptionGroup as e3:
+            reraise(e3, 'While retrying', member_message='In retry')
+    assert format_exception(e2.value).splitlines().count('In retry') == 4
@@ -0,0 +1,122 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import gc
+import logging
+import pytest
+
+from six.moves import queue
+
+from zerotk.reraiseit import ReraiseFilter, ReraiseFormatter, reraise
+
+from reraise_helpers import make_payload
+
+
+def fail(payload):
+    raise KeyError('key')
+
+
+def load(payload_refs):
+    try:
+        fail(make_payload(payload_refs))
+    except KeyError as e:
+        reraise(e, 'While loading', fields={'shard': 17})
+
+
+def log_failure(logger, payload_refs):
+    try:
+        try:
+            load(payload_refs)
+        except KeyError as e:
+            reraise(e, 'While running')
+    except KeyError:
+        logger.exception('Job failed')
+
+
+@pytest.fixture
+def logger():
+    result = logging.getLogger('test_logging')
+    result.propagate = False
+    yield result
+    for handler in list(result.handlers):
+        result.removeHandler(handler)
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def testReraiseFilter(logger):
+    handler = ListHandler()
+    handler.addFilter(ReraiseFilter())
+    logger.addHandler(handler)
+
+    payload_refs = []
+    log_failure(logger, payload_refs)
+    gc.collect()
+    # The exception (and so its frames) is released.
+    assert payload_refs[0]() is None
+
+    [record] = handler.records
+    assert record.exc_info is None
+    assert record.reraise_context == {'shard': 17}
+    assert record.reraise_messages == [
+        'While running', 'While loading (shard=17)'
+    ]
+    assert record.exc_text.startswith('Traceback (most recent call last):')
+    assert record.exc_text.endswith(
+        "While running\nWhile loading (shard=17)\nKeyError: 'key'"
+    )
+    # No source lines by default.
+    assert 'fail(make_payload(payload_refs))' not in record.exc_text
+
+    text = logging.Formatter().format(record)
+    assert text.startswith('Job failed\nTraceback (most recent call last):')
+
+
+def testReraiseFilterWithQueueHandler(logger):
+    from logging.handlers import QueueHandler
+
+    records = queue.Queue()
+    handler = QueueHandler(records)
+    handler.addFilter(ReraiseFilter())
+    logger.addHandler(handler)
+    log_failure(logger, [])
+
+    record = records.get_nowait()
+    assert record.reraise_context == {'shard': 17}
+    assert record.getMessage().endswith("KeyError: 'key'")
+
+
+def testReraiseFilterWithoutException(logger):
+    handler = ListHandler()
+    handler.addFilter(ReraiseFilter())
+    logger.addHandler(handler)
+    logger.error('Plain error')
+    [record] = handler.records
+    assert not hasattr(record, 'reraise_context')
+
+
+def testReraiseFormatter(logger):
+    handler = ListHandler()
+    logger.addHandler(handler)
+    log_failure(logger, [])
+    logger.error('Plain error')
+
+    formatter = ReraiseFormatter('%(message)s %(reraise_context)s')
+    failure, plain = [formatter.format(record) for record in handler.records]
+    assert failure.startswith("Job failed {'shard': 17}\nTraceback")
+    assert 'fail(make_payload(payload_refs))' in failure
+    assert failure.endswith("KeyError: 'key'")
+    assert plain == 'Plain error {}'
+
+    formatter = ReraiseFormatter(source=False)
+    assert 'fail(make_payload(payload_refs))' not in (
+        formatter.format(handler.records[0])
+    )
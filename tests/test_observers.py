@@ -0,0 +1,139 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+import threading
+
+from zerotk.reraiseit import (
+    ReraiseStats,
+    add_observer,
+    configure,
+    remove_observer,
+    reraise,
+    reraising,
+)
+from zerotk.reraiseit import _reraiseit
+
+
+@pytest.fixture
+def events():
+    result = []
+    add_observer(result.append)
+    yield result
+    remove_observer(result.append)
+
+
+def load(path):
+    try:
+        raise KeyError(path)
+    except KeyError as e:
+        reraise(e, 'While loading %s', args=(path,))
+
+
+def catch(function, *args):
+    try:
+        function(*args)
+    except Exception as e:
+        return e
+
+
+@pytest.mark.parametrize('annotate', ['args', 'notes'])
+def testObserver(events, annotate, monkeypatch):
+    monkeypatch.setattr(
+        _reraiseit, '_annotate', _reraiseit._BACKENDS[annotate]
+    )
+    catch(load, 'a.txt')
+
+    [event] = events
+    assert event.exception_type is KeyError
+    assert event.filename == __file__.replace('.pyc', '.py')
+    assert event.lineno == load.__code__.co_firstlineno + 4
+    assert event.function == 'load'
+    assert event.depth == 1
+    assert event.message_length == len('While loading %s')
+
+
+def testObserverCallSiteOfReraising(events):
+
+    @reraising(lambda: 'While loading')
+    def load_with_reraising():
+        raise KeyError('key')
+
+    exception = catch(load_with_reraising)
+    assert exception.reraised_message.depth() == 1
+    [event] = events
+    # The frames of reraiseit itself are skipped.
+    assert event.function == 'catch'
+    assert event.message_length is None
+
+
+def testObserverErrorsAreIgnored():
+
+    def broken(event):
+        raise RuntimeError('broken observer')
+
+    add_observer(broken)
+    try:
+        assert isinstance(catch(load, 'a.txt'), KeyError)
+    finally:
+        remove_observer(broken)
+    assert _reraiseit.observers.active == ()
+
+
+def testObserverSampleRate(events):
+    previous = configure(observer_sample_rate=0.0)
+    try:
+        catch(load, 'a.txt')
+    finally:
+        configure(**previous)
+    assert events == []
+
+
+def testReraiseStats():
+    stats = ReraiseStats()
+    add_observer(stats)
+    try:
+        catch(load, 'a.txt')
+
+        def load_in_thread():
+            for _i in range(3):
+                catch(load, 'b.txt')
+
+        thread = threading.Thread(target=load_in_thread)
+        thread.start()
+        thread.join()
+    finally:
+        remove_observer(stats)
+
+    snapshot = stats.snapshot()
+    assert snapshot['annotations'] == 4
+    assert snapshot['exception_types'] == {'KeyError': 4}
+    assert snapshot['call_sites'] == {
+        (
+            __file__.replace('.pyc', '.py'),
+            load.__code__.co_firstlineno + 4,
+            'load',
+        ): 4,
+    }
+    assert snapshot['depth'] == {1: 4}
+    assert snapshot['message_length'] == {31: 4}
+
+    stats.reset()
+    assert stats.snapshot()['annotations'] == 0
+
+
+def testReraiseStatsFinishedThreads():
+    stats = ReraiseStats()
+    add_observer(stats)
+    try:
+        for _i in range(20):
+            thread = threading.Thread(target=catch, args=(load, 'a.txt'))
+            thread.start()
+            thread.join()
+    finally:
+        remove_observer(stats)
+
+    assert stats.snapshot()['annotations'] == 20
+    # The tables of the finished threads were folded together.
+    assert stats._tables == []
+    assert stats.snapshot()['annotations'] == 20
@@ -0,0 +1,145 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+import subprocess
+import sys
+
+from zerotk.reraiseit import (
+    ReraiseProfiler,
+    get_profiler,
+    reraise,
+    start_profiling,
+    stop_profiling,
+)
+from zerotk.reraiseit import _reraiseit
+
+from reraise_helpers import format_exception
+
+
+def fail(depth):
+    if depth:
+        fail(depth - 1)
+    raise KeyError('key')
+
+
+def load(depth):
+    try:
+        fail(depth)
+    except KeyError as e:
+        reraise(e, 'While loading')
+
+
+def run(depth):
+    try:
+        try:
+            load(depth)
+        except KeyError as e:
+            reraise(e, 'While running')
+    except KeyError as e:
+        return e
+
+
+@pytest.fixture
+def args_backend(monkeypatch):
+    """
+    Renders the context only when shown (notes are rendered when added).
+    """
+    monkeypatch.setattr(_reraiseit, '_annotate', _reraiseit._annotate_args)
+
+
+@pytest.fixture
+def profiler():
+    annotate = _reraiseit._annotate
+    result = start_profiling()
+    yield result
+    assert stop_profiling() is result
+    assert _reraiseit._annotate is annotate
+
+
+def testProfiler(args_backend, profiler):
+    assert get_profiler() is profiler
+    for _i in range(3):
+        exception = run(2)
+    format_exception(exception)
+    format_exception(exception)
+
+    [run_stats, load_stats] = sorted(
+        profiler.stats(), key=lambda item: item['site'][2], reverse=True
+    )
+    assert load_stats['site'] == (
+        __file__.replace('.pyc', '.py'),
+        load.__code__.co_firstlineno + 4,
+        'load',
+    )
+    assert load_stats['annotations'] == 3
+    assert load_stats['renderings'] == 0
+    # load, fail, fail, fail
+    assert load_stats['max_traceback_depth'] == 4
+
+    assert run_stats['site'][2] == 'run'
+    assert run_stats['annotations'] == 3
+    # The rendered text is cached.
+    assert run_stats['renderings'] == 1
+    assert run_stats['render_time'] > 0
+    assert run_stats['total_time'] == (
+        run_stats['annotate_time'] + run_stats['render_time']
+    )
+
+    report = profiler.report().splitlines()
+    assert report[0].split() == [
+        'count',
+        'annotate_ms',
+        'renders',
+        'render_ms',
+        'total_ms',
+        'tb_depth',
+        'call',
+        'site',
+    ]
+    assert len(report) == 3
+    assert len(profiler.report(limit=1).splitlines()) == 2
+
+
+def testProfilerDumpStats(profiler, tmpdir):
+    import pstats
+
+    run(0)
+    filename = str(tmpdir.join('reraise.prof'))
+    profiler.dump_stats(filename)
+    stats = pstats.Stats(filename)
+    assert sorted(name for _filename, _lineno, name in stats.stats) == [
+        'load', 'run'
+    ]
+
+
+def testProfilerFromEnvironment(tmpdir):
+    import os
+    import pstats
+
+    filename = str(tmpdir.join('reraise.prof'))
+    code = '\n'.join([
+        'from zerotk.reraiseit import get_profiler, reraise',
+        'try:',
+        '    try:',
+        '        raise KeyError("key")',
+        '    except KeyError as e:',
+        '        reraise(e, "While loading")',
+        'except KeyError:',
+        '    pass',
+        'assert get_profiler() is not None',
+    ])
+    environ = dict(os.environ, ZEROTK_RERAISEIT_PROFILE=filename)
+    subprocess.check_call([sys.executable, '-c', code], env=environ)
+    assert len(pstats.Stats(filename).stats) == 1
+
+    environ.pop('ZEROTK_RERAISEIT_PROFILE')
+    code = 'from zerotk.reraiseit import get_profiler\n' \
+        'assert get_profiler() is None'
+    subprocess.check_call([sys.executable, '-c', code], env=environ)
+
+
+def testNoProfilerByDefault():
+    assert get_profiler() is None
+    assert stop_profiling() is None
+    assert isinstance(ReraiseProfiler().stats(), list)
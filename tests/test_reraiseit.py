@@ -4,12 +4,37 @@ from __future__ import unicode_literals, print_function
 import locale  # noqa - Used by code inside a string.
 import pytest
 import six
+import sys
 import traceback
 
 from zerotk.reraiseit import reraise, exception_to_unicode
+from zerotk.reraiseit import _reraiseit
+
+from reraise_helpers import format_exception
 
 MESSAGE_TYPE = bytes if six.PY2 else str
 
+HAS_NOTES = hasattr(BaseException, 'add_note')
+
+
+@pytest.fixture
+def args_backend(monkeypatch):
+    """
+    Adds the messages to the exception's own message, the only backend
+    available before Python 3.11.
+    """
+    monkeypatch.setattr(_reraiseit, '_annotate', _reraiseit._annotate_args)
+
+
+@pytest.fixture
+def notes_backend(monkeypatch):
+    """
+    Adds the messages as PEP 678 notes.
+    """
+    if not HAS_NOTES:
+        pytest.skip('PEP 678 notes require Python 3.11')
+    monkeypatch.setattr(_reraiseit, '_annotate', _reraiseit._annotate_notes)
+
 
 def execute_python_code(code):
     try:
@@ -81,9 +106,6 @@ class ExceptionTestConfiguration():
         # Getting the type of the "actual exception" because its type might be
         # different than self.exception_type
         reraised_exception_name = type(actual_exception).__name__
-        if six.PY3 and reraised_exception_name.startswith('Reraised'):
-            reraised_exception_name = 'zerotk.reraiseit._reraiseit.' + \
-                reraised_exception_name
         exception_message = self.get_expected_exception_message()
 
         if self.expected_traceback_message is not None:
@@ -124,7 +146,7 @@ if six.PY2:
                     '  File "<string>", line 1\n'
                     '    in valid syntax\n'
                     '     ^\n'
-                    'ReraisedSyntaxError: invalid syntax\n'
+                    'SyntaxError: invalid syntax\n'
                 )
             ),
             ExceptionTestConfiguration(
@@ -233,8 +255,7 @@ else:
                     '  File "<string>", line 1\n'
                     '    in valid syntax\n'
                     '     ^\n'
-                    'zerotk.reraiseit._reraiseit.ReraisedSyntaxError: '
-                    'invalid syntax\n'
+                    'SyntaxError: invalid syntax\n'
                 )
             ),
             ExceptionTestConfiguration(
@@ -273,6 +294,7 @@ else:
 
 
 @parametrized_exceptions
+@pytest.mark.usefixtures('args_backend')
 def testReraiseKeepsTraceback(exception_configuration):
     with pytest.raises(exception_configuration.exception_type) as e:
         exception_configuration.RaiseExceptionUsingReraise()
@@ -318,6 +340,7 @@ def testReraiseKeepsTraceback(exception_configuration):
 
 
 @parametrized_exceptions
+@pytest.mark.usefixtures('args_backend')
 def testReraiseAddsMessagesCorrectly(exception_configuration):
     with pytest.raises(exception_configuration.exception_type) as e:
         exception_configuration.RaiseExceptionUsingReraise()
@@ -338,6 +361,7 @@ def testReraiseAddsMessagesCorrectly(exception_configuration):
 
 
 @parametrized_exceptions
+@pytest.mark.usefixtures('args_backend')
 def testPickle(exception_configuration):
     try:
         exception_configuration.RaiseExceptionUsingReraise()
@@ -350,3 +374,907 @@ def testPickle(exception_configuration):
         )
         assert exception_to_unicode(pickled_exception) != ''
         assert exception_to_unicode(reraised_exception) != ''
+
+
+@pytest.mark.usefixtures('args_backend')
+def testReraiseBuildsMessageLazily():
+    calls = []
+
+    class CountingMessage(object):
+        def __str__(self):
+            calls.append(None)
+            return 'original'
+
+    class CountingError(Exception):
+        pass
+
+    def raise_nested(depth):
+        if depth == 0:
+            raise CountingError(CountingMessage())
+        try:
+            raise_nested(depth - 1)
+        except CountingError as e:
+            reraise(e, 'layer %d' % depth)
+
+    with pytest.raises(CountingError) as e:
+        raise_nested(3)
+
+    # The original message is obtained once, no matter the number of layers.
+    assert len(calls) == 1
+    context = e.value.reraised_message
+    assert context._text is None
+    assert exception_to_unicode(e.value) == (
+        '\nlayer 3\nlayer 2\nlayer 1\noriginal'
+    )
+    assert context._text is not None
+
+    # Adding a layer invalidates the cached text.
+    with pytest.raises(CountingError) as e2:
+        try:
+            raise e.value
+        except CountingError as e3:
+            reraise(e3, 'layer 4')
+    assert exception_to_unicode(e2.value) == (
+        '\nlayer 4\nlayer 3\nlayer 2\nlayer 1\noriginal'
+    )
+    assert len(calls) == 1
+
+
+@pytest.mark.usefixtures('args_backend')
+def testReraiseSeparator():
+    with pytest.raises(RuntimeError) as e:
+        try:
+            try:
+                raise RuntimeError('original message')
+            except RuntimeError as e1:
+                reraise(e1, '[message]', separator=' ')
+        except RuntimeError as e2:
+            reraise(e2, '[outer]', separator=' ')
+
+    assert exception_to_unicode(e.value) == (
+        '\n[outer] \n[message] original message'
+    )
+    assert e.value.reraised_message == exception_to_unicode(e.value)
+
+
+@pytest.mark.skipif(six.PY2, reason='OSError subclasses are Python 3 only')
+@pytest.mark.parametrize(
+    'exception',
+    [
+        PermissionError(13, 'Permission denied', 'path'),
+        ConnectionResetError(104, 'Connection reset by peer'),
+    ] if six.PY3 else [],
+    ids=lambda exception: type(exception).__name__,
+)
+@pytest.mark.usefixtures('args_backend')
+def testReraiseOSErrorSubclasses(exception):
+    from six.moves.cPickle import dumps, loads
+
+    with pytest.raises(type(exception)) as e:
+        try:
+            raise exception
+        except OSError as e1:
+            reraise(e1, 'While doing x:')
+
+    original_message = exception_to_unicode(exception)
+    assert type(e.value)._reraised_base is type(exception)
+    # Shown with the original type name.
+    assert type(e.value).__name__ == type(exception).__name__
+    assert traceback.format_exception_only(type(e.value), e.value)[
+        -1
+    ].startswith(type(exception).__name__ + ': ')
+    assert e.value.errno == exception.errno
+    assert e.value.filename == exception.filename
+    assert exception_to_unicode(e.value) == (
+        '\nWhile doing x:\n' + original_message
+    )
+    # The reraised exception replaces the original one, which must not be
+    # reported as its context.
+    assert e.value.__context__ is None
+
+    pickled_exception = loads(dumps(e.value))
+    assert type(pickled_exception) is type(e.value)
+    assert exception_to_unicode(pickled_exception) == (
+        exception_to_unicode(e.value)
+    )
+
+
+@pytest.mark.usefixtures('args_backend')
+def testReraiseCustomException():
+
+    class CustomError(Exception):
+        def __init__(self, code):
+            Exception.__init__(self, code)
+            self.code = code
+
+        def __str__(self):
+            return 'custom error %d' % self.code
+
+    with pytest.raises(CustomError) as e:
+        try:
+            raise CustomError(3)
+        except CustomError as e1:
+            reraise(e1, 'While doing x:')
+
+    assert e.value.code == 3
+    assert e.value.args == (3,)
+    assert exception_to_unicode(e.value) == '\nWhile doing x:\ncustom error 3'
+
+
+def testReraisedClassesAreCached():
+    assert _reraiseit._reraised_class(KeyError) is _reraiseit.ReraisedKeyError
+    assert (
+        _reraiseit._reraised_class(AttributeError) is
+        _reraiseit._reraised_class(AttributeError)
+    )
+
+    class CustomError(Exception):
+        pass
+
+    reraised_class = _reraiseit._reraised_class(CustomError)
+    assert reraised_class is _reraiseit._reraised_class(CustomError)
+    assert issubclass(reraised_class, CustomError)
+
+
+@pytest.mark.skipif(six.PY2, reason='Exception chaining is Python 3 only')
+@pytest.mark.usefixtures('args_backend')
+def testReraiseKeepsExceptionChain():
+
+    def run(cause):
+        try:
+            try:
+                raise KeyError('inner A')
+            except KeyError as e1:
+                if cause:
+                    six.raise_from(ValueError('outer'), e1)
+                raise ValueError('outer')
+        except ValueError as e2:
+            reraise(e2, 'While running')
+
+    # Replaced by a Reraised* instance, which keeps the original's chain.
+    with pytest.raises(ValueError) as e:
+        run(cause=False)
+    assert type(e.value)._reraised_base is ValueError
+    assert repr(e.value.__context__) == "KeyError('inner A')"
+    assert not e.value.__suppress_context__
+    text = ''.join(
+        traceback.format_exception(
+            type(e.value), e.value, e.value.__traceback__
+        )
+    )
+    assert "KeyError: 'inner A'\n\nDuring handling" in text
+    assert text.count('During handling') == 1
+
+    with pytest.raises(ValueError) as e:
+        run(cause=True)
+    assert repr(e.value.__cause__) == "KeyError('inner A')"
+    assert e.value.__suppress_context__
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 6), reason='__init_subclass__ requires Python 3.6'
+)
+@pytest.mark.usefixtures('args_backend')
+def testReraisedClassesSkipSubclassHooks():
+    registry = []
+
+    class PluginError(Exception):
+        def __init_subclass__(cls, **kwargs):
+            super().__init_subclass__(**kwargs)
+            registry.append(cls.__name__)
+
+    class MyPluginError(PluginError):
+        pass
+
+    class SlottedPluginError(PluginError):
+        __slots__ = ('code',)
+
+    assert registry == ['MyPluginError', 'SlottedPluginError']
+    for exception_class in (MyPluginError, SlottedPluginError):
+        with pytest.raises(exception_class) as e:
+            try:
+                raise exception_class('message')
+            except PluginError as e1:
+                reraise(e1, 'While loading plugin')
+        assert type(e.value)._reraised_base is exception_class
+        assert exception_to_unicode(e.value) == (
+            '\nWhile loading plugin\nmessage'
+        )
+    # Classes whose layout can't be moved (with "__slots__") are created as
+    # any subclass.
+    assert registry == [
+        'MyPluginError', 'SlottedPluginError', 'SlottedPluginError'
+    ]
+
+
+@pytest.mark.usefixtures('args_backend')
+def testReraisedClassesWithMetaclass():
+    registry = []
+
+    class PluginMeta(type):
+        def __init__(cls, name, bases, namespace):
+            type.__init__(cls, name, bases, namespace)
+            if '_reraised_base' not in namespace:
+                registry.append(name)
+
+    class PluginError(six.with_metaclass(PluginMeta, Exception)):
+        pass
+
+    with pytest.raises(PluginError) as e:
+        try:
+            raise PluginError('message')
+        except PluginError as e1:
+            reraise(e1, 'While loading plugin')
+
+    # Metaclasses are called: registries can skip the Reraised* classes.
+    assert type(type(e.value)) is PluginMeta
+    assert type(e.value)._reraised_base is PluginError
+    assert registry == ['PluginError']
+
+
+@pytest.mark.usefixtures('args_backend')
+def testReraisedClassesDontKeepOriginalAlive():
+    import gc
+    import weakref
+
+    def raise_plugin_error():
+
+        class PluginError(Exception):
+            pass
+
+        try:
+            try:
+                raise PluginError('message')
+            except PluginError as e1:
+                reraise(e1, 'While doing x:')
+        except PluginError as e2:
+            assert type(e2)._reraised_base is PluginError
+            return weakref.ref(PluginError), id(PluginError)
+
+    plugin_class_ref, plugin_class_id = raise_plugin_error()
+    gc.collect()
+    assert plugin_class_ref() is None
+
+
+def testReraisedClassesLiveAsLongAsOriginal():
+    import gc
+
+    class PluginError(Exception):
+        pass
+
+    class ChildPluginError(PluginError):
+        pass
+
+    reraised_class = _reraiseit._reraised_class(PluginError)
+    reraised_class_id = id(reraised_class)
+    del reraised_class
+    # Not collected, even without instances.
+    gc.collect()
+    assert id(_reraiseit._reraised_class(PluginError)) == reraised_class_id
+
+    # Subclasses get their own wrapper.
+    child_class = _reraiseit._reraised_class(ChildPluginError)
+    assert child_class._reraised_base is ChildPluginError
+    assert _reraiseit._reraised_class(PluginError) is not child_class
+
+
+def testReraisedClassesRegistryFromThreads():
+    import threading
+
+    classes = [type(str('Error%d' % i), (Exception,), {}) for i in range(20)]
+    results = []
+
+    def register():
+        results.append([_reraiseit._reraised_class(c) for c in classes])
+
+    threads = [threading.Thread(target=register) for _i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # A single wrapper per class, even when registered concurrently.
+    assert all(result == results[0] for result in results)
+
+
+def testReraisedClassesStaticRegistry():
+    # The interpreter's classes can't keep their wrapper as an attribute.
+    reraised_class = _reraiseit._reraised_class(KeyError)
+    assert _reraiseit._STATIC_RERAISED_CLASSES[KeyError] is reraised_class
+    assert '_reraised_wrapper' not in KeyError.__dict__
+
+
+class CustomKeyError(KeyError):
+    pass
+
+
+class CodedError(Exception):
+    """
+    Can't be unpickled on its own: "__init__" doesn't accept its "args".
+    """
+
+    def __init__(self, code, description):
+        Exception.__init__(self, '%s: %s' % (code, description))
+        self.code = code
+
+
+def reraise_many(exception, count, message='While handling layer %d'):
+    for i in range(count):
+        try:
+            try:
+                raise exception
+            except Exception as e1:
+                reraise(e1, message, args=(i,) if '%' in message else ())
+        except Exception as e2:
+            exception = e2
+    return exception
+
+
+@pytest.mark.parametrize('backend', ['args_backend', 'notes_backend'])
+def testPickleDeepChain(backend, request):
+    from six.moves.cPickle import dumps, loads
+
+    request.getfixturevalue(backend)
+    exception = reraise_many(CustomKeyError('key'), 90)
+    text = format_exception(exception)
+
+    dumped = dumps(exception, 2)
+    # The chain is pickled once (not once per attribute referencing it),
+    # with a few bytes of overhead per layer. Notes share the text of the
+    # messages.
+    assert dumped.count(b'While handling layer 89') == 1
+    assert len(dumped) < len(text.encode('utf-8')) + 25 * 90
+
+    pickled_exception = loads(dumped)
+    assert type(pickled_exception) is type(exception)
+    assert format_exception(pickled_exception) == text
+    assert (
+        pickled_exception.reraised_message.layers[-1] ==
+        ('While handling layer 89', '\n', None, None)
+    )
+
+    # The unpickled exception can be reraised again.
+    pickled_exception = reraise_many(pickled_exception, 1, 'Back in %d')
+    assert format_exception(pickled_exception) == text.replace(
+        'While handling layer 89', 'Back in 0\nWhile handling layer 89'
+    )
+
+
+@pytest.mark.usefixtures('args_backend')
+def testPickleCustomInit():
+    from six.moves.cPickle import dumps, loads
+
+    exception = reraise_many(CodedError(3, 'broken'), 2)
+    pickled_exception = loads(dumps(exception))
+    assert pickled_exception.code == 3
+    assert pickled_exception.args == ('3: broken',)
+    assert exception_to_unicode(pickled_exception) == (
+        exception_to_unicode(exception)
+    )
+
+
+@pytest.mark.usefixtures('args_backend', 'small_limits')
+def testPickleKeepsTruncatedMessages():
+    from six.moves.cPickle import dumps, loads
+
+    exception = reraise_many(RuntimeError('original'), 1, 'c' * 50 + '%d')
+    text = exception_to_unicode(exception)
+    assert '[... 41 chars elided ...]' in text
+    assert exception_to_unicode(loads(dumps(exception))) == text
+
+
+@pytest.mark.usefixtures('notes_backend')
+def testReraiseWithNotes():
+    from six.moves.cPickle import dumps, loads
+
+    original = CustomKeyError('key')
+    with pytest.raises(CustomKeyError) as e:
+        try:
+            try:
+                raise original
+            except KeyError as e1:
+                reraise(e1, "While doing 'bar'")
+        except KeyError as e2:
+            reraise(e2, 'While doing x:')
+
+    # The same object is raised, with its args untouched.
+    assert e.value is original
+    assert e.value.args == ('key',)
+    assert exception_to_unicode(e.value) == "'key'"
+    # One note per layer, outermost first.
+    assert [six.text_type(note) for note in e.value.__notes__] == [
+        'While doing x:', "While doing 'bar'"
+    ]
+
+    original.add_note('user note')
+    traceback_message = ''.join(
+        traceback.format_exception_only(type(e.value), e.value)
+    )
+    assert traceback_message.endswith(
+        "CustomKeyError: 'key'\n"
+        "While doing x:\n"
+        "While doing 'bar'\n"
+        "user note\n"
+    )
+
+    pickled_exception = loads(dumps(e.value))
+    assert pickled_exception.args == ('key',)
+    assert [six.text_type(note) for note in pickled_exception.__notes__] == [
+        'While doing x:', "While doing 'bar'", 'user note'
+    ]
+
+
+@pytest.mark.usefixtures('notes_backend')
+def testNotesAreStrings():
+    from six.moves.cPickle import dumps, loads
+
+    def run():
+        try:
+            try:
+                raise ValueError('invalid value')
+            except ValueError as e1:
+                e1.add_note('user note')
+                reraise(
+                    e1, 'While parsing %s', args=('a.txt',),
+                    fields={'line': 3},
+                )
+        except ValueError as e2:
+            reraise(e2, 'While loading')
+
+    # PEP 678: notes must be strings, as assumed by pytest and others. Notes
+    # formatted when shown have their template as value.
+    with pytest.raises(ValueError, match='While parsing %s') as e:
+        run()
+    assert all(isinstance(note, str) for note in e.value.__notes__)
+    assert '\n'.join(e.value.__notes__) == (
+        'user note\nWhile loading\nWhile parsing %s'
+    )
+    assert '\n'.join(str(note) for note in e.value.__notes__) == (
+        'user note\nWhile loading\nWhile parsing a.txt (line=3)'
+    )
+    assert '{}'.format(e.value.__notes__[-1]) == (
+        'While parsing a.txt (line=3)'
+    )
+
+    # The notes are found again after pickling.
+    pickled_exception = loads(dumps(e.value))
+    with pytest.raises(ValueError) as e:
+        try:
+            raise pickled_exception
+        except ValueError as e3:
+            reraise(e3, 'While retrying')
+    assert e.value.__notes__ == [
+        'user note',
+        'While retrying',
+        'While loading',
+        'While parsing a.txt (line=3)',
+    ]
+
+
+def testDefaultBackend(monkeypatch):
+    monkeypatch.delenv('ZEROTK_RERAISEIT_BACKEND', raising=False)
+    expected = 'notes' if HAS_NOTES else 'args'
+    assert _reraiseit._default_backend() == expected
+
+    monkeypatch.setenv('ZEROTK_RERAISEIT_BACKEND', 'args')
+    assert _reraiseit._default_backend() == 'args'
+
+
+@pytest.mark.parametrize('backend', ['args_backend', 'notes_backend'])
+def testReraiseDefersMessageFormatting(backend, request):
+    from six.moves.cPickle import dumps, loads
+
+    request.getfixturevalue(backend)
+    calls = []
+
+    class Payload(object):
+        def __repr__(self):
+            calls.append('repr')
+            return '<payload>'
+
+    def describe():
+        calls.append('describe')
+        return 'While describing'
+
+    with pytest.raises(RuntimeError) as e:
+        try:
+            try:
+                raise RuntimeError('original message')
+            except RuntimeError as e1:
+                reraise(e1, 'While processing %r', args=(Payload(),))
+        except RuntimeError as e2:
+            reraise(e2, describe)
+
+    assert calls == []
+    assert (
+        'While describing\nWhile processing <payload>' in
+        format_exception(e.value)
+    )
+    assert sorted(calls) == ['describe', 'repr']
+
+    # The rendered text is cached.
+    format_exception(e.value)
+    assert sorted(calls) == ['describe', 'repr']
+
+    pickled_exception = loads(dumps(e.value))
+    assert (
+        'While describing\nWhile processing <payload>' in
+        format_exception(pickled_exception)
+    )
+
+
+def testReraiseDefersMessageFormattingByDefault():
+    calls = []
+
+    def describe():
+        calls.append('describe')
+        return 'While describing'
+
+    exception = KeyError('key')
+    for _i in range(3):
+        try:
+            try:
+                raise exception
+            except KeyError as e1:
+                reraise(e1, describe)
+        except KeyError as e2:
+            exception = e2
+
+    # Neither reraising (even repeatedly) nor looking at the notes formats
+    # the message: only showing it does.
+    getattr(exception, '__notes__', None)
+    assert calls == []
+    assert 'While describing (repeated 3\u00d7)' in format_exception(exception)
+    assert calls == ['describe']
+
+
+def testReraiseMessageFormattingErrors():
+
+    class BrokenPayload(object):
+        def __repr__(self):
+            raise RuntimeError('broken repr')
+
+    def broken_describe():
+        raise ValueError('broken describe')
+
+    with pytest.raises(KeyError) as e:
+        try:
+            try:
+                raise KeyError('key')
+            except KeyError as e1:
+                reraise(e1, 'While processing %r', args=(BrokenPayload(),))
+        except KeyError as e2:
+            reraise(e2, broken_describe)
+
+    text = format_exception(e.value)
+    assert "<unprintable message 'While processing %r': RuntimeError>" in text
+    assert '<unprintable message <function ' in text
+    assert ': ValueError>' in text
+
+
+@pytest.fixture
+def small_limits():
+    from zerotk.reraiseit import configure
+
+    previous = configure(max_message_size=10, max_total_size=None)
+    yield
+    configure(**previous)
+
+
+@pytest.mark.usefixtures('args_backend', 'small_limits')
+def testReraiseTruncatesHugeMessages():
+    with pytest.raises(RuntimeError) as e:
+        try:
+            try:
+                raise RuntimeError('a' * 100 + 'b' * 100)
+            except RuntimeError as e1:
+                reraise(e1, 'c' * 50)
+        except RuntimeError as e2:
+            reraise(e2, 'short')
+
+    # A single copy of the (truncated) original message is kept.
+    context = e.value.reraised_message
+    assert context.original == 'aaaaa[... 190 chars elided ...]bbbbb'
+    assert e.value.message is context
+    assert e.value.args == ('a' * 100 + 'b' * 100,)
+
+    assert exception_to_unicode(e.value) == (
+        '\nshort'
+        '\nccccc[... 40 chars elided ...]ccccc'
+        '\naaaaa[... 190 chars elided ...]bbbbb'
+    )
+
+
+@pytest.mark.usefixtures('notes_backend', 'small_limits')
+def testReraiseTruncatesTotalSize():
+    from zerotk.reraiseit import configure
+
+    configure(max_message_size=None, max_total_size=20)
+    with pytest.raises(RuntimeError) as e:
+        try:
+            try:
+                raise RuntimeError('original message')
+            except RuntimeError as e1:
+                reraise(e1, 'first layer')
+        except RuntimeError as e2:
+            reraise(e2, 'second layer')
+
+    assert six.text_type(e.value.reraised_message) == (
+        'second lay[... 4 chars elided ...]irst layer'
+    )
+    # Each layer has its own note, limited by "max_message_size".
+    assert e.value.__notes__ == ['second layer', 'first layer']
+
+
+def testExceptionToUnicodeLimit():
+    exception = RuntimeError('0123456789')
+    assert exception_to_unicode(exception) == '0123456789'
+    assert exception_to_unicode(exception, 100) == '0123456789'
+    assert exception_to_unicode(exception, 5) == (
+        '012[... 5 chars elided ...]89'
+    )
+
+
+def testDecodeTruncatedBytes():
+    message = ('ã' * 10).encode('utf-8')
+    assert _reraiseit._decode(message, 'utf-8', 'strict', None) == 'ã' * 10
+    # Characters cut in half are dropped from both ends.
+    assert _reraiseit._decode(message, 'utf-8', 'strict', 7) == (
+        'ãã[... 13 bytes elided ...]ã'
+    )
+    with pytest.raises(UnicodeDecodeError):
+        _reraiseit._decode(b'\xff' * 20, 'utf-8', 'strict', 7)
+    assert _reraiseit._decode(b'\xff' * 20, 'ascii', 'replace', 7) == (
+        '�' * 4 + '[... 13 bytes elided ...]' + '�' * 3
+    )
+
+
+@pytest.mark.parametrize('backend', ['args_backend', 'notes_backend'])
+def testReraiseWithFields(backend, request):
+    from six.moves.cPickle import dumps, loads
+    from zerotk.reraiseit import get_context
+
+    request.getfixturevalue(backend)
+    handle = object()
+    with pytest.raises(KeyError) as e:
+        try:
+            try:
+                raise KeyError('key')
+            except KeyError as e1:
+                reraise(
+                    e1, 'While loading', fields={'shard': 17, 'path': 'a.txt'}
+                )
+        except KeyError as e2:
+            reraise(
+                e2, 'While running job', fields={'shard': 18, 'handle': handle}
+            )
+
+    text = format_exception(e.value)
+    assert "While loading (shard=17, path='a.txt')" in text
+    assert 'While running job (shard=18, handle=<object object at ' in text
+    # The innermost value is kept.
+    assert get_context(e.value) == {
+        'shard': 17, 'path': 'a.txt', 'handle': handle
+    }
+
+    # Values that may not be picklable are pickled as text.
+    pickled_exception = loads(dumps(e.value))
+    assert format_exception(pickled_exception) == text
+    assert get_context(pickled_exception) == {
+        'shard': 17, 'path': 'a.txt', 'handle': six.text_type(handle)
+    }
+
+    assert get_context(KeyError('key')) == {}
+
+
+def testReraiseFieldsNamedAsParameters():
+    from zerotk.reraiseit import get_context, reraising
+
+    fields = {'args': 1, 'separator': 2, 'member_message': 3, 'shared': 4}
+    with pytest.raises(KeyError) as e:
+        try:
+            raise KeyError('key')
+        except KeyError as e1:
+            reraise(e1, 'While loading', fields=fields)
+    assert get_context(e.value) == fields
+    assert 'While loading (args=1, separator=2, ' in format_exception(e.value)
+
+    with pytest.raises(KeyError) as e:
+        with reraising('While loading', fields=fields):
+            raise KeyError('key')
+    assert get_context(e.value) == fields
+
+
+def testUnpickleContextWithoutFields():
+    # As pickled before fields were supported.
+    context = _reraiseit._ReraiseContext(
+        'original message', [('While loading', '\n', ())]
+    )
+    assert six.text_type(context) == '\nWhile loading\noriginal message'
+    assert context.fields() == {}
+
+
+@pytest.mark.parametrize('backend', ['args_backend', 'notes_backend'])
+def testReraiseCollapsesRepeatedMessages(backend, request):
+    from six.moves.cPickle import dumps, loads
+
+    request.getfixturevalue(backend)
+    exception = reraise_many(KeyError('key'), 3, 'While handling request')
+    exception = reraise_many(exception, 500, 'While retrying')
+    exception = reraise_many(exception, 1, 'While running job')
+
+    context = exception.reraised_message
+    assert len(context.layers) == 3
+    text = format_exception(exception)
+    assert (
+        'While running job\n'
+        'While retrying (repeated 500×)\n'
+        'While handling request (repeated 3×)\n'
+    ) in text
+
+    assert format_exception(loads(dumps(exception))) == text
+
+
+@pytest.mark.usefixtures('args_backend')
+def testReraiseDoesntCollapseDifferentArguments():
+    exception = reraise_many(KeyError('key'), 3, 'While handling layer %d')
+    assert len(exception.reraised_message.layers) == 3
+    assert (
+        'While handling layer 2\n'
+        'While handling layer 1\n'
+        'While handling layer 0\n'
+    ) in exception_to_unicode(exception)
+
+
+@pytest.mark.usefixtures('args_backend')
+def testReraiseLimitsLayers():
+    from six.moves.cPickle import dumps, loads
+    from zerotk.reraiseit import configure
+
+    previous = configure(max_layers=5)
+    try:
+        exception = reraise_many(KeyError('key'), 1000)
+        assert len(exception.reraised_message.layers) == 5
+        text = exception_to_unicode(exception)
+        assert text == (
+            '\nWhile handling layer 999'
+            '\nWhile handling layer 998'
+            '\n[... 995 layers elided ...]'
+            '\nWhile handling layer 2'
+            '\nWhile handling layer 1'
+            '\nWhile handling layer 0'
+            "\n'key'"
+        )
+
+        pickled_exception = loads(dumps(exception))
+        assert exception_to_unicode(pickled_exception) == text
+        pickled_exception = reraise_many(pickled_exception, 1, 'Back in %d')
+        assert '[... 996 layers elided ...]' in (
+            exception_to_unicode(pickled_exception)
+        )
+    finally:
+        configure(**previous)
+
+
+@pytest.mark.usefixtures('notes_backend')
+def testReraiseAddsOneNotePerLayer():
+    from six.moves.cPickle import dumps, loads
+    from zerotk.reraiseit import configure
+
+    previous = configure(max_layers=5)
+    try:
+        exception = reraise_many(KeyError('key'), 2)
+        exception.add_note('user note')
+        first = exception.__notes__[1]
+        assert six.text_type(first) == 'While handling layer 0'
+
+        # Adding layers doesn't rewrite the notes of the previous ones.
+        exception = reraise_many(exception, 3, 'While retrying')
+        assert exception.__notes__[-2] is first
+        assert [six.text_type(note) for note in exception.__notes__] == [
+            'While retrying (repeated 3\u00d7)',
+            'While handling layer 1',
+            'While handling layer 0',
+            'user note',
+        ]
+
+        exception = reraise_many(exception, 1000)
+        assert [six.text_type(note) for note in exception.__notes__] == [
+            'While handling layer 999',
+            'While handling layer 998',
+            '[... 998 layers elided ...]',
+            'While retrying (repeated 3\u00d7)',
+            'While handling layer 1',
+            'While handling layer 0',
+            'user note',
+        ]
+
+        pickled_exception = loads(dumps(exception))
+        pickled_exception = reraise_many(pickled_exception, 1, 'Back in %d')
+        assert [
+            six.text_type(note) for note in pickled_exception.__notes__
+        ] == [
+            'Back in 0',
+            'While handling layer 999',
+            '[... 999 layers elided ...]',
+            'While retrying (repeated 3\u00d7)',
+            'While handling layer 1',
+            'While handling layer 0',
+            'user note',
+        ]
+    finally:
+        configure(**previous)
+
+
+def reraise_shared(exception, message):
+    try:
+        try:
+            raise exception
+        except Exception as e1:
+            reraise(_reraiseit.shared(e1), message)
+    except Exception as e2:
+        return e2
+
+
+@pytest.mark.parametrize('backend', ['args_backend', 'notes_backend'])
+@pytest.mark.parametrize(
+    'exception',
+    [
+        KeyError('key'),
+        OSError(2, 'No such file', 'a.txt'),
+        CodedError(3, 'broken'),
+    ],
+    ids=['KeyError', 'OSError', 'CodedError'],
+)
+def testReraiseShared(backend, exception, request):
+    request.getfixturevalue(backend)
+    shared = reraise_many(exception, 1, 'While computing')
+    text = exception_to_unicode(shared)
+    notes = list(getattr(shared, '__notes__', ()))
+    args = shared.args
+
+    first = reraise_shared(shared, 'While waiting in first')
+    second = reraise_shared(shared, 'While waiting in second')
+
+    # The shared exception is unchanged (except for its traceback, set by
+    # "raise").
+    assert exception_to_unicode(shared) == text
+    assert list(getattr(shared, '__notes__', ())) == notes
+    assert shared.args == args
+    assert shared.reraised_message.depth() == 1
+
+    for copy, message in [
+        (first, 'While waiting in first'),
+        (second, 'While waiting in second'),
+    ]:
+        assert copy is not shared
+        assert isinstance(copy, type(exception))
+        assert copy.args == args
+        assert copy.__dict__.get('code') == shared.__dict__.get('code')
+        assert copy.reraised_message.depth() == 2
+        copy_text = format_exception(copy)
+        assert message + '\nWhile computing\n' in copy_text
+        assert copy_text.count('While waiting') == 1
+
+
+@pytest.mark.usefixtures('args_backend')
+def testReraiseSharedFromThreads():
+    import threading
+
+    shared = KeyError('key')
+    results = []
+
+    def wait(index):
+        for _i in range(100):
+            exception = reraise_shared(shared, 'While waiting in %d' % index)
+            results.append(exception.reraised_message.depth())
+
+    threads = [threading.Thread(target=wait, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [1] * 800
+    assert 'reraised_message' not in shared.__dict__
+    assert exception_to_unicode(shared) == "'key'"
@@ -0,0 +1,215 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+
+from zerotk.reraiseit import reraise_iter, reraising, reraising_call
+
+from reraise_helpers import format_exception
+
+
+def testReraisingContextManager():
+    with pytest.raises(KeyError) as e:
+        with reraising('While loading %s', 'file.txt'):
+            raise KeyError('key')
+
+    assert 'While loading file.txt' in format_exception(e.value)
+    assert "'key'" in format_exception(e.value)
+
+
+def testReraisingDecorator():
+
+    @reraising('While loading')
+    def load(value):
+        if value is None:
+            raise ValueError('no value')
+        return value
+
+    assert load.__name__ == 'load'
+    assert load(1) == 1
+    with pytest.raises(ValueError) as e:
+        load(None)
+    assert 'While loading' in format_exception(e.value)
+
+
+def testReraisingFormatsOnlyOnFailure():
+    calls = []
+
+    class Expensive(object):
+        def __str__(self):
+            calls.append(None)
+            return 'expensive'
+
+    def describe():
+        calls.append(None)
+        return 'described'
+
+    scope = reraising('While processing %s', Expensive())
+    for _i in range(3):
+        with scope:
+            pass
+    with reraising(describe):
+        pass
+    assert calls == []
+
+    with pytest.raises(RuntimeError) as e:
+        with reraising(describe):
+            raise RuntimeError('error')
+    assert 'described' in format_exception(e.value)
+    assert len(calls) == 1
+
+
+def testReraisingIgnoresBaseExceptions():
+    with pytest.raises(KeyboardInterrupt) as e:
+        with reraising('While processing'):
+            raise KeyboardInterrupt()
+    assert 'While processing' not in format_exception(e.value)
+
+
+def testReraisingUnexpectedKeyword():
+    with pytest.raises(TypeError):
+        reraising('message', sep=' ')
+
+
+def testReraisingFields():
+    from zerotk.reraiseit import get_context
+
+    with pytest.raises(KeyError) as e:
+        with reraising('While loading', fields={'shard': 17}):
+            raise KeyError('key')
+    assert 'While loading (shard=17)' in format_exception(e.value)
+    assert get_context(e.value) == {'shard': 17}
+
+
+def testReraisingShared():
+    error = KeyError('key')
+    with pytest.raises(KeyError) as e:
+        with reraising('While waiting', shared=True):
+            raise error
+    assert e.value is not error
+    assert 'While waiting' in format_exception(e.value)
+    assert 'While waiting' not in format_exception(error)
+
+
+def describe(index, item):
+    return 'While processing record {} ({!r})'.format(index, item)
+
+
+def records(count, fail_at=None):
+    for i in range(count):
+        if i == fail_at:
+            raise IOError('truncated file')
+        yield 'r{}'.format(i)
+
+
+def testReraiseIterConsumer():
+    calls = []
+
+    def describe_calls(index, item):
+        calls.append((index, item))
+        return describe(index, item)
+
+    processed = []
+    with pytest.raises(ValueError) as e:
+        with reraise_iter(records(5), describe_calls) as items:
+            for item in items:
+                if item == 'r3':
+                    raise ValueError('invalid record')
+                processed.append(item)
+
+    assert processed == ['r0', 'r1', 'r2']
+    # Only the failed item is described, once.
+    text = format_exception(e.value)
+    assert "While processing record 3 ('r3')" in text
+    assert 'invalid record' in text
+    assert calls == [(3, 'r3')]
+
+
+def testReraiseIterProducer():
+    # Failures of the iterable itself are annotated, even without "with".
+    processed = []
+    with pytest.raises(IOError) as e:
+        for item in reraise_iter(records(5, fail_at=2), describe):
+            processed.append(item)
+
+    assert processed == ['r0', 'r1']
+    text = format_exception(e.value)
+    assert 'While processing record 2 (None)' in text
+    assert text.count('While processing') == 1
+
+    # Exceptions after the iteration ended are not annotated.
+    with pytest.raises(KeyError) as e:
+        with reraise_iter(records(2), describe) as items:
+            assert list(items) == ['r0', 'r1']
+            raise KeyError('key')
+    assert 'While processing' not in format_exception(e.value)
+
+
+def testReraiseIterBreak():
+    # Exceptions after leaving the loop are not annotated.
+    with pytest.raises(KeyError) as e:
+        with reraise_iter(records(5), describe) as items:
+            for item in items:
+                if item == 'r3':
+                    break
+            raise KeyError('key')
+    assert 'While processing' not in format_exception(e.value)
+
+    def find(items):
+        for item in items:
+            if item == 'r3':
+                return item
+
+    with pytest.raises(KeyError) as e:
+        with reraise_iter(records(5), describe) as items:
+            assert find(items) == 'r3'
+            raise KeyError('key')
+    assert 'While processing' not in format_exception(e.value)
+
+
+def testReraisingCall():
+    calls = []
+
+    @reraising_call(exclude=['password'], max_repr=20)
+    def connect(host, port=5432, password=None, *args, **options):
+        calls.append(host)
+        if host is None:
+            raise KeyError('no host')
+        return host
+
+    assert connect.__name__ == 'connect'
+    assert connect('db') == 'db'
+
+    with pytest.raises(KeyError) as e:
+        connect(None, 5433, 'secret', 'x' * 100, timeout=3)
+    text = format_exception(e.value)
+    assert (
+        "While calling testReraisingCall.<locals>.connect(host=None, "
+        "port=5433, password=<hidden>, "
+        "'xxxxxxxxx[... 82 chars elided ...]xxxxxxxxx', timeout=3)"
+    ) in text
+
+    # Calls not matching the signature are shown as they are.
+    with pytest.raises(TypeError) as e:
+        connect(1, 2, 3, 4, host=5)
+    assert 'connect(1, 2, 3, 4, host=5)' in format_exception(e.value)
+
+
+def testReraisingCallInclude():
+    signatures = []
+
+    @reraising_call(include=['shard'])
+    def load(shard, path):
+        raise KeyError(path)
+
+    for shard in range(3):
+        with pytest.raises(KeyError) as e:
+            load(shard, '/data/{}.bin'.format(shard))
+        text = format_exception(e.value)
+        assert 'While calling testReraisingCallInclude.<locals>.load(' \
+            'shard={})'.format(shard) in text
+        signatures.append(
+            e.value.reraised_message.layers[-1][0].call._signature
+        )
+    # The signature is obtained once.
+    assert signatures[0] is signatures[1] is signatures[2]
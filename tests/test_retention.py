@@ -0,0 +1,188 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import gc
+import pytest
+import six
+import traceback
+
+from zerotk.reraiseit import (
+    configure,
+    release_traceback,
+    reraise,
+    shared,
+)
+
+from reraise_helpers import Payload, make_payload
+
+pytestmark = pytest.mark.skipif(
+    six.PY2, reason='Frames can only be released on Python 3'
+)
+
+
+# Only shown by live frames: the summary has no source lines.
+RAISE_SOURCE = "raise RuntimeError('original message')"
+
+
+def format_exception(exception):
+    return ''.join(
+        traceback.format_exception(
+            type(exception), exception, exception.__traceback__
+        )
+    )
+
+
+def fail(payload):
+    raise RuntimeError('original message')
+
+
+def fail_and_reraise(payload_refs):
+    try:
+        fail(make_payload(payload_refs))
+    except RuntimeError as e:
+        reraise(e, 'While failing')
+
+
+def catch(function, *args):
+    try:
+        function(*args)
+    except Exception as e:
+        return e
+
+
+@pytest.fixture
+def retention(request):
+    previous = configure(traceback_retention=request.param)
+    yield request.param
+    configure(**previous)
+
+
+@pytest.mark.parametrize('retention', ['full'], indirect=True)
+def testFullRetention(retention):
+    payload_refs = []
+    exception = catch(fail_and_reraise, payload_refs)
+    gc.collect()
+    assert payload_refs[0]() is not None
+    assert RAISE_SOURCE in format_exception(exception)
+
+
+@pytest.mark.parametrize('retention', ['clear_locals'], indirect=True)
+def testClearLocalsRetention(retention):
+    payload_refs = []
+    exception = catch(fail_and_reraise, payload_refs)
+    gc.collect()
+    assert payload_refs[0]() is None
+    # The frames are still in the traceback.
+    assert RAISE_SOURCE in format_exception(exception)
+
+
+@pytest.mark.parametrize('retention', ['summary'], indirect=True)
+def testSummaryRetention(retention):
+    payload_refs = []
+    exception = catch(fail_and_reraise, payload_refs)
+    gc.collect()
+    assert payload_refs[0]() is None
+
+    frames = exception.reraised_message.frames()
+    assert [name for _filename, _lineno, name in frames] == ['fail']
+    assert frames[0][0] == __file__.replace('.pyc', '.py')
+
+    text = format_exception(exception)
+    assert RAISE_SOURCE not in text
+    assert 'While failing' in text
+    assert 'Released frames (most recent call last):' in text
+    assert 'line {}, in fail'.format(frames[0][1]) in text
+
+
+@pytest.mark.parametrize('policy', ['clear_locals', 'summary'])
+def testReleaseTraceback(policy):
+    from six.moves.cPickle import dumps, loads
+
+    payload_refs = []
+    exception = catch(fail, make_payload(payload_refs))
+    stored = release_traceback(exception, policy)
+    del exception
+    gc.collect()
+    assert payload_refs[0]() is None
+    assert 'original message' in format_exception(stored)
+
+    if policy == 'summary':
+        assert stored.__traceback__ is None
+        assert 'line {}, in fail'.format(
+            fail.__code__.co_firstlineno + 1
+        ) in format_exception(stored)
+        assert (
+            loads(dumps(stored)).reraised_message.frames() ==
+            stored.reraised_message.frames()
+        )
+
+
+def testReleaseTracebackChained():
+    payload_refs = []
+
+    def fail_chained():
+        try:
+            fail(make_payload(payload_refs))
+        except RuntimeError as e:
+            six.raise_from(ValueError('chained'), e)
+
+    exception = catch(fail_chained)
+    stored = release_traceback(exception, 'summary')
+    del exception
+    gc.collect()
+    assert payload_refs[0]() is None
+    assert stored.__cause__.__traceback__ is None
+    assert RAISE_SOURCE not in format_exception(stored)
+
+
+def testReleaseTracebackUnknownPolicy():
+    with pytest.raises(ValueError):
+        release_traceback(RuntimeError(), 'unknown')
+
+
+def testClearLocalsKeepsSuspendedGenerators():
+
+    def produce():
+        try:
+            raise RuntimeError('original message')
+        except RuntimeError as e:
+            yield e
+        yield 'after'
+
+    generator = produce()
+    exception = next(generator)
+    release_traceback(exception, 'clear_locals')
+    assert list(generator) == ['after']
+
+    # Reraising a stored exception only releases the frames below the
+    # handler, which may be suspended too.
+    generator = produce()
+    exception = next(generator)
+    previous = configure(traceback_retention='clear_locals')
+    try:
+        with pytest.raises(RuntimeError):
+            try:
+                raise exception
+            except RuntimeError as e:
+                reraise(e, 'While consuming')
+    finally:
+        configure(**previous)
+    assert list(generator) == ['after']
+
+
+@pytest.mark.parametrize('retention', ['summary'], indirect=True)
+def testSummaryRetentionShared(retention):
+    exception = catch(fail, Payload())
+    frames = traceback.extract_tb(exception.__traceback__)
+
+    with pytest.raises(RuntimeError) as e:
+        try:
+            raise exception
+        except RuntimeError as e1:
+            reraise(shared(e1), 'While sharing')
+    assert e.value is not exception
+    assert 'Released frames' in format_exception(e.value)
+
+    # The traceback of the original exception is left untouched.
+    assert traceback.extract_tb(exception.__traceback__)[-2:] == frames
+    assert RAISE_SOURCE in format_exception(exception)
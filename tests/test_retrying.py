@@ -0,0 +1,126 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import sys
+
+import pytest
+
+from zerotk.reraiseit import Attempt, format_exception, retrying
+
+from reraise_helpers import make_payload
+
+
+class Flaky(object):
+    """
+    Fails the first `failures` calls.
+    """
+
+    def __init__(self, failures, exception_type=IOError):
+        self.failures = failures
+        self.exception_type = exception_type
+        self.calls = 0
+        self.payload_refs = []
+
+    def __call__(self, value):
+        return self.call(value, make_payload(self.payload_refs))
+
+    def call(self, value, payload):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.exception_type(
+                'failure {} {}'.format(self.calls, 'x' * 100)
+            )
+        return value
+
+
+def testRetrying():
+    sleeps = []
+    retry = retrying(
+        attempts=4, delay=0.5, backoff=2.0, max_delay=1.5,
+        sleep=sleeps.append,
+    )
+    flaky = Flaky(2)
+    assert retry.call(flaky, 'value') == 'value'
+    assert flaky.calls == 3
+    assert sleeps == [0.5, 1.0]
+
+    flaky = Flaky(10)
+    with pytest.raises(IOError) as e:
+        retry.call(flaky, 'value')
+    assert flaky.calls == 4
+    assert sleeps[2:] == [0.5, 1.0, 1.5]
+
+    text = format_exception(e.value)
+    assert 'After 4 attempts\n  #1 OSError: failure 1 xx' in text
+    assert '\n  #3 OSError: failure 3 xx' in text
+    assert text.endswith('OSError: failure 4 ' + 'x' * 100 + '\n')
+
+    # Only the last exception (and its traceback) is kept.
+    assert [ref() is not None for ref in flaky.payload_refs] == (
+        [False, False, False, True]
+    )
+
+    history = e.value.reraised_message.layers[-1][0]
+    first = history.attempts[0]
+    assert isinstance(first, Attempt)
+    assert first.number == 1
+    assert first.exception_type is OSError
+    assert len(first.message) <= 80 + len('[... 21 chars elided ...]')
+
+
+def testRetryingManyAttempts():
+    sleeps = []
+    retry = retrying(
+        attempts=2000, delay=0.5, backoff=2.0, max_delay=1.5,
+        sleep=sleeps.append,
+    )
+    flaky = Flaky(1999)
+    assert retry.call(flaky, 'value') == 'value'
+    assert sleeps[:3] == [0.5, 1.0, 1.5]
+    assert sleeps[-1] == 1.5
+
+
+def testRetryingDecorator():
+
+    @retrying(attempts=2, delay=0, exceptions=KeyError)
+    def load(flaky):
+        return flaky('value')
+
+    assert load.__name__ == 'load'
+    assert load(Flaky(1, KeyError)) == 'value'
+
+    # Other exceptions are not retried.
+    flaky = Flaky(1, ValueError)
+    with pytest.raises(ValueError) as e:
+        load(flaky)
+    assert flaky.calls == 1
+    assert 'attempt' not in format_exception(e.value)
+
+    with pytest.raises(ValueError):
+        retrying(attempts=0)
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 7), reason='asyncio.run requires Python 3.7'
+)
+def testRetryingCoroutineFunction():
+    import asyncio
+    import inspect
+
+    flaky = Flaky(10)
+
+    @retrying(attempts=3, delay=0)
+    async def fetch(value):
+        await asyncio.sleep(0)
+        return flaky(value)
+
+    assert inspect.iscoroutinefunction(fetch)
+    with pytest.raises(IOError) as e:
+        asyncio.run(fetch('value'))
+    assert flaky.calls == 3
+    assert 'After 3 attempts\n  #1 OSError: failure 1' in (
+        format_exception(e.value)
+    )
+
+    flaky = Flaky(1)
+    assert asyncio.run(fetch('value')) == 'value'
@@ -0,0 +1,142 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import io
+
+import pytest
+
+from zerotk.reraiseit import (
+    ExceptionReader,
+    ExceptionRecord,
+    ExceptionWriter,
+    dumps_exceptions,
+    format_exception,
+    loads_exceptions,
+    reraise,
+)
+from zerotk.reraiseit import _reraiseit
+
+
+class LoadError(Exception):
+    pass
+
+
+def fail(path):
+    raise LoadError('cannot load {}'.format(path))
+
+
+def load(path):
+    try:
+        fail(path)
+    except LoadError as e:
+        reraise(
+            e, 'While loading %s', args=(path,),
+            fields={'shard': 17, 'path': path},
+        )
+
+
+def run(path):
+    try:
+        try:
+            load(path)
+        except LoadError as e:
+            reraise(e, 'While running ☃', fields={'owner': object()})
+    except LoadError as e:
+        return e
+
+
+@pytest.mark.parametrize('backend', ['args', 'notes'])
+def testDumpsExceptions(backend, monkeypatch):
+    if backend == 'notes' and not hasattr(BaseException, 'add_note'):
+        pytest.skip('PEP 678 notes require Python 3.11')
+    monkeypatch.setattr(
+        _reraiseit, '_annotate', _reraiseit._BACKENDS[backend]
+    )
+    exception = run('a.bin')
+    [record] = loads_exceptions(dumps_exceptions([exception]))
+
+    assert isinstance(record, ExceptionRecord)
+    assert record.type_name == 'test_wire.LoadError'
+    assert record.original == 'cannot load a.bin'
+    assert record.messages == [
+        'While running ☃ (owner={!r})'.format(
+            exception.reraised_message.layers[-1][3]['owner']
+        ),
+        "While loading a.bin (shard=17, path='a.bin')",
+    ]
+    assert record.fields['shard'] == 17
+    assert record.fields['path'] == 'a.bin'
+    assert record.fields['owner'].startswith('<object object at')
+    filename = __file__.replace('.pyc', '.py')
+    assert [frame for frame in record.frames if frame[0] == filename] == [
+        (filename, run.__code__.co_firstlineno + 5, 'run'),
+        (filename, run.__code__.co_firstlineno + 3, 'run'),
+        (filename, load.__code__.co_firstlineno + 4, 'load'),
+        (filename, load.__code__.co_firstlineno + 2, 'load'),
+        (filename, fail.__code__.co_firstlineno + 1, 'fail'),
+    ]
+    assert record.format() == format_exception(exception, source=False)
+
+
+def testNamesAreWrittenOncePerStream():
+    exceptions = [run('{}.bin'.format(i)) for i in range(10)]
+    data = dumps_exceptions(exceptions)
+    assert data.count(b'test_wire.LoadError') == 1
+    assert data.count(__file__.replace('.pyc', '.py').encode('utf-8')) == 1
+
+    records = loads_exceptions(data)
+    assert [record.original for record in records] == [
+        'cannot load {}.bin'.format(i) for i in range(10)
+    ]
+    assert records[-1].frames == records[0].frames
+
+
+def testExceptionReaderStreaming():
+    stream = io.BytesIO()
+    writer = ExceptionWriter(stream)
+    writer.write(KeyError('key'))
+    writer.write(run('a.bin'))
+
+    stream.seek(0)
+    reader = ExceptionReader(stream)
+    record = reader.read()
+    assert record == ExceptionRecord('KeyError', "'key'", [], {}, [])
+    assert record.format() == "KeyError: 'key'\n"
+    assert reader.read().original == 'cannot load a.bin'
+    assert reader.read() is None
+
+    assert loads_exceptions(b'') == []
+    with pytest.raises(ValueError):
+        loads_exceptions(b'pickle')
+    with pytest.raises(ValueError):
+        loads_exceptions(stream.getvalue()[:-1])
+
+
+class UnprintableError(Exception):
+    def __str__(self):
+        raise RuntimeError('no text')
+
+
+def testWriteAfterFailure(monkeypatch):
+    from zerotk.reraiseit import _wire
+
+    stream = io.BytesIO()
+    writer = ExceptionWriter(stream)
+    writer.write(UnprintableError())
+
+    # A failed record doesn't change the names already written.
+    def fail(exception):
+        raise MemoryError()
+
+    monkeypatch.setattr(_wire, '_messages', fail)
+    with pytest.raises(MemoryError):
+        writer.write(run('a.bin'))
+    monkeypatch.undo()
+    writer.write(run('b.bin'))
+
+    records = loads_exceptions(stream.getvalue())
+    assert [record.original for record in records] == [
+        '<unprintable message: RuntimeError>', 'cannot load b.bin'
+    ]
+    assert records[1].type_name == 'test_wire.LoadError'
+    assert records[1].frames[-1][2] == 'fail'
@@ -1,3 +1,71 @@
-from ._reraiseit import reraise, exception_to_unicode
+from ._aggregator import FailureAggregator
+from ._ambient import push_context
+from ._formatting import format_exception
+from ._logging import ReraiseFilter, ReraiseFormatter
+from ._observers import (
+    ReraiseEvent,
+    ReraiseStats,
+    add_observer,
+    remove_observer,
+)
+from ._reraiseit import (
+    reraise,
+    exception_to_unicode,
+    get_context,
+    release_traceback,
+    shared,
+)
+from ._profiler import (
+    ReraiseProfiler,
+    get_profiler,
+    start_profiling,
+    stop_profiling,
+)
+from ._reraising import (
+    context_boundary,
+    reraise_iter,
+    reraising,
+    reraising_call,
+)
+from ._retrying import Attempt, retrying
+from ._settings import configure
+from ._wire import (
+    ExceptionReader,
+    ExceptionRecord,
+    ExceptionWriter,
+    dumps_exceptions,
+    loads_exceptions,
+)
 
-__all__ = [reraise, exception_to_unicode]
+__all__ = [
+    reraise,
+    exception_to_unicode,
+    reraising,
+    configure,
+    release_traceback,
+    push_context,
+    context_boundary,
+    get_context,
+    add_observer,
+    remove_observer,
+    ReraiseEvent,
+    ReraiseStats,
+    ReraiseProfiler,
+    get_profiler,
+    start_profiling,
+    stop_profiling,
+    format_exception,
+    ReraiseFilter,
+    ReraiseFormatter,
+    ExceptionWriter,
+    ExceptionReader,
+    ExceptionRecord,
+    dumps_exceptions,
+    loads_exceptions,
+    reraise_iter,
+    FailureAggregator,
+    retrying,
+    Attempt,
+    reraising_call,
+    shared,
+]
@@ -0,0 +1,187 @@
+from __future__ import unicode_literals
+"""
+    Collection of the failures of batch jobs that keep going after errors.
+"""
+import threading
+
+import six
+
+from ._ambient import _AmbientMessage
+from ._context import _ReraiseContext
+from ._formatting import _type_name
+from ._groups import BaseExceptionGroup
+from ._reraiseit import reraise
+
+# Key of the failures counted after "max_groups" distinct keys.
+_OTHER = '<other>'
+
+
+class FailureAggregator(object):
+    """
+    Collects the failures of a batch job in bounded memory, no matter how
+    many items fail:
+        * the number of failures per exception type and per context message
+          (the message templates given to `reraise`, not their formatted
+          text, so each item doesn't add a new key);
+        * the first `max_examples` exceptions, with their tracebacks. The
+          others are only counted: nothing of them (nor of their tracebacks)
+          is kept.
+
+    Can be used as a context manager, which collects the exceptions raised
+    inside the block and suppresses them. Can be shared between threads.
+
+    :param int max_examples:
+        Number of exceptions kept.
+
+    :param int max_groups:
+        Maximum number of exception types and of messages counted: the
+        failures with other types (or messages) are counted as "<other>".
+
+    e.g.
+        failures = FailureAggregator(max_examples=10)
+        for record in records:
+            with failures:
+                store(record)
+        failures.raise_if_failed('While storing records')
+    """
+
+    def __init__(self, max_examples=10, max_groups=100):
+        self.max_examples = max_examples
+        self.max_groups = max_groups
+        self._lock = threading.Lock()
+        self._count = 0
+        self._by_type = {}
+        self._by_message = {}
+        self._examples = []
+
+    def add(self, exception):
+        """
+        Counts a failure, keeping the exception if there are less than
+        `max_examples` already kept.
+
+        :param BaseException exception:
+        """
+        type_key = _type_name(type(exception))
+        message_keys = _message_keys(exception)
+        with self._lock:
+            self._count += 1
+            _increment(self._by_type, type_key, self.max_groups)
+            for key in message_keys:
+                _increment(self._by_message, key, self.max_groups)
+            if len(self._examples) < self.max_examples:
+                self._examples.append(exception)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None or not issubclass(exception_type, Exception):
+            return False
+        if exception is None:
+            exception = exception_type()
+        self.add(exception)
+        return True
+
+    @property
+    def count(self):
+        """
+        :return int:
+            The number of failures added.
+        """
+        return self._count
+
+    @property
+    def examples(self):
+        """
+        :return list(BaseException):
+            The first exceptions added.
+        """
+        with self._lock:
+            return list(self._examples)
+
+    def counts(self):
+        """
+        :return dict:
+            With "failures" (the number of failures), "types" (the number of
+            failures by exception type name) and "messages" (the number of
+            failures by message template).
+        """
+        with self._lock:
+            return {
+                'failures': self._count,
+                'types': dict(self._by_type),
+                'messages': dict(self._by_message),
+            }
+
+    def summary(self):
+        """
+        :return unicode:
+            e.g. "1200 failures (KeyError: 1000, ValueError: 200), showing 10"
+        """
+        counts = self.counts()
+        types = sorted(
+            counts['types'].items(), key=lambda item: (-item[1], item[0])
+        )
+        return '{} failure{} ({}), showing {}'.format(
+            counts['failures'],
+            '' if counts['failures'] == 1 else 's',
+            ', '.join('{}: {}'.format(name, count) for name, count in types),
+            len(self.examples),
+        )
+
+    def raise_if_failed(self, message=None, group=False):
+        """
+        Raises the failures added, if any, as a single exception: the first
+        exception kept, reraised (see `reraise`) with the summary of the
+        failures and the "failures" field.
+
+        :param unicode|None message:
+            Added before the summary.
+
+        :param bool group:
+            If True (and exception groups are supported), raises an exception
+            group with the exceptions kept instead.
+        """
+        examples = self.examples
+        if not examples:
+            return
+        summary = self.summary()
+        if message is not None:
+            summary = '{}: {}'.format(message, summary)
+        if group and BaseExceptionGroup is not None:
+            raise BaseExceptionGroup(summary, examples)
+        exception = examples[0]
+        try:
+            raise exception
+        except BaseException as e:
+            reraise(e, summary, fields={'failures': self._count})
+
+
+def _increment(counts, key, max_groups):
+    if key not in counts and len(counts) >= max_groups:
+        key = _OTHER
+    counts[key] = counts.get(key, 0) + 1
+
+
+def _message_keys(exception):
+    """
+    :return set(unicode):
+        The templates of the messages added to the exception by `reraise`.
+    """
+    context = exception.__dict__.get('reraised_message')
+    if not isinstance(context, _ReraiseContext):
+        return ()
+    return set(_message_key(layer[0]) for layer in context.layers)
+
+
+def _message_key(message):
+    if isinstance(message, six.string_types):
+        return message
+    if isinstance(message, _AmbientMessage):
+        # The innermost message pushed.
+        return _message_key(message.node[0])
+    # Callables, including `functools.partial` (as used by `reraise_iter`).
+    function = getattr(message, 'func', message)
+    return getattr(
+        function, '__qualname__', getattr(function, '__name__', None)
+    ) or type(message).__name__
@@ -0,0 +1,160 @@
+from __future__ import unicode_literals
+"""
+    Ambient context: messages pushed on a stack, only attached to exceptions
+    that escape them.
+"""
+import threading
+
+from ._context import _format_message
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
+
+
+class _ThreadLocalVar(object):
+    """
+    Minimal `ContextVar` replacement when contextvars is not available: each
+    thread has its own value, but asyncio tasks share the value of their
+    thread.
+    """
+
+    def __init__(self, name, default=None):
+        self._local = threading.local()
+        self._default = default
+
+    def get(self):
+        return getattr(self._local, 'value', self._default)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+# The innermost node of the stack: a tuple (message, args, parent), where
+# parent is the next node or None.
+if ContextVar is not None:
+    _stack = ContextVar(str('zerotk.reraiseit.ambient'), default=None)
+else:
+    _stack = _ThreadLocalVar(str('zerotk.reraiseit.ambient'))
+
+
+class push_context(object):
+    """
+    Pushes a message on the ambient context while inside a block.
+
+    Pushing and popping are O(1) and the message is never formatted unless
+    an exception escapes the block: then, the innermost node is recorded in
+    the exception (once, even if it goes through many blocks) and the
+    messages are attached (see `reraise`) when the exception goes through
+    `reraise`, `reraising` or `context_boundary`.
+
+    Each thread and asyncio task has its own stack (using contextvars when
+    available).
+
+    :param unicode|callable message:
+        See `reraise`.
+
+    :param args:
+        Arguments to format the message.
+
+    e.g.
+        @context_boundary()
+        def handle(request):
+            with push_context('While handling request %s', request.id):
+                for path in request.paths:
+                    with push_context('While processing %s', path):
+                        process(path)
+    """
+
+    __slots__ = ('message', 'args', '_node', '_token')
+
+    def __init__(self, message, *args):
+        self.message = message
+        self.args = args
+
+    def __enter__(self):
+        self._node = (self.message, self.args, _stack.get())
+        self._token = _stack.set(self._node)
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        _stack.reset(self._token)
+        if exception is not None and isinstance(exception, Exception):
+            _record(exception, self._node)
+        return False
+
+
+class _PendingContext(object):
+    """
+    The innermost node of the ambient context escaped by an exception, kept
+    in its "reraised_pending_context" attribute.
+    """
+
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    def __reduce__(self):
+        # The messages are not attached yet and may not be picklable.
+        return (_unpickle_pending_context, ())
+
+
+def _unpickle_pending_context():
+    return None
+
+
+def _record(exception, node):
+    pending = exception.__dict__.get('reraised_pending_context')
+    if pending is not None:
+        # Keep the innermost node, unless it is left from a previous escape
+        # (an exception stored and raised again somewhere else).
+        current = pending.node
+        while current is not None:
+            if current is node:
+                return
+            current = current[2]
+    exception.reraised_pending_context = _PendingContext(node)
+
+
+def take_pending_message(exception):
+    """
+    Removes the ambient context recorded in an exception.
+
+    :return _AmbientMessage|None:
+        A message (see `reraise`) with the recorded messages from the
+        innermost up to the stack of the caller (excluded) or None if there
+        are none.
+    """
+    pending = exception.__dict__.pop('reraised_pending_context', None)
+    if pending is None or pending.node is _stack.get():
+        return None
+    return _AmbientMessage(pending.node, _stack.get())
+
+
+class _AmbientMessage(object):
+    """
+    A callable message (see `reraise`) rendering the messages of the ambient
+    context, outermost first.
+    """
+
+    __slots__ = ('node', 'stop')
+
+    def __init__(self, node, stop):
+        self.node = node
+        self.stop = stop
+
+    def __call__(self):
+        messages = []
+        node = self.node
+        while node is not None and node is not self.stop:
+            message, args, node = node
+            messages.append(_format_message(message, args))
+        messages.reverse()
+        return '\n'.join(messages)
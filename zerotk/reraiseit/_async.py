@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+"""
+    asyncio support for `reraising`, `reraising_call`, `reraise_iter` and
+    `retrying` (Python 3.5+).
+
+    Kept in a separate module since Python 2 can't parse "async def".
+"""
+import functools
+import timeit
+
+_timer = timeit.default_timer
+
+
+async def enter(scope):
+    return scope
+
+
+async def exit(scope, exception_type, exception, traceback):
+    return scope.__exit__(exception_type, exception, traceback)
+
+
+def wrap_coroutine_function(scope, function):
+    """
+    Decorates a coroutine function to reraise its exceptions with the
+    scope's message.
+    """
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await function(*args, **kwargs)
+        except Exception as e:
+            scope.reraise(e)
+
+    return wrapper
+
+
+def wrap_call_coroutine_function(call, function):
+    """
+    Decorates a coroutine function to reraise its exceptions with a message
+    showing the call (see `reraising_call`).
+    """
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await function(*args, **kwargs)
+        except Exception as e:
+            call.reraise(e, args, kwargs)
+
+    return wrapper
+
+
+async def wrap_awaitable(scope, awaitable):
+    """
+    Awaits `awaitable`, reraising its exceptions with the scope's message.
+    """
+    try:
+        return await awaitable
+    except Exception as e:
+        scope.reraise(e)
+
+
+class AsyncIterator(object):
+    """
+    Iterates over an asynchronous iterable for `reraise_iter`.
+    """
+
+    __slots__ = ('scope', 'iterator')
+
+    def __init__(self, scope, iterable):
+        scope._index = -1
+        self.scope = scope
+        self.iterator = iterable.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    def __del__(self):
+        # Released by the consumer's loop, as a generator would be closed.
+        self.scope._stop(1)
+
+    async def __anext__(self):
+        scope = self.scope
+        try:
+            item = await self.iterator.__anext__()
+        except StopAsyncIteration:
+            scope._index = None
+            scope._item = None
+            raise
+        except Exception as e:
+            scope._fail(e)
+        scope._index += 1
+        scope._item = item
+        return item
+
+
+def retry_coroutine_function(scope, function):
+    """
+    Decorates a coroutine function to retry it (see `retrying`).
+    """
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        return await scope.call(function, *args, **kwargs)
+
+    return wrapper
+
+
+async def retry(scope, history, function, args, kwargs):
+    """
+    Awaits the coroutine function until it succeeds (see `retrying`).
+    """
+    import asyncio
+
+    number = 1
+    while True:
+        start = _timer()
+        try:
+            return await function(*args, **kwargs)
+        except scope.exceptions as e:
+            scope._failed(history, number, e, start)
+        await asyncio.sleep(scope._delay(number))
+        number += 1
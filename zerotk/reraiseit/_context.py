@@ -0,0 +1,733 @@
+from __future__ import unicode_literals
+"""
+    The context chain attached to exceptions by `reraise`.
+"""
+import functools
+
+import six
+
+from ._settings import settings
+
+
+@six.python_2_unicode_compatible
+class _ReraiseContext(object):
+    """
+    Append-only chain of messages added to an exception by `reraise`.
+
+    Adding a layer doesn't depend on the number of layers added before: the
+    messages are only formatted and joined together (and the result cached)
+    when the text is requested, usually by `str()` or by a traceback
+    formatter. Exceptions that are caught and discarded never pay for
+    building the final text. When the chain is attached as notes, each layer
+    adds its own note instead, also formatted when first shown (see
+    `_LazyNote`).
+
+    :ivar unicode original:
+        The exception's own message, obtained once when the first layer is
+        added. None when the chain is attached as notes, in which case only
+        the added messages are rendered.
+
+    :ivar list(unicode)|None notes:
+        When attached as notes: the note of each layer in the exception's
+        "__notes__" (which must only contain strings), found by identity to
+        be replaced when the layer is repeated or removed.
+
+    :ivar list(tuple(unicode|callable,unicode,tuple|None,dict|None)) layers:
+        The `(message, separator, args, fields)` of each layer, innermost
+        first. See `_format_message`.
+
+    Consecutive identical layers (a retry loop or a recursion reraising with
+    the same message) are kept once with a repetition count and only the
+    first and last layers are kept when there are more than the
+    "max_layers" setting, so memory and time per layer stay constant no
+    matter how many times an exception is reraised.
+    """
+
+    __slots__ = (
+        'original',
+        'notes',
+        'layers',
+        '_counts',
+        '_elided',
+        '_elided_note',
+        '_frames_note',
+        '_formatted',
+        '_frame_chunks',
+        '_text',
+        '__weakref__',
+    )
+
+    def __init__(self, original, layers=None, frames=None):
+        self.original = original
+        if layers is None:
+            self.layers = []
+        else:
+            # Contexts pickled by older versions have no fields.
+            self.layers = [
+                layer if len(layer) == 4 else tuple(layer) + (None,)
+                for layer in layers
+            ]
+        # The repetitions of each layer, None while there are none.
+        self._counts = None
+        self.notes = None
+        if original is None:
+            self.notes = [None] * len(self.layers)
+        # The (index, count) of the layers removed by "max_layers".
+        self._elided = None
+        # The notes replacing the removed layers and showing the frames.
+        self._elided_note = None
+        self._frames_note = None
+        # The formatted message of each layer, None until formatted. When
+        # attached as notes, the layer's note, which formats it once.
+        self._formatted = [None] * len(self.layers)
+        self._frame_chunks = [frames] if frames else []
+        self._text = None
+
+    def add(self, message, separator, args=(), fields=None, notes=None):
+        """
+        Appends a new layer, invalidating the cached text.
+
+        :param list(unicode)|None notes:
+            The exception's "__notes__" when the chain is attached as notes:
+            the layer's note is added to it (before the note of the previous
+            layer, so the messages are shown outermost first) or, when the
+            last layer is repeated, replaces that layer's note.
+        """
+        layer = (message, separator, args, fields or None)
+        layers = self.layers
+        counts = self._counts
+        if layers and _same_layer(layers[-1], layer):
+            if counts is None:
+                counts = self._counts = [1] * len(layers)
+            counts[-1] += 1
+            if notes is not None:
+                message = self._formatted[-1]
+                if message is None:
+                    message = self._formatted_message(len(layers) - 1)
+                note = _repeated_note(message, counts[-1])
+                _replace_note(notes, self.notes[-1], note)
+                self.notes[-1] = note
+        else:
+            layers.append(layer)
+            self._formatted.append(None)
+            if counts is not None:
+                counts.append(1)
+            if notes is not None:
+                note = self._formatted[-1] = _layer_note(message, args, fields)
+                index = -1
+                if self.notes:
+                    index = _find_note(notes, self.notes[-1])
+                if index == -1:
+                    notes.append(note)
+                else:
+                    notes.insert(index, note)
+                self.notes.append(note)
+            limit = settings.max_layers
+            if limit is not None and len(layers) > limit:
+                self._elide(_split_limit(limit)[0], notes)
+        self._text = None
+
+    def _elide(self, index, notes=None):
+        """
+        Removes the layer at `index`: the oldest of the last layers kept.
+
+        :param list(unicode)|None notes:
+            See `add`. The layer's note is removed and a single note takes
+            the place of all removed layers.
+        """
+        del self.layers[index]
+        del self._formatted[index]
+        count = 1
+        if self._counts is not None:
+            count = self._counts.pop(index)
+        if self._elided is not None:
+            count += self._elided[1]
+        self._elided = (index, count)
+        if notes is not None:
+            removed = self.notes.pop(index)
+            note = _elided('', count, 'layers', '')
+            position = _find_note(notes, self._elided_note)
+            if position == -1:
+                _replace_note(notes, removed, note)
+            else:
+                notes[position] = note
+                # The layer removed is shown right before the elided ones.
+                if position and notes[position - 1] is removed:
+                    del notes[position - 1]
+                else:
+                    position = _find_note(notes, removed)
+                    if position != -1:
+                        del notes[position]
+            self._elided_note = note
+
+    def depth(self):
+        """
+        :return int:
+            The number of messages added, including repetitions and the
+            layers removed by "max_layers".
+        """
+        result = len(self.layers)
+        if self._counts is not None:
+            result += sum(self._counts) - len(self._counts)
+        if self._elided is not None:
+            result += self._elided[1]
+        return result
+
+    def copy(self):
+        """
+        :return _ReraiseContext:
+            A context with the same layers, which can be extended without
+            changing this one.
+        """
+        result = _ReraiseContext(self.original)
+        if self.notes is not None:
+            result.notes = list(self.notes)
+        result.layers = list(self.layers)
+        if self._counts is not None:
+            result._counts = list(self._counts)
+        result._elided = self._elided
+        result._elided_note = self._elided_note
+        result._frames_note = self._frames_note
+        result._formatted = list(self._formatted)
+        result._frame_chunks = list(self._frame_chunks)
+        return result
+
+    def add_frames(self, frames, notes=None):
+        """
+        Keeps a summary of frames released from the traceback. See
+        `release_traceback`.
+
+        :param list(tuple(unicode,int,unicode)) frames:
+            The `(filename, line number, function name)` of each frame, most
+            recent call last. These frames are more recent than the ones
+            already added.
+
+        :param list(unicode)|None notes:
+            See `add`. The frames are shown by a note after the messages,
+            replaced whenever frames are added.
+        """
+        self._frame_chunks.append(frames)
+        self._text = None
+        if notes is not None:
+            position = _find_note(notes, self._frames_note)
+            if position != -1:
+                del notes[position]
+            # Only the chunks added so far (the list is shared by the note).
+            self._frames_note = _LazyNote(
+                _FRAMES_HEADER,
+                functools.partial(
+                    _render_frame_chunks,
+                    self._frame_chunks,
+                    len(self._frame_chunks),
+                ),
+            )
+            notes.append(self._frames_note)
+
+    def attached_notes(self):
+        """
+        :return list(unicode):
+            The notes added to the exception's "__notes__" by this chain, none
+            unless attached as notes.
+        """
+        if self.notes is None:
+            return []
+        result = [note for note in self.notes if note is not None]
+        for note in (self._elided_note, self._frames_note):
+            if note is not None:
+                result.append(note)
+        return result
+
+    def frames(self):
+        """
+        :return list(tuple(unicode,int,unicode)):
+            The frames added by `add_frames`, most recent call last.
+        """
+        return _join_frame_chunks(self._frame_chunks)
+
+    def formatted_layers(self):
+        """
+        :return list(tuple(unicode,unicode,None,dict|None)):
+            The layers with their messages already formatted.
+        """
+        return [
+            (self._formatted_message(index), separator, None, fields)
+            for index, (_message, separator, _args, fields)
+            in enumerate(self.layers)
+        ]
+
+    def _formatted_message(self, index):
+        """
+        :return unicode:
+            The formatted message of a layer, formatted only once.
+        """
+        text = self._formatted[index]
+        if text is None:
+            message, _separator, args, fields = self.layers[index]
+            text = self._formatted[index] = _format_message(
+                message, args, fields
+            )
+        elif isinstance(text, _LazyNote):
+            text = six.text_type(text)
+        return text
+
+    def fields(self):
+        """
+        :return dict:
+            The fields of all layers (except the ones removed by the
+            "max_layers" setting). When a field is given more than once, the
+            innermost value is kept.
+        """
+        result = {}
+        for _message, _separator, _args, fields in reversed(self.layers):
+            if fields:
+                result.update(fields)
+        return result
+
+    def __str__(self):
+        if self._text is None:
+            # Returned if formatting a message requires this text.
+            self._text = '...'
+            text = _render(self.original, self._rendered_layers())
+            if self._frame_chunks:
+                text = _render_frames(text, self.frames())
+            self._text = _truncate(text, settings.max_total_size)
+        return self._text
+
+    def _rendered_layers(self):
+        """
+        :return list(tuple):
+            The layers to render, already formatted, with the repetition
+            counts and the layers removed by "max_layers".
+        """
+        if self._counts is None and self._elided is None:
+            return self.formatted_layers()
+        result = []
+        for index, layer in enumerate(self.formatted_layers()):
+            if self._elided is not None and index == self._elided[0]:
+                result.append(
+                    (_elided('', self._elided[1], 'layers', ''), '\n', None,
+                     None)
+                )
+            count = 1 if self._counts is None else self._counts[index]
+            if count > 1:
+                message, separator, _args, fields = layer
+                layer = (
+                    _repeated(message, count),
+                    separator,
+                    None,
+                    fields,
+                )
+            result.append(layer)
+        return result
+
+    def __repr__(self):
+        return repr(six.text_type(self))
+
+    def __eq__(self, other):
+        if isinstance(other, _ReraiseContext):
+            other = six.text_type(other)
+        return six.text_type(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(six.text_type(self))
+
+    def __reduce__(self):
+        # Callables and arguments may not be picklable (or only make sense in
+        # this process), so only the formatted messages are kept. The
+        # separator is usually the same for every layer and is kept once.
+        # Equal messages are interned, so they are pickled once.
+        interned = {}
+        messages = []
+        separators = []
+        layer_fields = []
+        for message, separator, _args, fields in self.formatted_layers():
+            messages.append(interned.setdefault(message, message))
+            separators.append(separator)
+            layer_fields.append(_portable_fields(fields))
+        if len(set(separators)) <= 1:
+            separators = separators[0] if separators else '\n'
+        args = (self.original, messages, separators, self.frames() or None)
+        if any(layer_fields) or self._counts or self._elided:
+            args += (layer_fields, self._counts, self._elided)
+        if self.notes is None:
+            return (_unpickle_context, args)
+        # Pickled once with the exception's "__notes__", so the unpickled
+        # notes can still be found (by identity) and replaced.
+        state = {
+            'notes': self.notes,
+            '_elided_note': self._elided_note,
+            '_frames_note': self._frames_note,
+        }
+        return (_unpickle_context, args, (None, state))
+
+
+def _unpickle_context(
+        original,
+        messages,
+        separators,
+        frames,
+        fields=None,
+        counts=None,
+        elided=None,
+):
+    """
+    Recreates a `_ReraiseContext` pickled by `_ReraiseContext.__reduce__`.
+
+    :param unicode|None original:
+    :param list(unicode) messages:
+        The formatted messages, innermost first.
+    :param unicode|list(unicode) separators:
+        The separator of each layer, or a single separator used by all.
+    :param list(tuple(unicode,int,unicode))|None frames:
+    :param list(dict|None)|None fields:
+        The fields of each layer, None if no layer has fields.
+    :param list(int)|None counts:
+    :param tuple(int,int)|None elided:
+        See `_ReraiseContext`.
+    """
+    if isinstance(separators, six.string_types):
+        separators = [separators] * len(messages)
+    if not fields:
+        fields = [None] * len(messages)
+    result = _ReraiseContext(
+        original,
+        [
+            (message, separator, None, layer_fields)
+            for message, separator, layer_fields
+            in zip(messages, separators, fields)
+        ],
+        frames,
+    )
+    result._counts = counts
+    result._elided = elided
+    return result
+
+
+def _same_layer(layer, other):
+    """
+    :return bool:
+        True if both layers show the same message. Arguments and field
+        values are compared by identity: comparing arbitrary objects may be
+        expensive (or fail).
+    """
+    message, separator, args, fields = layer
+    other_message, other_separator, other_args, other_fields = other
+    if message is not other_message and not (
+        isinstance(message, six.string_types) and message == other_message
+    ):
+        return False
+    if separator != other_separator:
+        return False
+    if args is not other_args and not (
+        args is not None and other_args is not None and
+        len(args) == len(other_args) and
+        all(a is b for a, b in zip(args, other_args))
+    ):
+        return False
+    if fields is other_fields:
+        return True
+    return (
+        fields is not None and other_fields is not None and
+        len(fields) == len(other_fields) and
+        all(
+            name in other_fields and value is other_fields[name]
+            for name, value in fields.items()
+        )
+    )
+
+
+# Field values pickled as they are, others are pickled as text.
+_PORTABLE_TYPES = six.integer_types + (
+    float, bool, type(None), six.text_type, six.binary_type,
+)
+
+
+def _portable_fields(fields):
+    """
+    :return dict|None:
+        The fields, with values that may not be picklable (or only make sense
+        in this process) replaced by their text.
+    """
+    if not fields:
+        return None
+    return dict(
+        (name, value if isinstance(value, _PORTABLE_TYPES) else
+            _format_message('%s', (value,)))
+        for name, value in fields.items()
+    )
+
+
+class _LazyNote(six.text_type):
+    """
+    A PEP 678 note (Python 3.11+) rendered when first shown.
+
+    Notes must be strings: the value of this one is a placeholder (the
+    message's template) and the actual text is rendered once, when converted
+    with `str()` as done by `traceback` and by the interpreter when showing
+    the exception. Code using the notes as strings directly (joining them,
+    for instance) gets the placeholder.
+    """
+
+    def __new__(cls, placeholder, render):
+        """
+        :param unicode placeholder:
+        :param callable render:
+            Called with no arguments to obtain the text.
+        """
+        result = six.text_type.__new__(cls, placeholder)
+        result._render = render
+        result._text = None
+        return result
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self._render()
+            self._render = None
+        return self._text
+
+    def __format__(self, format_spec):
+        return format(six.text_type(self), format_spec)
+
+    def __repr__(self):
+        return repr(six.text_type(self))
+
+    def __reduce__(self):
+        # Rendered: the message's arguments may not be picklable.
+        return (six.text_type, (six.text_type(self),))
+
+
+_FRAMES_HEADER = 'Released frames (most recent call last):'
+
+
+def _layer_note(message, args, fields):
+    """
+    :return unicode:
+        The note of a layer: the message itself when it is a plain string
+        or a `_LazyNote` formatting it when first shown.
+    """
+    if not args and not fields and isinstance(message, six.string_types):
+        return _format_message(message, args)
+    return _LazyNote(
+        _placeholder(message),
+        functools.partial(_format_message, message, args, fields),
+    )
+
+
+def _placeholder(message):
+    """
+    :return unicode:
+        The value of a `_LazyNote` formatting `message`: the template itself
+        or, for a callable (whose text is only known when called), a marker.
+    """
+    if isinstance(message, six.string_types):
+        return message
+    return '<deferred message>'
+
+
+def _repeated(message, count):
+    return '{} (repeated {}\u00d7)'.format(message, count)
+
+
+def _repeated_note(message, count):
+    """
+    :param unicode message:
+        The layer's formatted message or its `_LazyNote`, rendered when the
+        repeated note is shown.
+    """
+    if isinstance(message, _LazyNote):
+        return _LazyNote(
+            _repeated(six.text_type.__str__(message), count),
+            functools.partial(_repeated, message, count),
+        )
+    return _repeated(message, count)
+
+
+def _find_note(notes, note):
+    """
+    :return int:
+        The index of a note in a list of PEP 678 notes, -1 if not found. The
+        note is found by identity, so equal notes added by others are kept.
+    """
+    if note is None:
+        return -1
+    try:
+        # Compares by identity first: equal notes are rarely found before.
+        index = notes.index(note)
+    except ValueError:
+        return -1
+    if notes[index] is note:
+        return index
+    for index in range(index + 1, len(notes)):
+        if notes[index] is note:
+            return index
+    return -1
+
+
+def _replace_note(notes, old, new):
+    """
+    Replaces a note (see `_find_note`), adding the new one if not found.
+    """
+    index = _find_note(notes, old)
+    if index == -1:
+        notes.append(new)
+    else:
+        notes[index] = new
+
+
+def _render(original, layers):
+    """
+    Joins the layers of a context chain into the final message.
+
+    Equivalent to prepending each layer in turn, as `reraise` used to do on
+    every call, but copying the text only once.
+
+    :param unicode|None original:
+    :param list(tuple(unicode|callable,unicode,tuple,dict)) layers:
+
+    :return unicode:
+    """
+    if original is None:
+        return '\n'.join(
+            _format_message(message, args, fields)
+            for message, _separator, args, fields in reversed(layers)
+        )
+    if not layers:
+        return original
+
+    # Only the beginning of the text is needed to check for the separator.
+    width = max(len(layer[1]) for layer in layers)
+    head = original[:width]
+    parts = [original]
+    for message, separator, args, fields in layers:
+        message = _format_message(message, args, fields)
+        if not head.startswith(separator):
+            parts.append(separator)
+            head = separator + head
+        prefix = '\n' + message
+        parts.append(prefix)
+        head = (prefix + head)[:width]
+    parts.reverse()
+    return ''.join(parts)
+
+
+def _join_frame_chunks(chunks):
+    """
+    :return list(tuple(unicode,int,unicode)):
+        The frames given to `_ReraiseContext.add_frames`, most recent call
+        last.
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    return [frame for chunk in reversed(chunks) for frame in chunk]
+
+
+def _render_frame_chunks(chunks, count):
+    """
+    :return unicode:
+        The summary of the first `count` chunks of frames.
+    """
+    return _render_frames('', _join_frame_chunks(chunks[:count]))
+
+
+def _render_frames(text, frames):
+    """
+    Adds the summary of released frames after the rendered text.
+    """
+    lines = [text] if text else []
+    lines.append(_FRAMES_HEADER)
+    for filename, lineno, name in frames:
+        lines.append(
+            '  File "{}", line {}, in {}'.format(filename, lineno, name)
+        )
+    return '\n'.join(lines)
+
+
+def _format_message(message, args, fields=None):
+    """
+    Obtains the text of a message given to `reraise`.
+
+    Errors are reported in the text instead of being raised: formatting
+    happens when the exception is being shown and must not replace it.
+
+    :param unicode|callable message:
+        The message, a template formatted with the "%" operator when `args`
+        are given or a callable returning the message.
+
+    :param tuple|None args:
+        None when `message` was already formatted (and truncated), as done
+        when pickling.
+
+    :param dict|None fields:
+        Fields shown after the message, as "message (name=value, ...)".
+
+    :return unicode:
+    """
+    if args is None:
+        return message
+    try:
+        if callable(message):
+            text = message()
+        elif args:
+            text = message % args
+        else:
+            text = message
+        if not isinstance(text, six.text_type):
+            text = six.text_type(text)
+    except Exception as e:
+        if isinstance(message, six.string_types):
+            description = repr(message)
+        else:
+            description = object.__repr__(message)
+        text = '<unprintable message {}: {}>'.format(
+            description, type(e).__name__
+        )
+    if fields:
+        text = '{} ({})'.format(text, _format_fields(fields))
+    return _truncate(text, settings.max_message_size)
+
+
+def _format_fields(fields):
+    parts = []
+    for name, value in fields.items():
+        try:
+            value = repr(value)
+            if not isinstance(value, six.text_type):
+                value = value.decode('utf-8', 'replace')
+        except Exception as e:
+            value = '<unprintable {}>'.format(type(e).__name__)
+        parts.append('{}={}'.format(name, value))
+    return ', '.join(parts)
+
+
+def _truncate(text, limit):
+    """
+    Keeps the beginning and the end of a text longer than `limit`, replacing
+    the middle by a marker.
+
+    :param unicode text:
+    :param int|None limit:
+        Number of characters kept, None for no limit.
+
+    :return unicode:
+    """
+    if limit is None or len(text) <= limit:
+        return text
+    head, tail = _split_limit(limit)
+    return _elided(
+        text[:head], len(text) - limit, 'chars', text[len(text) - tail:]
+    )
+
+
+def _split_limit(limit):
+    """
+    :return tuple(int,int):
+        The sizes of the beginning and of the end kept by a truncation.
+    """
+    return limit // 2 + limit % 2, limit // 2
+
+
+def _elided(head, count, unit, tail):
+    return '{}[... {} {} elided ...]{}'.format(head, count, unit, tail)
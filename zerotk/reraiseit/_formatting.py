@@ -0,0 +1,214 @@
+from __future__ import unicode_literals
+"""
+    Fast formatting of annotated exceptions.
+"""
+import linecache
+
+import six
+
+from ._context import (
+    _ReraiseContext,
+    _format_message,
+    _render,
+    _truncate,
+)
+from ._groups import is_exception_group
+from ._reraiseit import exception_to_unicode
+from ._retention import _summarize
+from ._settings import settings
+
+# Maximum number of source lines kept by `_source_line`.
+_MAX_SOURCE_LINES = 4096
+
+# (filename, line number) -> stripped source line. Shared by all threads:
+# only single lookups and insertions are done, which don't need a lock (and
+# only contend on misses on free-threaded builds).
+_SOURCE_LINES = {}
+
+_CAUSE_MESSAGE = (
+    '\nThe above exception was the direct cause of the following '
+    'exception:\n\n'
+)
+
+_CONTEXT_MESSAGE = (
+    '\nDuring handling of the above exception, another exception '
+    'occurred:\n\n'
+)
+
+
+def format_exception(exception, source=True, chain=True):
+    """
+    Formats an exception and its traceback, as `traceback.format_exception`
+    but faster, for code formatting many exceptions (error reporters,
+    loggers, ...).
+
+    The messages added by `reraise` are grouped above the exception's own
+    message (as they are shown by the "args" backend), the frames released
+    by `release_traceback` are shown with the traceback.
+
+    Source lines are cached (without checking if the files changed, which
+    `traceback` does on every call) and the cache is bounded.
+
+    Exception groups are formatted by `traceback`.
+
+    :param BaseException exception:
+
+    :param bool source:
+        If False, source lines are not shown (nor read).
+
+    :param bool chain:
+        If True, the exceptions in `__cause__` and `__context__` are shown
+        too.
+
+    :return unicode:
+
+    e.g.
+        Traceback (most recent call last):
+          File "jobs.py", line 12, in run
+            load(path)
+          File "loader.py", line 40, in load
+            raise KeyError(key)
+        While running job 17
+        While loading data.bin
+        KeyError: 'key'
+    """
+    lines = []
+    _format_chain(exception, source, chain, lines, set())
+    return ''.join(lines)
+
+
+def _format_chain(exception, source, chain, lines, seen):
+    seen.add(id(exception))
+    if chain and six.PY3:
+        cause = exception.__cause__
+        context = exception.__context__
+        if cause is not None and id(cause) not in seen:
+            _format_chain(cause, source, chain, lines, seen)
+            lines.append(_CAUSE_MESSAGE)
+        elif (
+            context is not None and
+            not exception.__suppress_context__ and
+            id(context) not in seen
+        ):
+            _format_chain(context, source, chain, lines, seen)
+            lines.append(_CONTEXT_MESSAGE)
+    _format_single(exception, source, lines)
+
+
+def _format_single(exception, source, lines):
+    if is_exception_group(exception):
+        import traceback
+
+        lines.extend(
+            traceback.format_exception(
+                type(exception), exception, exception.__traceback__,
+                chain=False,
+            )
+        )
+        return
+
+    context = exception.__dict__.get('reraised_message')
+    if not isinstance(context, _ReraiseContext):
+        context = None
+
+    frames = _summarize(getattr(exception, '__traceback__', None))
+    if context is not None and context._frame_chunks:
+        frames.extend(context.frames())
+    if frames:
+        lines.append('Traceback (most recent call last):\n')
+        for filename, lineno, name in frames:
+            lines.append(
+                '  File "{}", line {}, in {}\n'.format(filename, lineno, name)
+            )
+            if source:
+                line = _source_line(filename, lineno)
+                if line:
+                    lines.append('    {}\n'.format(line))
+
+    if context is not None and context.layers:
+        messages = _render(None, context._rendered_layers())
+        lines.append(_truncate(messages, settings.max_total_size) + '\n')
+
+    lines.append(_format_type(type(exception), _own_message(exception)))
+
+    attached = set()
+    if context is not None:
+        # The notes added by the context chain were already shown above.
+        attached = set(id(note) for note in context.attached_notes())
+    for note in getattr(exception, '__notes__', None) or ():
+        if id(note) not in attached:
+            lines.append('{}\n'.format(note))
+
+
+def _format_type(exception_type, message):
+    name = _type_name(exception_type)
+    if message:
+        return '{}: {}\n'.format(name, message)
+    return '{}\n'.format(name)
+
+
+def _type_name(exception_type):
+    """
+    :return unicode:
+        The name shown for the exception type, with its module unless it is a
+        builtin.
+    """
+    name = getattr(exception_type, '__qualname__', exception_type.__name__)
+    module = exception_type.__module__
+    if module not in ('builtins', 'exceptions', '__main__'):
+        name = '{}.{}'.format(module, name)
+    return name
+
+
+def _own_message(exception, limit=None):
+    """
+    :param int|None limit:
+        Maximum number of characters, the "max_message_size" setting when
+        None.
+
+    :return unicode:
+        The exception's message, without the messages added by `reraise`.
+        As for messages (see `_format_message`), an error obtaining it is
+        reported in the message instead of being raised.
+    """
+    if limit is None:
+        limit = settings.max_message_size
+    context = exception.__dict__.get('reraised_message')
+    if isinstance(context, _ReraiseContext) and context.original is not None:
+        return _truncate(context.original, limit)
+    try:
+        return exception_to_unicode(exception, limit)
+    except Exception as e:
+        return '<unprintable message: {}>'.format(type(e).__name__)
+
+
+def _messages(exception):
+    """
+    :return list(unicode):
+        The messages added by `reraise`, outermost first.
+    """
+    context = exception.__dict__.get('reraised_message')
+    if not isinstance(context, _ReraiseContext):
+        return []
+    return [
+        _format_message(message, args, fields)
+        for message, _separator, args, fields
+        in reversed(context._rendered_layers())
+    ]
+
+
+def _source_line(filename, lineno):
+    """
+    :return unicode:
+        The stripped source line, empty if not available.
+    """
+    key = (filename, lineno)
+    line = _SOURCE_LINES.get(key)
+    if line is None:
+        line = linecache.getline(filename, lineno).strip()
+        if not isinstance(line, six.text_type):
+            line = line.decode('utf-8', 'replace')
+        if len(_SOURCE_LINES) >= _MAX_SOURCE_LINES:
+            _SOURCE_LINES.clear()
+        _SOURCE_LINES[key] = line
+    return line
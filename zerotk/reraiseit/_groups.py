@@ -0,0 +1,130 @@
+from __future__ import unicode_literals
+"""
+    Support for exception groups (Python 3.11+).
+"""
+import functools
+
+import six
+
+from ._context import _LazyNote, _format_message, _placeholder
+
+BaseExceptionGroup = getattr(six.moves.builtins, 'BaseExceptionGroup', None)
+
+
+def is_exception_group(exception):
+    return (
+        BaseExceptionGroup is not None and
+        isinstance(exception, BaseExceptionGroup)
+    )
+
+
+class _MemberMessages(object):
+    """
+    Messages added by `reraise` to every member of an exception group.
+
+    Each leaf exception of the group gets a single PEP 678 note showing these
+    messages (see `_MemberNote`) with the first message: later messages are
+    only appended to the list, no matter how many members the group has.
+
+    :ivar list(unicode|callable) messages:
+        Innermost first.
+
+    :ivar list(BaseException)|None members:
+        The leaves of the group, found on the first message and released
+        once they have their note.
+    """
+
+    __slots__ = ('messages', 'members')
+
+    def __init__(self, members):
+        self.messages = []
+        self.members = members
+
+    def add(self, message):
+        self.messages.append(message)
+        if self.members is not None:
+            for member in self.members:
+                member.add_note(_MemberNote(self.messages, member))
+            self.members = None
+
+    def __reduce__(self):
+        # The members' notes are unpickled on their own, with no reference to
+        # this object: the unpickled group must walk its members again on
+        # the next message.
+        return (_unpickle_member_messages, ())
+
+
+def _unpickle_member_messages():
+    return None
+
+
+class _MemberNote(_LazyNote):
+    """
+    The note of a member of an exception group, showing the member messages
+    (outermost first). Each message is formatted once, when the note is
+    first shown after the message was added.
+    """
+
+    def __new__(cls, messages, member):
+        """
+        :param list(unicode|callable) messages:
+            The `_MemberMessages.messages`, shared by the notes of all
+            members.
+
+        :param BaseException member:
+            Given to callable messages. Most exceptions can't be referenced
+            weakly, so the note and its member reference each other.
+        """
+        result = six.text_type.__new__(cls, _placeholder(messages[0]))
+        result._messages = messages
+        result._member = member
+        result._parts = []
+        result._text = None
+        return result
+
+    def __str__(self):
+        parts = self._parts
+        if self._text is None or len(parts) < len(self._messages):
+            for message in self._messages[len(parts):]:
+                parts.append(_format_member_message(message, self._member))
+            self._text = '\n'.join(reversed(parts))
+        return self._text
+
+
+def _format_member_message(message, member):
+    if callable(message):
+        message = functools.partial(message, member)
+    return _format_message(message, ())
+
+
+def leaves(group):
+    """
+    :return iterator(BaseException):
+        The exceptions in the group, recursively, excluding nested groups.
+    """
+    for exception in group.exceptions:
+        if is_exception_group(exception):
+            for leaf in leaves(exception):
+                yield leaf
+        else:
+            yield exception
+
+
+def annotate_members(group, member_message):
+    """
+    Adds a message to every leaf of the group.
+
+    The leaves are only walked on the first call for a given group: later
+    messages are added to the list kept with the group.
+
+    :param BaseExceptionGroup group:
+
+    :param unicode|callable member_message:
+        The message or a callable receiving the member and returning its
+        message.
+    """
+    member_messages = group.__dict__.get('reraised_member_messages')
+    if member_messages is None:
+        member_messages = _MemberMessages(list(leaves(group)))
+        group.reraised_member_messages = member_messages
+    member_messages.add(member_message)
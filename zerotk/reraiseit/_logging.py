@@ -0,0 +1,94 @@
+from __future__ import unicode_literals
+"""
+    Integration with the logging module.
+"""
+import logging
+
+from ._formatting import _messages, format_exception
+from ._reraiseit import get_context
+
+
+class ReraiseFilter(logging.Filter):
+    """
+    Replaces the exception of log records by its text and context, so the
+    exception (with its traceback, frames and locals) is released as soon
+    as the record is handled.
+
+    Meant for handlers passing records to other threads or processes
+    (`QueueHandler`, ...), where the exception would be kept alive until the
+    record is formatted on the other side. Add it to the handler: its
+    filters run before the record is queued.
+
+    The record gets:
+        * "exc_text": the exception formatted by `format_exception`, shown
+          by any `logging.Formatter` (while "exc_info" is cleared);
+        * "reraise_context": the fields given to `reraise` (see
+          `get_context`);
+        * "reraise_messages": the messages added by `reraise`, outermost
+          first.
+
+    Note that the record is changed for the handlers handling it after this
+    one too.
+
+    :param bool source:
+        If True, the source lines are shown in the traceback (see
+        `format_exception`).
+
+    e.g.
+        handler = logging.handlers.QueueHandler(queue)
+        handler.addFilter(ReraiseFilter())
+    """
+
+    def __init__(self, name='', source=False):
+        logging.Filter.__init__(self, name)
+        self.source = source
+
+    def filter(self, record):
+        if not logging.Filter.filter(self, record):
+            return False
+        exc_info = record.exc_info
+        if not exc_info or exc_info[1] is None:
+            return True
+        exception = exc_info[1]
+        record.exc_text = format_exception(
+            exception, source=self.source
+        ).rstrip('\n')
+        record.reraise_context = get_context(exception)
+        record.reraise_messages = _messages(exception)
+        record.exc_info = None
+        return True
+
+
+class ReraiseFormatter(logging.Formatter):
+    """
+    Formatter using `format_exception` to format exceptions and providing
+    the "reraise_context" and "reraise_messages" attributes (see
+    `ReraiseFilter`) to format strings, empty for records without them.
+
+    :param bool source:
+        If True, the source lines are shown in the traceback.
+
+    e.g.
+        formatter = ReraiseFormatter('%(message)s %(reraise_context)s')
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.source = kwargs.pop('source', True)
+        logging.Formatter.__init__(self, *args, **kwargs)
+
+    def format(self, record):
+        if not hasattr(record, 'reraise_context'):
+            exception = record.exc_info[1] if record.exc_info else None
+            if exception is None:
+                record.reraise_context = {}
+                record.reraise_messages = []
+            else:
+                record.reraise_context = get_context(exception)
+                record.reraise_messages = _messages(exception)
+        if record.exc_info:
+            # Even if another formatter already formatted (and cached) it.
+            record.exc_text = self.formatException(record.exc_info)
+        return logging.Formatter.format(self, record)
+
+    def formatException(self, exc_info):
+        return format_exception(exc_info[1], source=self.source).rstrip('\n')
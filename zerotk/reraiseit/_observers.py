@@ -0,0 +1,270 @@
+from __future__ import unicode_literals
+"""
+    Observers notified of every annotation made by `reraise`.
+"""
+import collections
+import random
+import sys
+import threading
+import weakref
+
+import six
+
+from ._settings import settings
+
+
+class ReraiseEvent(collections.namedtuple(
+    'ReraiseEvent',
+    'exception_type filename lineno function depth message_length',
+)):
+    """
+    An annotation made by `reraise`.
+
+    :ivar type exception_type:
+        The class of the exception (the original one when the "args"
+        backend replaced it by a Reraised* subclass).
+
+    :ivar unicode filename:
+    :ivar int lineno:
+    :ivar unicode function:
+        The call site: the code calling `reraise`, `reraising`, ...
+
+    :ivar int depth:
+        The number of messages added to the exception so far, including this
+        one.
+
+    :ivar int|None message_length:
+        The length of the message (of the template, when formatted with
+        arguments) or None for callables: messages are only formatted when
+        shown.
+    """
+
+    __slots__ = ()
+
+
+class _Observers(object):
+    """
+    :ivar tuple(callable) active:
+        The registered observers. Replaced (never changed) when observers are
+        added or removed, so `reraise` checks for observers with a single
+        attribute lookup and notifies them without locking.
+    """
+
+    def __init__(self):
+        self.active = ()
+        self._lock = threading.Lock()
+
+    def add(self, observer):
+        with self._lock:
+            self.active = self.active + (observer,)
+
+    def remove(self, observer):
+        with self._lock:
+            active = list(self.active)
+            active.remove(observer)
+            self.active = tuple(active)
+
+
+observers = _Observers()
+
+_PACKAGE = __name__.rsplit('.', 1)[0] + '.'
+
+
+def add_observer(observer):
+    """
+    Registers a callable called with a `ReraiseEvent` for every annotation
+    made by `reraise` (or for a sample of them, see the
+    "observer_sample_rate" setting).
+
+    Observers are called before the exception is raised and must be fast.
+    Their errors are ignored: they never replace the exception being raised.
+
+    :param callable observer:
+
+    e.g.
+        def observe(event):
+            metrics.increment('reraise', tags={'type': event.exception_type})
+
+        add_observer(observe)
+    """
+    observers.add(observer)
+
+
+def remove_observer(observer):
+    """
+    Unregisters an observer added by `add_observer`.
+
+    :raise ValueError:
+        If the observer is not registered.
+    """
+    observers.remove(observer)
+
+
+def notify(exception, message):
+    """
+    Notifies the observers of an annotation. Only called when there are
+    observers.
+
+    :param BaseException exception:
+        The annotated exception.
+    :param unicode|callable message:
+    """
+    rate = settings.observer_sample_rate
+    if rate < 1.0 and random.random() >= rate:
+        return
+
+    exception_type = type(exception)
+    exception_type = exception_type.__dict__.get(
+        '_reraised_base', exception_type
+    )
+    context = getattr(exception, 'reraised_message', None)
+    filename, lineno, function = call_site()
+    event = ReraiseEvent(
+        exception_type,
+        filename,
+        lineno,
+        function,
+        context.depth() if hasattr(context, 'depth') else 0,
+        len(message) if isinstance(message, six.string_types) else None,
+    )
+    for observer in observers.active:
+        try:
+            observer(event)
+        except Exception:
+            pass
+
+
+def call_site():
+    """
+    :return tuple(unicode,int,unicode):
+        The filename, line and function of the innermost frame outside of
+        reraiseit (skipping reraise, reraising, context_boundary, ...).
+    """
+    frame = sys._getframe(1)
+    while (
+        frame.f_back is not None and
+        frame.f_globals.get('__name__', '').startswith(_PACKAGE)
+    ):
+        frame = frame.f_back
+    return frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name
+
+
+class ReraiseStats(object):
+    """
+    Observer keeping counters and histograms of the annotations.
+
+    Each thread counts in its own tables (merged by `snapshot`), so counting
+    never waits on a lock. The tables of finished threads are folded into a
+    single one, so short-lived threads don't make them grow.
+
+    e.g.
+        stats = ReraiseStats()
+        add_observer(stats)
+        ...
+        exporter.publish(stats.snapshot())
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (weak reference to the thread, tables) of each thread counting.
+        self._tables = []
+        # The counts of the threads that finished.
+        self._finished = _new_tables()
+
+    def __call__(self, event):
+        tables = getattr(self._local, 'tables', None)
+        if tables is None:
+            tables = self._local.tables = _new_tables()
+            thread = weakref.ref(threading.current_thread())
+            with self._lock:
+                self._fold_finished()
+                self._tables.append((thread, tables))
+        _increment(tables['exception_types'], event.exception_type.__name__)
+        _increment(
+            tables['call_sites'],
+            (event.filename, event.lineno, event.function),
+        )
+        _increment(tables['depth'], _bucket(event.depth))
+        if event.message_length is not None:
+            _increment(
+                tables['message_length'], _bucket(event.message_length)
+            )
+
+    def snapshot(self):
+        """
+        :return dict:
+            With:
+                * "annotations": the number of annotations observed;
+                * "exception_types": the count per exception class name;
+                * "call_sites": the count per (filename, line, function);
+                * "depth" and "message_length": histograms, the count per
+                  bucket, where each bucket is identified by its upper bound
+                  (0, 1, 3, 7, 15, ...).
+            Counts are of the observed annotations: with a sample rate, they
+            must be divided by the rate to estimate the actual counts.
+        """
+        result = _new_tables()
+        with self._lock:
+            self._fold_finished()
+            _merge(result, self._finished)
+            tables = [thread_tables for _thread, thread_tables in self._tables]
+        for thread_tables in tables:
+            _merge(result, thread_tables)
+        result['annotations'] = sum(result['exception_types'].values())
+        return result
+
+    def reset(self):
+        """
+        Discards all counts.
+        """
+        with self._lock:
+            self._tables = []
+            self._finished = _new_tables()
+            self._local = threading.local()
+
+    def _fold_finished(self):
+        """
+        Merges the tables of the threads that finished (which don't change
+        anymore) into `_finished` and drops them. Called with the lock held.
+        """
+        alive = []
+        for reference, tables in self._tables:
+            thread = reference()
+            if thread is not None and thread.is_alive():
+                alive.append((reference, tables))
+            else:
+                _merge(self._finished, tables)
+        self._tables = alive
+
+
+def _new_tables():
+    return {
+        'exception_types': {},
+        'call_sites': {},
+        'depth': {},
+        'message_length': {},
+    }
+
+
+def _merge(result, tables):
+    """
+    Adds the counts in `tables` to `result`.
+    """
+    for name, table in tables.items():
+        merged = result[name]
+        # Copied first: the thread may be counting.
+        for key, count in list(table.items()):
+            merged[key] = merged.get(key, 0) + count
+
+
+def _increment(table, key):
+    table[key] = table.get(key, 0) + 1
+
+
+def _bucket(value):
+    """
+    :return int:
+        The upper bound of the power of two bucket of `value`.
+    """
+    return (1 << value.bit_length()) - 1 if value > 0 else 0
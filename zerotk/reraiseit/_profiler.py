@@ -0,0 +1,301 @@
+from __future__ import unicode_literals
+"""
+    Profiler of the cost of annotating and rendering exceptions, per call
+    site of `reraise`.
+
+    Enabled with the ZEROTK_RERAISEIT_PROFILE environment variable, read
+    when reraiseit is imported. Nothing is installed (and so nothing is
+    paid) when it is not set.
+"""
+import os
+import sys
+import threading
+import timeit
+import weakref
+
+import six
+
+from . import _reraiseit
+from ._context import _ReraiseContext
+from ._observers import call_site
+
+# Name of the method rendering the context.
+_RENDER_METHOD = '__str__' if six.PY3 else '__unicode__'
+
+_timer = timeit.default_timer
+
+
+class ReraiseProfiler(object):
+    """
+    Collects, per call site (the code calling `reraise`, `reraising`, ...):
+        * the number of annotations;
+        * the time spent annotating;
+        * the number of renderings and the time spent rendering the context
+          (attributed to the site of the last annotation);
+        * the depth of the traceback when annotating.
+
+    e.g.
+        profiler = start_profiling()
+        try:
+            run()
+        finally:
+            stop_profiling()
+        print(profiler.report(limit=20))
+        profiler.dump_stats('reraise.prof')
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Call site: [annotations, annotate time, renderings, render time,
+        # total traceback depth, maximum traceback depth]
+        self._sites = {}
+        # Call site of the last annotation of each context, by id(): contexts
+        # compare (and hash) by their text, which would render them.
+        self._context_sites = {}
+
+    def add_annotation(self, site, context, elapsed, traceback_depth):
+        with self._lock:
+            entry = self._entry(site)
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[4] += traceback_depth
+            entry[5] = max(entry[5], traceback_depth)
+            if context is not None:
+                self._set_context_site(context, site)
+
+    def _set_context_site(self, context, site):
+        key = id(context)
+        entry = self._context_sites.get(key)
+        if entry is not None and entry[0]() is context:
+            self._context_sites[key] = (entry[0], site)
+            return
+
+        context_sites = self._context_sites
+
+        def forget(ref):
+            # Called by the garbage collector: not locking since it can run
+            # while the lock is held.
+            if context_sites.get(key, (None,))[0] is ref:
+                context_sites.pop(key, None)
+
+        self._context_sites[key] = (weakref.ref(context, forget), site)
+
+    def add_rendering(self, context, elapsed):
+        with self._lock:
+            entry = self._context_sites.get(id(context))
+            if entry is None or entry[0]() is not context:
+                return
+            site = entry[1]
+            entry = self._entry(site)
+            entry[2] += 1
+            entry[3] += elapsed
+
+    def _entry(self, site):
+        entry = self._sites.get(site)
+        if entry is None:
+            entry = self._sites[site] = [0, 0.0, 0, 0.0, 0, 0]
+        return entry
+
+    def stats(self):
+        """
+        :return list(dict):
+            One item per call site, with "site" (filename, line, function),
+            "annotations", "annotate_time", "renderings", "render_time",
+            "total_time" (in seconds), "mean_traceback_depth" and
+            "max_traceback_depth". Sorted by total time, highest first.
+        """
+        with self._lock:
+            sites = [
+                (site, list(entry)) for site, entry in self._sites.items()
+            ]
+        result = [
+            {
+                'site': site,
+                'annotations': annotations,
+                'annotate_time': annotate_time,
+                'renderings': renderings,
+                'render_time': render_time,
+                'total_time': annotate_time + render_time,
+                'mean_traceback_depth':
+                    float(depth_total) / annotations if annotations else 0.0,
+                'max_traceback_depth': depth_max,
+            }
+            for site, (
+                annotations,
+                annotate_time,
+                renderings,
+                render_time,
+                depth_total,
+                depth_max,
+            ) in sites
+        ]
+        result.sort(key=lambda item: item['total_time'], reverse=True)
+        return result
+
+    def report(self, limit=None):
+        """
+        :param int|None limit:
+            Maximum number of call sites listed.
+
+        :return unicode:
+            A table of the call sites, the most expensive first.
+        """
+        lines = [
+            '{:>10} {:>12} {:>10} {:>12} {:>12} {:>9}  {}'.format(
+                'count',
+                'annotate_ms',
+                'renders',
+                'render_ms',
+                'total_ms',
+                'tb_depth',
+                'call site',
+            )
+        ]
+        for item in self.stats()[:limit]:
+            filename, lineno, function = item['site']
+            lines.append(
+                '{:>10} {:>12.3f} {:>10} {:>12.3f} {:>12.3f} {:>9.1f}  '
+                '{}:{}({})'.format(
+                    item['annotations'],
+                    item['annotate_time'] * 1e3,
+                    item['renderings'],
+                    item['render_time'] * 1e3,
+                    item['total_time'] * 1e3,
+                    item['mean_traceback_depth'],
+                    filename,
+                    lineno,
+                    function,
+                )
+            )
+        return '\n'.join(lines)
+
+    def dump_stats(self, filename):
+        """
+        Writes the stats in the format of `cProfile`, to be read by `pstats`
+        (or any tool reading it): each call site is a "function", with the
+        annotation time as its own time and the annotation plus rendering
+        time as its cumulative time.
+
+        e.g.
+            pstats.Stats('reraise.prof').sort_stats('cumulative').print_stats()
+        """
+        import marshal
+
+        stats = {}
+        for item in self.stats():
+            count = item['annotations']
+            stats[item['site']] = (
+                count, count, item['annotate_time'], item['total_time'], {}
+            )
+        with open(filename, 'wb') as stream:
+            marshal.dump(stats, stream)
+
+
+_installed = None
+
+
+def get_profiler():
+    """
+    :return ReraiseProfiler|None:
+        The installed profiler, if any.
+    """
+    return _installed and _installed[0]
+
+
+def start_profiling(profiler=None):
+    """
+    Starts profiling, replacing the annotation backend and the rendering of
+    contexts by profiled versions. Stops the profiler already started, if
+    any.
+
+    :param ReraiseProfiler|None profiler:
+        A new profiler is created when None.
+
+    :return ReraiseProfiler:
+    """
+    global _installed
+    if _installed is not None:
+        stop_profiling()
+    if profiler is None:
+        profiler = ReraiseProfiler()
+
+    annotate = _reraiseit._annotate
+    render = getattr(_ReraiseContext, _RENDER_METHOD)
+
+    def profiled_annotate(exception, *args, **kwargs):
+        start = _timer()
+        result = annotate(exception, *args, **kwargs)
+        elapsed = _timer() - start
+        profiler.add_annotation(
+            call_site(),
+            getattr(result, 'reraised_message', None),
+            elapsed,
+            _traceback_depth(sys.exc_info()[-1]),
+        )
+        return result
+
+    def profiled_render(context):
+        if context._text is not None:
+            # Cached: costs nothing.
+            return context._text
+        start = _timer()
+        try:
+            return render(context)
+        finally:
+            profiler.add_rendering(context, _timer() - start)
+
+    _installed = (profiler, annotate, render)
+    _reraiseit._annotate = profiled_annotate
+    setattr(_ReraiseContext, _RENDER_METHOD, profiled_render)
+    return profiler
+
+
+def stop_profiling():
+    """
+    Stops profiling, restoring what `start_profiling` replaced.
+
+    :return ReraiseProfiler|None:
+        The profiler stopped, None if none was started.
+    """
+    global _installed
+    if _installed is None:
+        return None
+    profiler, annotate, render = _installed
+    _reraiseit._annotate = annotate
+    setattr(_ReraiseContext, _RENDER_METHOD, render)
+    _installed = None
+    return profiler
+
+
+def _traceback_depth(traceback):
+    result = 0
+    while traceback is not None:
+        result += 1
+        traceback = traceback.tb_next
+    return result
+
+
+def start_from_environment():
+    """
+    Starts a profiler when the ZEROTK_RERAISEIT_PROFILE environment
+    variable is set, writing its results when the process exits:
+        * "1": the report is written to stderr;
+        * otherwise, the name of the file written with `dump_stats`.
+    """
+    output = os.environ.get('ZEROTK_RERAISEIT_PROFILE')
+    if not output:
+        return
+    import atexit
+
+    profiler = start_profiling()
+
+    def write():
+        if output == '1':
+            sys.stderr.write(profiler.report() + '\n')
+        else:
+            profiler.dump_stats(output)
+
+    atexit.register(write)
+
+
+start_from_environment()
@@ -4,23 +4,74 @@ from __future__ import unicode_literals
 
     Derived from github.com/esss/ben10.
 """
+import codecs
 import six
 import locale
-
-
-def reraise(exception, message, separator='\n'):
+import sys
+import threading
+import types
+
+from ._ambient import take_pending_message
+from ._context import _ReraiseContext, _elided, _split_limit, _truncate
+from ._groups import (
+    BaseExceptionGroup,
+    annotate_members,
+    is_exception_group,
+)
+from ._observers import notify, observers
+from ._retention import (
+    CAN_DETACH_FRAMES,
+    CLEAR_LOCALS,
+    FULL,
+    POLICIES,
+    SUMMARY,
+    _clear_locals,
+    _summarize,
+)
+from ._settings import settings
+
+
+def reraise(
+        exception,
+        message,
+        separator='\n',
+        args=(),
+        member_message=None,
+        fields=None,
+):
     """
     Raised the same exception given, with an additional message.
 
-    :param Exception exception:
-        Original exception being raised with additional messages
+    The messages of the `push_context` blocks escaped by the exception are
+    added before `message`.
 
-    :param unicode message:
-        Message to be added to the given exception
+    :param Exception|shared exception:
+        Original exception being raised with additional messages. When
+        wrapped in `shared`, a copy of it is annotated and raised instead.
+
+    :param unicode|callable message:
+        Message to be added to the given exception. Can also be a template
+        formatted with `args` or a callable (with no arguments) returning the
+        message. Both are only formatted when the message is shown and any
+        error doing it is reported in the message instead of being raised.
 
     :param unicode separator:
         String separating `message` from the `exception`'s original message.
 
+    :param tuple args:
+        Arguments to format `message` with the "%" operator.
+
+    :param unicode|callable member_message:
+        Only for exception groups (which are always annotated as a whole): a
+        message to add to each exception in the group, or a callable
+        receiving the exception and returning its message. Each exception
+        gets a note with its member messages and the exceptions are only
+        visited the first time a group gets a member message.
+
+    :param dict fields:
+        Structured context kept with the message, shown after it as
+        "message (name=value, ...)" and obtained with `get_context`.
+
     e.g.
         try:
             raise RuntimeError('original message')
@@ -38,49 +89,377 @@ def reraise(exception, message, separator='\n'):
 
         > RuntimeError:
         > [message] original message
-    """
-    import sys
 
+        try:
+            load(request)
+        except Exception as e:
+            reraise(e, 'While loading %r', args=(request,))
+
+        try:
+            load_shard(shard, path)
+        except Exception as e:
+            reraise(e, 'While loading', fields={'shard': shard, 'path': path})
+
+        try:
+            future.result()
+        except Exception as e:
+            reraise(shared(e), 'While waiting for %s', args=(name,))
+    """
     # IMPORTANT: Do NOT use try/except mechanisms in this method or the
     # sys.exc_info()[-1] will be invalid
+    traceback = sys.exc_info()[-1]
+    given = exception
+
+    if isinstance(exception, shared):
+        exception = _overlay(exception.exception)
+
+    # Messages pushed by `push_context` blocks the exception escaped, which
+    # are inner to this one.
+    pending_message = take_pending_message(exception)
+    if pending_message is not None:
+        exception = _annotate(exception, pending_message, separator, ())
+
+    exception = _annotate(exception, message, separator, args, fields)
+    if member_message is not None and is_exception_group(exception):
+        annotate_members(exception, member_message)
+    if observers.active:
+        notify(exception, message)
+
+    if settings.traceback_retention != FULL and traceback is not None:
+        traceback = _release_finished_frames(
+            exception, traceback, settings.traceback_retention
+        )
 
-    if hasattr(exception, 'reraised_message'):
-        current_message = exception.reraised_message
-    else:
-        current_message = exception_to_unicode(exception)
+    # Reraise the exception with the EXTRA message information
+    if six.PY2:
+        six.reraise(exception, None, traceback)
+    elif exception is given:
+        raise exception.with_traceback(traceback)
+
+    # This frame is kept by the copy's traceback: it must not keep the given
+    # exception (and its frames, released in the copy) alive.
+    del given
+
+    # Raising a copy (see `_reraised_copy`) while the given exception is
+    # being handled sets that exception as the copy's "__context__": the
+    # context copied from the given exception is restored and the copy
+    # reraised as is (a bare "raise" doesn't change the context).
+    context = exception.__context__
+    try:
+        raise exception.with_traceback(traceback)
+    except BaseException:
+        exception.__context__ = context
+        raise
+
+
+def _annotate_args(exception, message, separator, args, fields=None):
+    """
+    Adds the message to the exception's own message ("args").
+
+    Some exceptions are replaced by an instance of a Reraised* subclass.
+
+    A None `message` only attaches the context chain, without adding a layer.
+
+    :return Exception:
+        The exception to raise.
+    """
+    # The messages are kept in a chain and only joined together when the
+    # exception is converted to text, so each layer costs the same no matter
+    # how many layers were added before.
+    context = getattr(exception, 'reraised_message', None)
+    if not isinstance(context, _ReraiseContext):
+        if context is None:
+            # Only the part of the original message that will be shown is
+            # kept in the context.
+            context = exception_to_unicode(
+                exception, settings.max_message_size
+            )
+        context = _ReraiseContext(context)
+    if message is not None:
+        context.add(message, separator, args, fields)
+
+    exception_class = exception.__class__
+    if '_reraised_base' not in exception_class.__dict__:
+        # Replace the exception by an instance of a Reraised* subclass, which
+        # keeps the original "args" and obtains its string from the context.
+        # Some exceptions (KeyError, OSError, SyntaxError, ...) ignore "args"
+        # or format it differently when converted to string.
+        reraised_class = _reraised_class(exception_class)
+        reraised = None
+        if reraised_class is not None:
+            reraised = _reraised_copy(exception, reraised_class)
+        if reraised is not None:
+            exception = reraised
+        else:
+            # In Python 2.5 overriding the exception "__str__" has no effect
+            # in "unicode()". Instead, we must change the "args" attribute
+            # which is used to build the string representation. Even though
+            # the documentation says "args" will be deprecated, it uses its
+            # first argument in unicode() implementation and not "message".
+            exception.args = (context,)
+
+    if not is_exception_group(exception):
+        # Exception groups have a read-only "message".
+        exception.message = context
+    # keep the context chain in the object in case this exception is
+    # reraised again
+    exception.reraised_message = context
+    return exception
+
+
+def _annotate_notes(exception, message, separator, args, fields=None):
+    """
+    Adds the message as a PEP 678 note (Python 3.11+).
 
-    # Build the new message
-    if not current_message.startswith(separator):
-        current_message = separator + current_message
-    message = '\n' + message + current_message
+    The exception object and its "args" are left untouched: each message is
+    added as a note, like `BaseException.add_note` does, so the traceback
+    shows the messages (innermost first) below the exception's own message.
+    `separator` is not used since the original message is not modified.
 
-    if exception.__class__ in _SPECIAL_EXCEPTION_MAP:
-        # Handling for special case, some exceptions have different behaviors.
-        exception = _SPECIAL_EXCEPTION_MAP[exception.__class__](
-            *exception.args
+    A None `message` only attaches the context chain, without adding a layer.
+
+    :return Exception:
+        The given exception.
+    """
+    context = getattr(exception, 'reraised_message', None)
+    if not isinstance(context, _ReraiseContext):
+        notes = getattr(exception, '__notes__', None)
+        if notes is not None and not isinstance(notes, list):
+            return _annotate_args(
+                exception, message, separator, args, fields
+            )
+        context = _ReraiseContext(None)
+        exception.reraised_message = context
+    if message is not None:
+        context.add(
+            message, separator, args, fields, _notes(exception, context)
         )
+    return exception
 
-    elif exception.__class__ not in _SPECIAL_EXCEPTION_MAP.values():
-        # In Python 2.5 overriding the exception "__str__" has no effect in
-        # "unicode()". Instead, we must change the "args" attribute which is
-        # used to build the string representation. Even though the
-        # documentation says "args" will be deprecated, it uses its first
-        # argument in unicode() implementation and not "message".
-        exception.args = (message,)
 
-    exception.message = message
-    # keep the already decoded message in the object in case this exception is
-    # reraised again
-    exception.reraised_message = message
+def _notes(exception, context):
+    """
+    :return list(unicode)|None:
+        The exception's "__notes__" (created if missing) when its context
+        chain is attached as notes, None otherwise.
+    """
+    if context.original is not None:
+        return None
+    notes = getattr(exception, '__notes__', None)
+    if notes is None:
+        notes = exception.__notes__ = []
+    return notes
 
-    # Reraise the exception with the EXTRA message information
-    if six.PY2:
-        six.reraise(exception, None, sys.exc_info()[-1])
+
+def _add_frames(exception, frames):
+    """
+    Keeps a summary of frames released from the exception's traceback (see
+    `_ReraiseContext.add_frames`), which must be already annotated.
+    """
+    context = exception.reraised_message
+    context.add_frames(frames, _notes(exception, context))
+
+
+class shared(object):
+    """
+    Wraps an exception given to `reraise` to leave it unchanged: a copy of it
+    is annotated and raised instead. For exceptions delivered to several
+    callers (the exception of a failed `Future`, a cached error, ...), which
+    would otherwise get the messages added by all of them. See `_overlay`.
+
+    e.g.
+        try:
+            future.result()
+        except Exception as e:
+            reraise(shared(e), 'While waiting for %s', args=(name,))
+    """
+
+    __slots__ = ('exception',)
+
+    def __init__(self, exception):
+        """
+        :param Exception exception:
+        """
+        self.exception = exception
+
+
+def _overlay(exception):
+    """
+    Creates a shallow copy of an exception, to be annotated instead of it.
+
+    The copy is an instance of the exception's Reraised* subclass (so it is
+    still an instance of the exception's class) sharing its "args" and
+    attributes. Only the context chain (and the notes) is copied, which
+    costs a list of at most "max_layers" references: the layers themselves
+    are shared.
+
+    Members of exception groups are not copied.
+
+    :return Exception:
+        The copy or, when the exception's class can't be subclassed, the
+        given exception (which is then annotated in place).
+    """
+    exception_class = exception.__class__
+    reraised_class = _reraised_class(
+        exception_class.__dict__.get('_reraised_base', exception_class)
+    )
+    result = None
+    if reraised_class is not None:
+        result = _reraised_copy(exception, reraised_class)
+    if result is None:
+        return exception
+
+    state = result.__dict__
+    context = state.get('reraised_message')
+    if isinstance(context, _ReraiseContext):
+        copied = state['reraised_message'] = context.copy()
+        if state.get('message') is context:
+            state['message'] = copied
     else:
-        raise exception.with_traceback(sys.exc_info()[-1])
+        copied = context
+    notes = state.get('__notes__')
+    if isinstance(notes, list):
+        state['__notes__'] = list(notes)
+    return result
 
 
-def exception_to_unicode(exception):
+def get_context(exception):
+    """
+    Obtains the structured context added to an exception by `reraise`.
+
+    :param BaseException exception:
+
+    :return dict:
+        The fields given to `reraise` (in all layers). When a field is given
+        more than once, the innermost value (the first one given) is kept.
+
+    e.g.
+        try:
+            run_job(shard)
+        except Exception as e:
+            errors_per_shard[get_context(e).get('shard')] += 1
+    """
+    context = getattr(exception, 'reraised_message', None)
+    if not isinstance(context, _ReraiseContext):
+        return {}
+    return context.fields()
+
+
+def _release_finished_frames(exception, traceback, policy):
+    """
+    Applies the retention policy to the frames below the handler calling
+    `reraise` (usually finished executing: see `_clear_locals`).
+
+    :param Exception exception:
+        The exception being reraised, already annotated.
+
+    :param traceback traceback:
+        The traceback, starting at the handler's frame.
+
+    :param unicode policy:
+        See `_Settings.traceback_retention`.
+
+    :return traceback:
+        The traceback to raise the exception with.
+    """
+    finished = traceback.tb_next
+    if finished is None:
+        return traceback
+    if policy == SUMMARY and CAN_DETACH_FRAMES:
+        _add_frames(exception, _summarize(finished))
+        # The traceback may be shared (with the original exception, see
+        # `shared`, or with another copy): a truncated copy is used instead.
+        return types.TracebackType(
+            None, traceback.tb_frame, traceback.tb_lasti, traceback.tb_lineno
+        )
+    if policy in (CLEAR_LOCALS, SUMMARY):
+        _clear_locals(finished)
+    return traceback
+
+
+def release_traceback(exception, policy=None):
+    """
+    Releases the memory kept by the traceback of an exception, usually
+    before storing it (in a failed future, a cache, a queue, ...).
+
+    The exceptions in its `__cause__` and `__context__` are released too.
+
+    :param Exception exception:
+
+    :param unicode|None policy:
+        One of:
+            * "full": keep the traceback as is;
+            * "clear_locals": keep the frames, clearing their locals;
+            * "summary": drop the traceback, keeping a summary of filename,
+              line and function with the exception's context (see `reraise`).
+        Defaults to the "traceback_retention" setting.
+
+    :return Exception:
+        The exception to store, which can be a new instance when the
+        exception's own message is used to show the context (see
+        `_annotate_args`).
+    """
+    if policy is None:
+        policy = settings.traceback_retention
+    if policy not in POLICIES:
+        raise ValueError('Unknown traceback retention: {!r}'.format(policy))
+    if policy == FULL or six.PY2:
+        return exception
+    return _release_traceback(exception, policy, {})
+
+
+def _release_traceback(exception, policy, released):
+    """
+    :param dict released:
+        The exceptions to store instead of the exceptions already released,
+        by their id().
+    """
+    given = exception
+    released[id(given)] = given
+    traceback = exception.__traceback__
+    if policy == CLEAR_LOCALS:
+        _clear_locals(traceback)
+    elif traceback is not None:
+        exception = _annotate(exception, None, '\n', ())
+        _add_frames(exception, _summarize(traceback))
+        exception.__traceback__ = None
+    released[id(given)] = exception
+
+    for attribute in ('__cause__', '__context__'):
+        chained = getattr(exception, attribute)
+        if chained is None:
+            continue
+        result = released.get(id(chained))
+        if result is None:
+            result = _release_traceback(chained, policy, released)
+        setattr(exception, attribute, result)
+    return exception
+
+
+_BACKENDS = {
+    'args': _annotate_args,
+    'notes': _annotate_notes,
+}
+
+
+def _default_backend():
+    """
+    Obtains the name of the backend used by `reraise`.
+
+    Uses "notes" when the interpreter supports PEP 678 and "args" otherwise.
+    Can be overridden with the ZEROTK_RERAISEIT_BACKEND environment variable.
+    """
+    import os
+
+    name = os.environ.get('ZEROTK_RERAISEIT_BACKEND')
+    if name in _BACKENDS:
+        return name
+    if hasattr(BaseException, 'add_note'):
+        return 'notes'
+    return 'args'
+
+
+def exception_to_unicode(exception, limit=None):
     """
     Obtains unicode representation of an Exception.
 
@@ -97,29 +476,35 @@ def exception_to_unicode(exception):
 
     :param Exception exception:
 
+    :param int|None limit:
+        Maximum number of characters kept from the message: see `_truncate`.
+        In Python 2, bytes messages are truncated before being decoded.
+
     :return unicode:
         Unicode representation of an Exception.
     """
     if six.PY2:
         try:
             # First, try to obtain __unicode__ as defined by the Exception
-            return six.text_type(exception)
+            return _truncate(six.text_type(exception), limit)
         except UnicodeDecodeError:
+            # Obtain the bytes only once: the message can be huge.
+            message = bytes(exception)
             try:
                 # If that fails, try decoding with utf-8 which is the strictest
                 # and will complain loudly.
-                return bytes(exception).decode('utf-8')
+                return _decode(message, 'utf-8', 'strict', limit)
             except UnicodeDecodeError:
                 try:
                     # If that fails, try obtaining bytes repr and decoding with
                     # locale
-                    return bytes(exception).decode(
-                        locale.getpreferredencoding()
+                    return _decode(
+                        message, locale.getpreferredencoding(), 'strict', limit
                     )
                 except UnicodeDecodeError:
                     # If all failed, give up and decode with ascii replacing
                     # errors.
-                    return bytes(exception).decode(errors='replace')
+                    return _decode(message, 'ascii', 'replace', limit)
         except UnicodeEncodeError:
             # Some exception contain unicode messages, but try to convert them
             # to bytes when calling unicode() (such as IOError). In these
@@ -129,116 +514,270 @@ def exception_to_unicode(exception):
             # This should be true if code got here:
             assert type(exception.message) == six.text_type
 
-            return exception.message
+            return _truncate(exception.message, limit)
     else:
-        return str(exception)
+        return _truncate(str(exception), limit)
+
+
+def _decode(message, encoding, errors, limit):
+    """
+    Decodes bytes, only decoding the beginning and the end kept when the
+    message is longer than `limit`.
+
+    :param bytes message:
+    :param unicode encoding:
+    :param unicode errors:
+    :param int|None limit:
+
+    :return unicode:
+    """
+    if limit is None or len(message) <= limit:
+        return message.decode(encoding, errors)
+
+    head, tail = _split_limit(limit)
+    # An incremental decoder keeps (and here drops) a multi-byte character
+    # cut at the end of the beginning...
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    head_text = decoder.decode(message[:head], False)
+    # ... while a character cut at the start of the end is skipped.
+    tail_message = message[len(message) - tail:]
+    for skip in range(3):
+        try:
+            tail_text = tail_message[skip:].decode(encoding, errors)
+            break
+        except UnicodeDecodeError as e:
+            if e.start != 0:
+                raise
+    else:
+        tail_text = tail_message[3:].decode(encoding, errors)
+    return _elided(head_text, len(message) - limit, 'bytes', tail_text)
 
 
 # =============================================================================
-# SPECIAL_EXCEPTIONS
+# Reraised classes
 # =============================================================================
-# [[[cog
-# SPECIAL_EXCEPTIONS = [
-#     KeyError,
-#     OSError,
-#     IOError,
-#     SyntaxError,
-#     UnicodeDecodeError,
-#     UnicodeEncodeError,
-# ]
-# from ben10.foundation.string import Dedent
-# exception_map = []
-# for exception_class in SPECIAL_EXCEPTIONS:
-#     superclass_name = exception_class.__name__
-#     mapping_str = \
-#         '\n        ' + superclass_name + \
-#         ': Reraised' + superclass_name + ','
-#     if mapping_str in exception_map:
-#         continue
-#     exception_map.append(mapping_str)
-#     cog.out(Dedent(
-#         '''
-#
-#         class Reraised%(superclass_name)s(%(superclass_name)s):
-#             def __init__(self, *args):
-#                 %(superclass_name)s.__init__(self, *args)
-#                 self.message = None
-#
-#             def __str__(self):
-#                 return self.message
-#
-#
-#         '''% locals()
-#     ))
-# cog.out(Dedent(
-#     '''
-#     _SPECIAL_EXCEPTION_MAP = {%s
-#     }
-#     ''' % ''.join(exception_map)
-# ))
-# ]]]
-
-class ReraisedKeyError(KeyError):
-    def __init__(self, *args):
-        KeyError.__init__(self, *args)
-        self.message = None
-
-    def __str__(self):
-        return self.message
-
-
-class ReraisedOSError(OSError):
-    def __init__(self, *args):
-        OSError.__init__(self, *args)
-        self.message = None
-
-    def __str__(self):
-        return self.message
-
-
-class ReraisedSyntaxError(SyntaxError):
-    def __init__(self, *args):
-        SyntaxError.__init__(self, *args)
-        self.message = None
-
-    def __str__(self):
-        return self.message
-
-
-class ReraisedUnicodeDecodeError(UnicodeDecodeError):
-    def __init__(self, *args):
-        UnicodeDecodeError.__init__(self, *args)
-        self.message = None
-
-    def __str__(self):
-        return self.message
-
-
-class ReraisedUnicodeEncodeError(UnicodeEncodeError):
-    def __init__(self, *args):
-        UnicodeEncodeError.__init__(self, *args)
-        self.message = None
-
-    def __str__(self):
-        return self.message
-
-_SPECIAL_EXCEPTION_MAP = {
-    KeyError: ReraisedKeyError,
-    OSError: ReraisedOSError,
-    SyntaxError: ReraisedSyntaxError,
-    UnicodeDecodeError: ReraisedUnicodeDecodeError,
-    UnicodeEncodeError: ReraisedUnicodeEncodeError,
-}
-# [[[end]]]
 
+_BUILTIN_MODULES = frozenset(['builtins', 'exceptions', '__builtin__'])
+
+# Held while creating a wrapper class, so each class gets a single one.
+_REGISTRY_LOCK = threading.Lock()
+
+# Attribute of an exception class keeping its wrapper, which then lives as
+# long as the class itself: both reference each other and are collected
+# together.
+_WRAPPER_ATTRIBUTE = '_reraised_wrapper'
+
+# Wrappers of the classes that can't keep them as an attribute: the
+# interpreter's own exceptions (and those of extension modules), which are
+# never unloaded. Read-mostly: never changed in place, but replaced by a
+# changed copy (under _REGISTRY_LOCK), so lookups never lock nor contend with
+# each other, including on free-threaded builds.
+_STATIC_RERAISED_CLASSES = {}
+
+_SLOT_WRAPPER_TYPE = type(BaseException.__init__)
+
+
+def _reraised_class(exception_class):
+    """
+    Obtains the Reraised* subclass used to reraise instances of the given
+    class, creating it on first use.
+
+    :param type exception_class:
+
+    :return type:
+        The wrapper class or None if the given class can't be subclassed.
+    """
+    result = _registered_reraised_class(exception_class)
+    if result is None:
+        result = _register_reraised_class(exception_class)
+    return result
+
+
+def _registered_reraised_class(exception_class):
+    # Looked up in the class' own "__dict__": subclasses inherit the
+    # attribute, but need their own wrapper.
+    result = exception_class.__dict__.get(_WRAPPER_ATTRIBUTE)
+    if result is None:
+        result = _STATIC_RERAISED_CLASSES.get(exception_class)
+    return result
+
+
+def _register_reraised_class(exception_class):
+    global _STATIC_RERAISED_CLASSES
+
+    with _REGISTRY_LOCK:
+        # Another thread may have registered it meanwhile.
+        result = _registered_reraised_class(exception_class)
+        if result is not None:
+            return result
+        try:
+            result = _create_reraised_class(exception_class)
+        except Exception:
+            return None
+
+        try:
+            # Not through the metaclass, which may define "__setattr__".
+            type.__setattr__(exception_class, _WRAPPER_ATTRIBUTE, result)
+        except TypeError:
+            # Immutable types.
+            registry = dict(_STATIC_RERAISED_CLASSES)
+            registry[exception_class] = result
+            _STATIC_RERAISED_CLASSES = registry
+    return result
+
+
+def _create_reraised_class(exception_class):
+    """
+    Creates the Reraised* subclass of an exception class.
+
+    The "__init_subclass__" hooks of its bases (used by registries of
+    plugins, error codes, ...) are not called. The metaclass, when it is not
+    `type`, is called as for any subclass: registries kept by metaclasses
+    see the new class, which can be told apart by its "_reraised_base"
+    attribute.
+
+    The new class has the same name (and module) as `exception_class`, so
+    tracebacks and logs show the original type name.
+    """
+    namespace = {
+        '__module__': exception_class.__module__,
+        '__qualname__': getattr(
+            exception_class, '__qualname__', exception_class.__name__
+        ),
+        '__str__': _reraised_str,
+        '__reduce__': _reraised_reduce,
+        '_reraised_base': exception_class,
+    }
+    if BaseExceptionGroup is not None and issubclass(
+        exception_class, BaseExceptionGroup
+    ):
+        namespace['derive'] = _reraised_derive
+    name = str(exception_class.__name__)
+    metaclass = type(exception_class)
+    builtin = exception_class.__module__ in _BUILTIN_MODULES
+    if metaclass is type and not builtin:
+        result = _create_unhooked_subclass(name, exception_class, namespace)
+        if result is not None:
+            return result
+    return metaclass(name, (exception_class,), namespace)
+
+
+def _create_unhooked_subclass(name, exception_class, namespace):
+    """
+    Creates a subclass without calling the "__init_subclass__" hooks of its
+    bases: it is created as a subclass of the builtin exception class below
+    them and then moved under `exception_class`.
+
+    :return type|None:
+        None if the class can't be moved, when its layout differs from
+        `exception_class` (which defines "__slots__", for instance).
+    """
+    builtin_class = next(
+        base for base in exception_class.__mro__
+        if base.__module__ in _BUILTIN_MODULES
+    )
+    # Has the same layout as a subclass of `builtin_class` without slots.
+    placeholder = type(str('_Placeholder'), (builtin_class,), {})
+    result = type(name, (placeholder,), namespace)
+    try:
+        result.__bases__ = (exception_class,)
+    except TypeError:
+        return None
+    return result
+
+
+def _reraised_copy(exception, reraised_class):
+    """
+    Creates an instance of `reraised_class` with the same state as the given
+    exception.
+
+    :return Exception:
+        The new instance or None if it can't be created.
+    """
+    try:
+        if isinstance(exception.__class__.__init__, _SLOT_WRAPPER_TYPE):
+            # Built-in exceptions know how to reduce themselves to the
+            # arguments needed to recreate them (for instance, OSError
+            # includes the "filename").
+            base = reraised_class._reraised_base
+            result = reraised_class(*base.__reduce__(exception)[1])
+        else:
+            # Don't call Python defined __init__: its parameters usually
+            # don't match "args" and the state is copied below anyway.
+            result = reraised_class.__new__(reraised_class, *exception.args)
+        result.__dict__.update(exception.__dict__)
+    except Exception:
+        return None
+
+    if six.PY3:
+        # The new instance replaces the original one: it keeps its chain.
+        result.__cause__ = exception.__cause__
+        result.__context__ = exception.__context__
+        result.__suppress_context__ = exception.__suppress_context__
+    return result
+
+
+def _reraised_str(self):
+    context = self.__dict__.get('reraised_message')
+    if context is None or getattr(context, 'original', '') is None:
+        # Not annotated yet, or annotated with notes (see `_overlay`).
+        return self._reraised_base.__str__(self)
+    return six.text_type(context)
+
+
+def _reraised_reduce(self):
+    reduced = self._reraised_base.__reduce__(self)
+    return (
+        (_reraised_instance, (self._reraised_base, reduced[1])) +
+        tuple(reduced[2:])
+    )
+
+
+def _reraised_derive(self, exceptions):
+    """
+    Keeps the context of exception groups in the groups created by "split()"
+    and "subgroup()".
+    """
+    derived = self._reraised_base.derive(self, exceptions)
+    context = self.__dict__.get('reraised_message')
+    if not isinstance(context, _ReraiseContext):
+        return derived
+    reraised_class = _reraised_class(type(derived))
+    result = None
+    if reraised_class is not None:
+        result = _reraised_copy(derived, reraised_class)
+    if result is None:
+        return derived
+    # Each group gets its own copy, so they can be reraised independently.
+    result.reraised_message = context.copy()
+    return result
+
+
+def _reraised_instance(exception_class, args):
+    """
+    Recreates a reraised exception when unpickling.
+
+    As in `_reraised_copy`, Python defined "__init__" is not called: its
+    parameters usually don't match "args" (which would make the exception
+    impossible to unpickle) and the state is restored by pickle anyway.
+    """
+    reraised_class = _reraised_class(exception_class)
+    if reraised_class is None:
+        return exception_class(*args)
+    if isinstance(exception_class.__init__, _SLOT_WRAPPER_TYPE):
+        return reraised_class(*args)
+    return reraised_class.__new__(reraised_class, *args)
+
+
+# Kept so these names can still be imported and unpickled.
+ReraisedKeyError = _reraised_class(KeyError)
+ReraisedOSError = _reraised_class(OSError)
+ReraisedSyntaxError = _reraised_class(SyntaxError)
+ReraisedUnicodeDecodeError = _reraised_class(UnicodeDecodeError)
+ReraisedUnicodeEncodeError = _reraised_class(UnicodeEncodeError)
 
 if six.PY3:
-    class ReraisedFileNotFoundError(FileNotFoundError):
-        def __init__(self, *args):
-            FileNotFoundError.__init__(self, *args)
-            self.message = None
+    ReraisedFileNotFoundError = _reraised_class(FileNotFoundError)
 
-        def __str__(self):
-            return self.message
 
-    _SPECIAL_EXCEPTION_MAP[FileNotFoundError] = ReraisedFileNotFoundError
+_annotate = _BACKENDS[_default_backend()]
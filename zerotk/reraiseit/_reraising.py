@@ -0,0 +1,498 @@
+from __future__ import unicode_literals
+"""
+    Context manager and decorator to reraise exceptions with a message.
+"""
+import functools
+import inspect
+import sys
+
+import six
+
+from ._ambient import take_pending_message
+from ._context import _format_message, _truncate
+from ._reraiseit import reraise, shared
+
+if sys.version_info >= (3, 5):
+    from . import _async
+
+
+class reraising(object):
+    """
+    Reraises exceptions raised inside a block (or a decorated function) with
+    an additional message.
+
+    Nothing is done when no exception is raised and the message is only
+    formatted when shown (see `reraise`), so the same instance can be reused
+    (and shared between threads) at no cost.
+
+    :param unicode|callable message:
+        Message to be added to the exception. When `args` are given, it is
+        formatted with the "%" operator. A callable is called without
+        arguments to obtain the message.
+
+    :param args:
+        Arguments to format the message.
+
+    :param unicode separator:
+        See `reraise`.
+
+    :param unicode|callable member_message:
+        See `reraise`.
+
+    :param dict fields:
+        Structured context: see `reraise`.
+
+    :param bool shared:
+        If True, exceptions are reraised as `shared`: a copy is annotated
+        instead of the exception raised in the block.
+
+    Also works as an asynchronous context manager, decorates coroutine
+    functions and wraps awaitables (see `wrap`), annotating exceptions that
+    cross "await" (including the ones coming from other tasks through
+    `asyncio.gather` or task groups).
+
+    e.g.
+        with reraising('While loading %s', filename):
+            load(filename)
+
+        with reraising('While loading shard', fields={'shard': shard}):
+            load_shard(shard)
+
+        @reraising('While loading configuration')
+        def load_configuration():
+            ...
+
+        async with reraising('While fetching shards'):
+            await asyncio.gather(
+                reraising('While fetching shard %d', 17).wrap(fetch(17)),
+                reraising('While fetching shard %d', 18).wrap(fetch(18)),
+            )
+    """
+
+    __slots__ = (
+        'message',
+        'args',
+        'separator',
+        'member_message',
+        'fields',
+        'shared',
+    )
+
+    def __init__(self, message, *args, **kwargs):
+        self.message = message
+        self.args = args
+        self.separator = kwargs.pop('separator', '\n')
+        self.member_message = kwargs.pop('member_message', None)
+        self.fields = kwargs.pop('fields', None)
+        self.shared = kwargs.pop('shared', False)
+        if kwargs:
+            raise TypeError(
+                'Unexpected keyword arguments: {}'.format(
+                    ', '.join(sorted(kwargs))
+                )
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None or not issubclass(exception_type, Exception):
+            return False
+        if exception is None:
+            exception = exception_type()
+        self.reraise(exception)
+
+    def __aenter__(self):
+        return _async.enter(self)
+
+    def __aexit__(self, exception_type, exception, traceback):
+        return _async.exit(self, exception_type, exception, traceback)
+
+    def __call__(self, function):
+        if _is_coroutine_function(function):
+            return _async.wrap_coroutine_function(self, function)
+
+        # Not using "with self" avoids calling __enter__/__exit__: the only
+        # overhead is the wrapper's frame.
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                self.reraise(e)
+
+        return wrapper
+
+    def wrap(self, awaitable):
+        """
+        :param awaitable awaitable:
+
+        :return coroutine:
+            Awaits the given awaitable, reraising its exceptions with this
+            message. Useful to give context to each awaitable passed to
+            `asyncio.gather` or started as a task.
+        """
+        return _async.wrap_awaitable(self, awaitable)
+
+    def reraise(self, exception):
+        """
+        Reraises the given exception with this message. See `reraise`.
+        """
+        reraise(
+            shared(exception) if self.shared else exception,
+            self.message,
+            self.separator,
+            self.args,
+            self.member_message,
+            self.fields,
+        )
+
+
+class context_boundary(reraising):
+    """
+    Attaches the ambient context (see `push_context`) to exceptions leaving a
+    block (or a decorated function).
+
+    Exceptions that escaped no `push_context` block inside the boundary are
+    reraised unchanged. Supports the same uses as `reraising`.
+
+    e.g.
+        @context_boundary()
+        async def handle(request):
+            with push_context('While handling request %s', request.id):
+                ...
+    """
+
+    __slots__ = ()
+
+    def __init__(self):
+        reraising.__init__(self, None)
+
+    def reraise(self, exception):
+        message = take_pending_message(exception)
+        if message is None:
+            six.reraise(type(exception), exception, sys.exc_info()[-1])
+        reraise(exception, message)
+
+
+class reraise_iter(object):
+    """
+    Iterates over an iterable, reraising the exceptions raised while
+    iterating with a message describing the current item.
+
+    Only the position and the current item are kept while iterating: the
+    message is obtained by calling `describe(index, item)` when it is shown
+    (see `reraise`), so items that don't fail cost nothing but the
+    iteration.
+
+    Exceptions raised by the iterable itself (a generator failing to
+    produce an item) are always annotated, with the position of the item it
+    failed to produce and None as `item`. Exceptions raised by the code
+    consuming the items are annotated when it runs inside the `with` block.
+
+    Also works with asynchronous iterables, with "async for" and
+    "async with".
+
+    :param iterable iterable:
+
+    :param callable describe:
+        Receives the position of the item (from 0) and the item, returning
+        the message.
+
+    :param unicode separator:
+        See `reraise`.
+
+    e.g.
+        with reraise_iter(read_records(f), describe_record) as records:
+            for record in records:
+                store(record)
+
+        async with reraise_iter(fetch_all(), describe_record) as records:
+            async for record in records:
+                await store(record)
+    """
+
+    __slots__ = (
+        'iterable', 'describe', 'separator', '_index', '_item', '_stopped_at'
+    )
+
+    def __init__(self, iterable, describe, separator='\n'):
+        self.iterable = iterable
+        self.describe = describe
+        self.separator = separator
+        # The position and item being consumed, None when not iterating.
+        self._index = None
+        self._item = None
+        # See `_stop`.
+        self._stopped_at = None
+
+    def __iter__(self):
+        self._index = -1
+        self._stopped_at = None
+        try:
+            for index, item in enumerate(self.iterable):
+                self._index = index
+                self._item = item
+                yield item
+        except GeneratorExit:
+            self._stop(1)
+            raise
+        except Exception as e:
+            self._fail(e)
+        self._index = None
+        self._item = None
+
+    def __aiter__(self):
+        return _async.AsyncIterator(self, self.iterable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        index = self._index
+        item = self._item
+        stopped_at = self._stopped_at
+        self._index = None
+        self._item = None
+        self._stopped_at = None
+        if (
+            exception_type is None or
+            not issubclass(exception_type, Exception) or
+            index is None or
+            index < 0 or
+            (stopped_at is not None and not _raised_at(traceback, stopped_at))
+        ):
+            return False
+        if exception is None:
+            exception = exception_type()
+        self._reraise(exception, index, item)
+
+    def __aenter__(self):
+        return _async.enter(self)
+
+    def __aexit__(self, exception_type, exception, traceback):
+        return _async.exit(self, exception_type, exception, traceback)
+
+    def _stop(self, depth):
+        """
+        Called when the consumer stops iterating before the end: by leaving
+        the loop ("break", "return", ...) or because an exception was raised
+        while consuming an item. Both unwind the loop (and so stop the
+        iteration) before `__exit__` is called, so the instruction being
+        executed is kept: only an exception raised there was raised while
+        consuming the current item.
+
+        Iterators are released by the consumer's loop when it stops, which
+        is only detected when they are released right away (by reference
+        counting). Iterators released later, by the garbage collector or
+        while a coroutine is torn down, have no consumer frame and are not
+        considered stopped.
+
+        :param int depth:
+            How many frames the consumer's frame is above the caller's.
+        """
+        if self._index is None:
+            return
+        try:
+            frame = sys._getframe(depth + 1)
+        except ValueError:
+            # No Python frame is running.
+            return
+        self._stopped_at = (frame, frame.f_lasti)
+
+    def _fail(self, exception):
+        """
+        Reraises an exception raised by the iterable, producing the item
+        after the current one.
+        """
+        self._reraise(exception, self._index + 1, None)
+
+    def _reraise(self, exception, index, item):
+        """
+        Reraises the given exception with the message describing the item,
+        ending the iteration.
+        """
+        self._index = None
+        self._item = None
+        reraise(
+            exception,
+            functools.partial(self.describe, index, item),
+            self.separator,
+        )
+
+
+def _raised_at(traceback, instruction):
+    """
+    :param tuple(frame,int) instruction:
+        A frame and the position of an instruction in its code.
+
+    :return bool:
+        True if the traceback passes through that instruction.
+    """
+    frame, lasti = instruction
+    while traceback is not None:
+        if traceback.tb_frame is frame:
+            return traceback.tb_lasti == lasti
+        traceback = traceback.tb_next
+    return False
+
+
+class reraising_call(object):
+    """
+    Decorator reraising the exceptions of a function with a message showing
+    the call, as "While calling load(shard=17, path='/data/17.bin')".
+
+    Nothing but the call is done when no exception is raised. The message is
+    only rendered when shown (see `reraise`): the arguments are then bound
+    to the function's signature, obtained once per decorated function.
+
+    Also decorates coroutine functions.
+
+    :param iterable(unicode)|None include:
+        The names of the arguments shown, all when None.
+
+    :param iterable(unicode)|None exclude:
+        The names of the arguments hidden (passwords, tokens, ...), shown as
+        "<hidden>".
+
+    :param int|None max_repr:
+        Maximum number of characters of the representation of each argument.
+
+    e.g.
+        @reraising_call(exclude=['password'])
+        def connect(host, port=5432, password=None):
+            ...
+
+        > While calling connect('db', port=5433, password=<hidden>)
+    """
+
+    __slots__ = ('include', 'exclude', 'max_repr')
+
+    def __init__(self, include=None, exclude=None, max_repr=80):
+        self.include = None if include is None else frozenset(include)
+        self.exclude = frozenset(exclude or ())
+        self.max_repr = max_repr
+
+    def __call__(self, function):
+        call = _Call(self, function)
+        if _is_coroutine_function(function):
+            return _async.wrap_call_coroutine_function(call, function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                call.reraise(e, args, kwargs)
+
+        return wrapper
+
+
+class _Call(object):
+    """
+    A function decorated by `reraising_call`, with its signature (obtained
+    on the first failure).
+    """
+
+    __slots__ = ('options', 'function', '_signature')
+
+    def __init__(self, options, function):
+        self.options = options
+        self.function = function
+        self._signature = None
+
+    def reraise(self, exception, args, kwargs):
+        reraise(exception, _CallMessage(self, args, kwargs))
+
+    def signature(self):
+        """
+        :return inspect.Signature|None:
+            None if not available (Python 2, some builtins).
+        """
+        if self._signature is None:
+            try:
+                self._signature = inspect.signature(self.function)
+            except (AttributeError, TypeError, ValueError):
+                self._signature = False
+        return self._signature or None
+
+    def render(self, args, kwargs):
+        """
+        :return unicode:
+            The message showing the call with the given arguments.
+        """
+        # (name, value, keyword): the name is None for the arguments that
+        # couldn't be bound.
+        arguments = []
+        signature = self.signature()
+        bound = None
+        if signature is not None:
+            try:
+                bound = signature.bind(*args, **kwargs)
+            except TypeError:
+                # The call didn't match the signature.
+                pass
+        if bound is None:
+            arguments.extend((None, value, False) for value in args)
+            arguments.extend(
+                (name, value, True) for name, value in sorted(kwargs.items())
+            )
+        else:
+            for name, value in bound.arguments.items():
+                kind = signature.parameters[name].kind
+                if kind == inspect.Parameter.VAR_POSITIONAL:
+                    arguments.extend((name, item, False) for item in value)
+                elif kind == inspect.Parameter.VAR_KEYWORD:
+                    arguments.extend(
+                        (key, item, True) for key, item in value.items()
+                    )
+                else:
+                    arguments.append(
+                        (
+                            name,
+                            value,
+                            kind != inspect.Parameter.POSITIONAL_ONLY,
+                        )
+                    )
+
+        options = self.options
+        rendered = []
+        for name, value, keyword in arguments:
+            if options.include is not None and name not in options.include:
+                continue
+            if name in options.exclude:
+                value = '<hidden>'
+            else:
+                value = _truncate(
+                    _format_message('%r', (value,)), options.max_repr
+                )
+            rendered.append('{}={}'.format(name, value) if keyword else value)
+        return 'While calling {}({})'.format(
+            getattr(self.function, '__qualname__', self.function.__name__),
+            ', '.join(rendered),
+        )
+
+
+class _CallMessage(object):
+    """
+    A callable message (see `reraise`) rendering a call of a function
+    decorated by `reraising_call`.
+    """
+
+    __slots__ = ('call', 'args', 'kwargs')
+
+    def __init__(self, call, args, kwargs):
+        self.call = call
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self):
+        return self.call.render(self.args, self.kwargs)
+
+
+def _is_coroutine_function(function):
+    is_coroutine_function = getattr(inspect, 'iscoroutinefunction', None)
+    return (
+        is_coroutine_function is not None and
+        is_coroutine_function(function)
+    )
@@ -0,0 +1,59 @@
+from __future__ import unicode_literals
+"""
+    Helpers to release the frames kept by tracebacks.
+"""
+import sys
+
+FULL = 'full'
+CLEAR_LOCALS = 'clear_locals'
+SUMMARY = 'summary'
+
+POLICIES = (FULL, CLEAR_LOCALS, SUMMARY)
+
+# "tb_next" can only be changed since Python 3.7.
+CAN_DETACH_FRAMES = sys.version_info >= (3, 7)
+
+# Before Python 3.13, clearing the frame of a suspended generator (or
+# coroutine) finalizes it, instead of failing as for executing frames.
+CAN_CLEAR_SUSPENDED_FRAMES = sys.version_info >= (3, 13)
+
+# CO_GENERATOR | CO_COROUTINE | CO_ITERABLE_COROUTINE | CO_ASYNC_GENERATOR
+_GENERATOR_FLAGS = 0x20 | 0x80 | 0x100 | 0x200
+
+
+def _clear_locals(traceback):
+    """
+    Clears the locals of the frames in the traceback that finished executing.
+
+    Frames still executing are skipped and so are, before Python 3.13, all
+    frames of generators and coroutines: they can't be told apart from the
+    ones still suspended (as the frame of a generator that caught the
+    exception and yielded).
+    """
+    while traceback is not None:
+        frame = traceback.tb_frame
+        if (
+            CAN_CLEAR_SUSPENDED_FRAMES or
+            not frame.f_code.co_flags & _GENERATOR_FLAGS
+        ):
+            try:
+                frame.clear()
+            except (AttributeError, RuntimeError):
+                # Frame still executing (or suspended), or Python 2, where
+                # frames can't be cleared.
+                pass
+        traceback = traceback.tb_next
+
+
+def _summarize(traceback):
+    """
+    :return list(tuple(unicode,int,unicode)):
+        The `(filename, line number, function name)` of each entry in the
+        traceback, most recent call last.
+    """
+    result = []
+    while traceback is not None:
+        code = traceback.tb_frame.f_code
+        result.append((code.co_filename, traceback.tb_lineno, code.co_name))
+        traceback = traceback.tb_next
+    return result
@@ -0,0 +1,212 @@
+from __future__ import unicode_literals
+"""
+    Retrying calls, reraising the last failure with the history of the
+    attempts.
+"""
+import collections
+import functools
+import sys
+import time
+import timeit
+
+import six
+
+from ._formatting import _own_message
+from ._reraiseit import reraise
+from ._reraising import _is_coroutine_function
+
+if sys.version_info >= (3, 5):
+    from . import _async
+
+_timer = timeit.default_timer
+
+
+@six.python_2_unicode_compatible
+class Attempt(
+    collections.namedtuple(
+        'Attempt', ['number', 'exception_type', 'message', 'elapsed']
+    )
+):
+    """
+    A failed attempt of `retrying`: only what is needed to show it is kept,
+    not the exception (nor its traceback).
+
+    :ivar int number:
+        From 1.
+
+    :ivar type exception_type:
+
+    :ivar unicode message:
+        The exception's own message, truncated.
+
+    :ivar float elapsed:
+        Seconds spent in the attempt.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        name = getattr(
+            self.exception_type, '__qualname__', self.exception_type.__name__
+        )
+        if self.message:
+            name = '{}: {}'.format(name, self.message)
+        return '#{} {} ({:.3f}s)'.format(self.number, name, self.elapsed)
+
+
+class _AttemptHistory(object):
+    """
+    A callable message (see `reraise`) listing the failed attempts before
+    the last one.
+    """
+
+    __slots__ = ('attempts',)
+
+    def __init__(self):
+        self.attempts = []
+
+    def __call__(self):
+        count = len(self.attempts) + 1
+        lines = ['After {} attempt{}'.format(count, 's' if count > 1 else '')]
+        lines.extend('  {}'.format(attempt) for attempt in self.attempts)
+        return '\n'.join(lines)
+
+
+class retrying(object):
+    """
+    Calls a function until it succeeds, waiting between the attempts.
+
+    When all attempts fail, the last exception is reraised (see `reraise`)
+    with the list of the previous attempts: their number, exception type,
+    message (truncated) and duration. The previous exceptions and their
+    tracebacks are released as soon as they are recorded.
+
+    Also decorates (and calls) coroutine functions, waiting with
+    `asyncio.sleep`.
+
+    :param int attempts:
+        Maximum number of calls.
+
+    :param float delay:
+        Seconds to wait before the second attempt.
+
+    :param float backoff:
+        Factor applied to the delay after each attempt.
+
+    :param float|None max_delay:
+        Maximum seconds to wait between attempts.
+
+    :param type|tuple(type) exceptions:
+        The exceptions retried. Others are raised right away.
+
+    :param int message_size:
+        Maximum number of characters kept from the message of each attempt.
+
+    :param callable sleep:
+        Called with the seconds to wait (not used by coroutine functions).
+
+    e.g.
+        @retrying(attempts=5, delay=0.5, exceptions=(IOError,))
+        def fetch(url):
+            ...
+
+        data = retrying(attempts=3).call(fetch, url)
+
+        > OSError: connection reset
+        > After 3 attempts
+        >   #1 TimeoutError: timed out (5.002s)
+        >   #2 TimeoutError: timed out (5.001s)
+    """
+
+    __slots__ = (
+        'attempts',
+        'delay',
+        'backoff',
+        'max_delay',
+        'exceptions',
+        'message_size',
+        'sleep',
+    )
+
+    def __init__(
+            self,
+            attempts=3,
+            delay=0.1,
+            backoff=2.0,
+            max_delay=None,
+            exceptions=Exception,
+            message_size=80,
+            sleep=time.sleep,
+    ):
+        if attempts < 1:
+            raise ValueError('At least one attempt is required')
+        self.attempts = attempts
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.exceptions = exceptions
+        self.message_size = message_size
+        self.sleep = sleep
+
+    def __call__(self, function):
+        if _is_coroutine_function(function):
+            return _async.retry_coroutine_function(self, function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return self.call(function, *args, **kwargs)
+
+        return wrapper
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls the function until it succeeds.
+
+        :return object:
+            The function's result (a coroutine, for coroutine functions).
+        """
+        if _is_coroutine_function(function):
+            return _async.retry(
+                self, _AttemptHistory(), function, args, kwargs
+            )
+
+        history = _AttemptHistory()
+        number = 1
+        while True:
+            start = _timer()
+            try:
+                return function(*args, **kwargs)
+            except self.exceptions as e:
+                self._failed(history, number, e, start)
+            self.sleep(self._delay(number))
+            number += 1
+
+    def _failed(self, history, number, exception, start):
+        """
+        Records a failed attempt or, for the last one, reraises the
+        exception. Must be called from the "except" block.
+        """
+        if number >= self.attempts:
+            reraise(exception, history)
+        history.attempts.append(
+            Attempt(
+                number,
+                type(exception),
+                _own_message(exception, self.message_size),
+                _timer() - start,
+            )
+        )
+
+    def _delay(self, number):
+        """
+        :return float:
+            Seconds to wait after the given attempt.
+        """
+        try:
+            result = self.delay * self.backoff ** (number - 1)
+        except OverflowError:
+            # Many attempts with a backoff: way above any "max_delay".
+            result = float('inf')
+        if self.max_delay is not None:
+            result = min(result, self.max_delay)
+        return result
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+"""
+    Global settings of reraiseit.
+"""
+
+
+class _Settings(object):
+    """
+    Settings read by reraiseit when annotating and rendering exceptions.
+
+    :ivar int|None max_message_size:
+        Maximum number of characters kept from each message, including the
+        exception's original message. None for no limit.
+
+    :ivar int|None max_total_size:
+        Maximum number of characters of the rendered context. None for no
+        limit. Contexts attached as notes add one note per layer, limited by
+        "max_message_size" and "max_layers" instead.
+
+    :ivar int|None max_layers:
+        Maximum number of layers kept in the context of an exception: the
+        first and last ones are kept, replacing the others by a marker. None
+        for no limit. Consecutive repetitions of the same message are always
+        kept as a single layer.
+
+    :ivar float observer_sample_rate:
+        Fraction of the annotations reported to the observers (see
+        `add_observer`), from 0.0 to 1.0.
+
+    :ivar unicode traceback_retention:
+        What `reraise` keeps of the frames that already finished executing
+        (the ones below the handler calling it):
+            * "full": the frames, with all their locals;
+            * "clear_locals": the frames, with their locals cleared;
+            * "summary": only a summary of filename, line and function,
+              shown with the context. The frames are released.
+        See also `release_traceback`.
+    """
+
+    def __init__(self):
+        self.max_message_size = 64 * 1024
+        self.max_total_size = 1024 * 1024
+        self.max_layers = 100
+        self.traceback_retention = 'full'
+        self.observer_sample_rate = 1.0
+
+
+settings = _Settings()
+
+
+def configure(**options):
+    """
+    Changes the global settings.
+
+    :param options:
+        New values for the attributes of `_Settings`.
+
+    :return dict:
+        The previous values of the changed settings, which can be given back
+        to `configure` to restore them.
+
+    e.g.
+        previous = configure(max_message_size=1000)
+        try:
+            ...
+        finally:
+            configure(**previous)
+    """
+    unknown = set(options) - set(vars(settings))
+    if unknown:
+        raise TypeError(
+            'Unknown settings: {}'.format(', '.join(sorted(unknown)))
+        )
+    previous = {}
+    for name, value in options.items():
+        previous[name] = getattr(settings, name)
+        setattr(settings, name, value)
+    return previous
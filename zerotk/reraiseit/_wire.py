@@ -0,0 +1,269 @@
+from __future__ import unicode_literals
+"""
+    Compact serialization of annotated exceptions, to ship them to another
+    process (a log collector, ...) without formatting their tracebacks.
+"""
+import collections
+import io
+import json
+import struct
+
+import six
+
+from ._context import _ReraiseContext, _format_message, _portable_fields
+from ._formatting import _messages, _own_message, _type_name
+from ._retention import _summarize
+
+# Written before the first record of a stream.
+_MAGIC = b'RRW1'
+
+# Length of each record.
+_LENGTH = struct.Struct('>I')
+
+
+class ExceptionRecord(
+    collections.namedtuple(
+        'ExceptionRecord',
+        ['type_name', 'original', 'messages', 'fields', 'frames'],
+    )
+):
+    """
+    An exception read by `ExceptionReader`.
+
+    :ivar unicode type_name:
+        The name of the exception type, with its module unless it is a
+        builtin.
+
+    :ivar unicode original:
+        The exception's own message.
+
+    :ivar list(unicode) messages:
+        The messages added by `reraise`, outermost first.
+
+    :ivar dict fields:
+        The fields given to `reraise` (see `get_context`), with values other
+        than numbers, strings, booleans and None as text.
+
+    :ivar list(tuple(unicode,int,unicode)) frames:
+        The `(filename, line number, function name)` of the traceback, most
+        recent call last.
+    """
+
+    __slots__ = ()
+
+    def format(self):
+        """
+        :return unicode:
+            The exception as shown by `format_exception` without source
+            lines.
+        """
+        lines = []
+        if self.frames:
+            lines.append('Traceback (most recent call last):\n')
+            for filename, lineno, name in self.frames:
+                lines.append(
+                    '  File "{}", line {}, in {}\n'.format(
+                        filename, lineno, name
+                    )
+                )
+        for message in self.messages:
+            lines.append(message + '\n')
+        if self.original:
+            lines.append('{}: {}\n'.format(self.type_name, self.original))
+        else:
+            lines.append(self.type_name + '\n')
+        return ''.join(lines)
+
+
+class ExceptionWriter(object):
+    """
+    Writes exceptions to a binary stream, with their type, message, context
+    chain (see `reraise`), fields and traceback (only the filename, line and
+    function of each frame), but without formatting their tracebacks.
+
+    Each record is a length prefixed compact JSON document. Type names,
+    filenames and function names are written once per stream and referred
+    to by index after that: use one writer per batch, since every name
+    written is kept until the writer is discarded.
+
+    The exceptions are not changed and no reference to them is kept.
+
+    :param stream:
+        A binary file-like object.
+
+    e.g.
+        writer = ExceptionWriter(socket.makefile('wb'))
+        for exception in failures:
+            writer.write(exception)
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._strings = {}
+
+    def write(self, exception):
+        """
+        :param BaseException exception:
+        """
+        first = not self._strings
+        payload = self._encode(exception)
+        if first:
+            # Every record adds at least its type name.
+            self._stream.write(_MAGIC)
+        self._stream.write(_LENGTH.pack(len(payload)) + payload)
+
+    def _encode(self, exception):
+        # Only kept once the record is encoded: the reader never gets the
+        # strings of a record that failed.
+        new_indexes = {}
+        new_strings = []
+
+        def intern(string):
+            index = self._strings.get(string)
+            if index is None:
+                index = new_indexes.get(string)
+                if index is None:
+                    index = new_indexes[string] = (
+                        len(self._strings) + len(new_strings)
+                    )
+                    new_strings.append(string)
+            return index
+
+        type_index = intern(_type_name(type(exception)))
+        context = exception.__dict__.get('reraised_message')
+        if not isinstance(context, _ReraiseContext):
+            context = None
+
+        frames = _summarize(getattr(exception, '__traceback__', None))
+        if context is not None and context._frame_chunks:
+            frames.extend(context.frames())
+        flat_frames = []
+        for filename, lineno, name in frames:
+            flat_frames.append(intern(filename))
+            flat_frames.append(lineno)
+            flat_frames.append(intern(name))
+
+        original = _own_message(exception)
+        fields = _portable_fields(context.fields()) if context else None
+
+        text = json.dumps(
+            [
+                new_strings,
+                type_index,
+                original,
+                _messages(exception),
+                fields or {},
+                flat_frames,
+            ],
+            separators=(',', ':'),
+            ensure_ascii=False,
+            default=_as_text,
+        )
+        if isinstance(text, six.text_type):
+            text = text.encode('utf-8')
+        self._strings.update(new_indexes)
+        return text
+
+
+class ExceptionReader(object):
+    """
+    Reads the exceptions written by `ExceptionWriter`, as `ExceptionRecord`.
+
+    :param stream:
+        A binary file-like object.
+
+    e.g.
+        for record in ExceptionReader(connection.makefile('rb')):
+            store(record.type_name, record.fields, record.format())
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._strings = None
+
+    def __iter__(self):
+        while True:
+            record = self.read()
+            if record is None:
+                return
+            yield record
+
+    def read(self):
+        """
+        :return ExceptionRecord|None:
+            The next record, None at the end of the stream.
+
+        :raises ValueError:
+            If the stream was not written by `ExceptionWriter` or is
+            truncated.
+        """
+        if self._strings is None:
+            magic = self._stream.read(len(_MAGIC))
+            if not magic:
+                return None
+            if magic != _MAGIC:
+                raise ValueError('Not a stream of exceptions')
+            self._strings = []
+
+        header = self._stream.read(_LENGTH.size)
+        if not header:
+            return None
+        if len(header) != _LENGTH.size:
+            raise ValueError('Truncated record')
+        (length,) = _LENGTH.unpack(header)
+        payload = self._stream.read(length)
+        if len(payload) != length:
+            raise ValueError('Truncated record')
+
+        (
+            new_strings,
+            type_index,
+            original,
+            messages,
+            fields,
+            flat_frames,
+        ) = json.loads(payload.decode('utf-8'))
+        strings = self._strings
+        strings.extend(new_strings)
+        return ExceptionRecord(
+            strings[type_index],
+            original,
+            messages,
+            fields,
+            [
+                (strings[flat_frames[i]], flat_frames[i + 1],
+                 strings[flat_frames[i + 2]])
+                for i in range(0, len(flat_frames), 3)
+            ],
+        )
+
+
+def dumps_exceptions(exceptions):
+    """
+    :param iterable(BaseException) exceptions:
+
+    :return bytes:
+        The exceptions written by an `ExceptionWriter`.
+    """
+    stream = io.BytesIO()
+    writer = ExceptionWriter(stream)
+    for exception in exceptions:
+        writer.write(exception)
+    return stream.getvalue()
+
+
+def loads_exceptions(data):
+    """
+    :param bytes data:
+        Written by `dumps_exceptions` (or an `ExceptionWriter`).
+
+    :return list(ExceptionRecord):
+    """
+    return list(ExceptionReader(io.BytesIO(data)))
+
+
+def _as_text(value):
+    """
+    Converts the values json can't write.
+    """
+    return _format_message('%s', (value,))